@@ -0,0 +1,100 @@
+"""
+Microbenchmark: title matchers vs. the original difflib scorer.
+
+Run from the repository root:
+    python -m benchmarks.bench_title_matcher [--queries 500] [--candidates 10]
+
+Reports time per query for each matcher, how often it picks the same candidate
+and makes the same accept/reject decision as difflib (each matcher at its own
+threshold), and its accept rates on two workloads: one where the true title is
+among the candidates (true accepts) and one where it is not (false accepts).
+"""
+import argparse
+import random
+import time
+
+from title_matcher import MATCHERS
+
+SAMPLE_TITLES = [
+    "The Joe Rogan Experience", "Crime Junkie", "The Daily", "Call Her Daddy",
+    "This Past Weekend w/ Theo Von", "SmartLess", "Huberman Lab", "Dateline NBC",
+    "Morbid", "Stuff You Should Know", "The Mel Robbins Podcast", "Rotten Mango",
+    "Mel Robbins", "The Megyn Kelly Show", "New Heights with Jason and Travis Kelce",
+    "Conan O'Brien Needs A Friend", "Shawn Ryan Show", "The Tucker Carlson Show",
+    "Armchair Expert with Dax Shepard", "Pod Save America", "Serial",
+    "Lex Fridman Podcast", "The Diary Of A CEO with Steven Bartlett", "48 Hours",
+    "Candace", "The Ben Shapiro Show", "Up First", "Freakonomics Radio",
+    "Last Podcast On The Left", "My Favorite Murder with Karen Kilgariff and Georgia Hardstark",
+    "Hidden Brain", "Radiolab", "99% Invisible", "This American Life",
+    "Planet Money", "The Bill Simmons Podcast", "Pardon My Take", "Mick Unplugged",
+    "The Rest Is History", "Rotten Tomatoes Is Wrong", "Behind the Bastards",
+]
+
+def perturb(title, rng):
+    """Returns a chart-style variant of a title (suffixes, dropped articles, typos)."""
+    variant = title
+    roll = rng.random()
+    if roll < 0.25:
+        variant = variant + rng.choice([" Podcast", " (Audio)", " - Official", ": Uncut"])
+    elif roll < 0.45 and variant.lower().startswith("the "):
+        variant = variant[4:]
+    elif roll < 0.65:
+        i = rng.randrange(len(variant))
+        variant = variant[:i] + variant[i + 1:]
+    return variant
+
+def build_workload(n_queries, n_candidates, seed, with_target=True):
+    """
+    Builds (query, candidates) pairs. With `with_target`, one candidate is a
+    variant of the query's title; without it, every candidate is another show,
+    so any accepted match is a false accept.
+    """
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(n_queries):
+        target = rng.choice(SAMPLE_TITLES)
+        others = [title for title in SAMPLE_TITLES if title != target]
+        candidates = [perturb(rng.choice(others), rng) for _ in range(n_candidates - 1)]
+        candidates.append(perturb(target if with_target else rng.choice(others), rng))
+        rng.shuffle(candidates)
+        workload.append((perturb(target, rng), candidates))
+    return workload
+
+def run(matcher, workload):
+    start = time.perf_counter()
+    results = [matcher.best_match(query, candidates) for query, candidates in workload]
+    return time.perf_counter() - start, results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--candidates", type=int, default=10, help="Candidates per query (the API returns up to 10)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    workload = build_workload(args.queries, args.candidates, args.seed)
+    no_target = build_workload(args.queries, args.candidates, args.seed + 1, with_target=False)
+    baseline_matcher = MATCHERS["difflib"]()
+    baseline_time, baseline = run(baseline_matcher, workload)
+    _, baseline_no_target = run(baseline_matcher, no_target)
+
+    print(f"{args.queries} queries x {args.candidates} candidates, with and without the true title")
+    print(f"{'matcher':<10} {'threshold':>9} {'us/query':>10} {'speedup':>8} {'same pick':>10} "
+          f"{'same decision':>14} {'true accepts':>13} {'false accepts':>14}")
+    for name, matcher_class in MATCHERS.items():
+        matcher = matcher_class()
+        elapsed, results = run(matcher, workload)
+        _, results_no_target = run(matcher, no_target)
+        same_pick = sum(1 for (i, _), (j, _) in zip(results, baseline) if i == j)
+        same_decision = sum(
+            1 for (_, r), (_, b) in zip(results + results_no_target, baseline + baseline_no_target)
+            if matcher.is_match(r) == baseline_matcher.is_match(b)
+        )
+        true_accepts = sum(1 for _, r in results if matcher.is_match(r))
+        false_accepts = sum(1 for _, r in results_no_target if matcher.is_match(r))
+        print(f"{name:<10} {matcher.threshold:>9.2f} {elapsed / len(workload) * 1e6:>10.1f} {baseline_time / elapsed:>7.1f}x "
+              f"{same_pick / len(workload):>10.1%} {same_decision / (2 * len(workload)):>14.1%} "
+              f"{true_accepts / len(workload):>13.1%} {false_accepts / len(no_target):>14.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+End-to-end pipeline throughput benchmark against the local stub API server.
+
+Starts benchmarks.stub_api_server in-process, points every pipeline URL at it,
+then runs the chart scrape (all requested regions, both platforms) and the full
+PodcastIndex enrichment into a fresh database in a temporary directory.
+
+Run from the repository root:
+    python -m benchmarks.run_pipeline_benchmark [--latency-ms 50] [--error-rate 0.02]
+        [--regions us,gb] [--podcastindex-rps 50] [--min-titles-per-sec 5]
+
+Reports wall time per stage, enrichment titles/sec and p50/p95/p99 latency per
+API endpoint. With --min-titles-per-sec it exits non-zero when enrichment is
+slower than that, so it can gate throughput regressions in CI. The HTTP cache
+and payload archive are off so every run does the same network work.
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_api_server import StubApiServer, StubConfig
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shows", type=int, default=StubConfig.shows, help="Size of the stub's show catalogue")
+    parser.add_argument("--regions", default="us", help="Comma-separated chart regions to scrape")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Stub response latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="Extra random stub latency, 0..jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of PodcastIndex calls failing with 503")
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0, help="Stub PodcastIndex calls/sec before 429s (0 = unlimited)")
+    parser.add_argument("--podcastindex-rps", type=float, default=50.0,
+                        help="Client-side PodcastIndex rate limit for the run (production default is PODCASTINDEX_RPS=4)")
+    parser.add_argument("--mode", choices=("async", "serial"), default=None, help="Enrichment engine (default: ENRICH_MODE)")
+    parser.add_argument("--concurrency", type=int, default=None, help="Async enrichment concurrency (default: ENRICH_CONCURRENCY)")
+    parser.add_argument("--min-titles-per-sec", type=float, default=None, help="Fail if enrichment throughput is below this")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        shows=args.shows, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, rate_limit_rps=args.rate_limit_rps,
+    )
+    server = StubApiServer(config).start()
+
+    # Configuration is read from the environment at import time, so set it
+    # before the pipeline modules are imported.
+    os.environ.update(server.env())
+    os.environ.update({
+        "HTTP_CACHE": "0",
+        "PAYLOAD_ARCHIVE": "0",
+        "PODCASTINDEX_API_KEY": "benchmark",
+        "PODCASTINDEX_API_SECRET": "benchmark",
+        "PODCASTINDEX_RPS": str(args.podcastindex_rps),
+        "PODCASTINDEX_BURST": str(max(1, int(args.podcastindex_rps))),
+        "CHART_REGIONS": args.regions,
+    })
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    import podcast_client
+    import scrape_all_regions
+    import update_all_podcast_details
+
+    regions = scrape_all_regions.CHART_REGIONS
+    workdir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    os.chdir(workdir) # The pipeline writes podcasts.db in the working directory
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    stage_times = {}
+    total_start = time.perf_counter()
+    with output:
+        start = time.perf_counter()
+        scrape_all_regions.scrape_all_regions(regions)
+        stage_times["charts"] = time.perf_counter() - start
+
+        conn = sqlite3.connect("podcasts.db")
+        titles = conn.execute("SELECT COUNT(DISTINCT title) FROM Top100Lists WHERE title IS NOT NULL").fetchone()[0]
+        conn.close()
+
+        chart_stats = podcast_client.call_stats.summary()
+        podcast_client.call_stats.reset()
+        start = time.perf_counter()
+        update_all_podcast_details.update_all_podcast_details(
+            mode=args.mode or update_all_podcast_details.ENRICH_MODE,
+            concurrency=args.concurrency or update_all_podcast_details.ENRICH_CONCURRENCY,
+            refresh_mode="full",
+        )
+        stage_times["enrich"] = time.perf_counter() - start
+    total = time.perf_counter() - total_start
+    enrich_stats = podcast_client.call_stats.summary()
+
+    conn = sqlite3.connect(os.path.join(workdir, "podcasts.db"))
+    enriched = conn.execute("SELECT COUNT(*) FROM Podcasts").fetchone()[0]
+    conn.close()
+    server.stop()
+
+    titles_per_sec = titles / stage_times["enrich"] if stage_times["enrich"] else float("inf")
+    print(f"Stub: {args.shows} shows, latency {args.latency_ms:g}ms + up to {args.jitter_ms:g}ms, "
+          f"error rate {args.error_rate:g}, stub rate limit {args.rate_limit_rps or 'off'}; "
+          f"{server.requests} requests served, injected {server.injected or 'none'}")
+    print(f"Client PodcastIndex rate limit: {args.podcastindex_rps:g} req/s (--podcastindex-rps; production default 4)")
+    print(f"Regions: {','.join(regions)}  Database: {workdir}/podcasts.db")
+    print()
+    print(f"{'stage':<10} {'wall s':>8}")
+    for stage, seconds in stage_times.items():
+        print(f"{stage:<10} {seconds:>8.2f}")
+    print(f"{'total':<10} {total:>8.2f}")
+    print()
+    print(f"Enrichment: {titles} titles, {enriched} enriched, {titles_per_sec:.2f} titles/sec")
+    print()
+    print(f"{'endpoint':<22} {'calls':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for label, stats in (("charts", chart_stats), ("enrich", enrich_stats)):
+        for endpoint, s in sorted(stats.items(), key=lambda kv: (kv[0] == "all", kv[0])):
+            name = f"{label}:{endpoint}"
+            print(f"{name:<22} {s['calls']:>6} {s['errors']:>6} {s['p50'] * 1000:>8.1f} {s['p95'] * 1000:>8.1f} "
+                  f"{s['p99'] * 1000:>8.1f} {s['max'] * 1000:>8.1f}")
+
+    if args.min_titles_per_sec is not None and titles_per_sec < args.min_titles_per_sec:
+        print(f"\nFAIL: {titles_per_sec:.2f} titles/sec is below the --min-titles-per-sec gate of {args.min_titles_per_sec:g}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
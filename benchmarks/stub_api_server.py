@@ -0,0 +1,311 @@
+"""
+Local stub of every HTTP API the pipeline calls, with latency and fault injection.
+
+Serves deterministic synthetic data in the shapes the scrapers and the
+enrichment script parse:
+
+    /apple/api/v2/{region}/podcasts/top/{limit}/podcasts.json   Apple RSS generator
+    /spotify/api/charts/top?region=xx                           Spotify charts
+    /itunes/lookup?id=1,2,3                                     iTunes Lookup
+    /podcastindex/api/1.0/search/byterm, search/bytitle,
+        podcasts/byfeedid, podcasts/byfeedurl, podcasts/byitunesid,
+        episodes/byfeedid                                       PodcastIndex
+
+Run it standalone from the repository root:
+    python -m benchmarks.stub_api_server [--port 8765] [--latency-ms 50] [--error-rate 0.02]
+
+It prints the environment variables that point the pipeline at it.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = [
+    "Daily", "Crime", "History", "Money", "Science", "Comedy", "Sports", "Health",
+    "Mystery", "Culture", "Politics", "Business", "Tech", "Stories", "Life", "Truth",
+    "Mind", "World", "Hour", "Talk", "Files", "Radio", "Lab", "Weekly", "Uncut",
+]
+FEED_ID_BASE = 500000
+ITUNES_ID_BASE = 1000000000
+
+@dataclass
+class StubConfig:
+    shows: int = 400 # Size of the synthetic show catalogue
+    latency_ms: float = 0.0 # Fixed delay added to every response
+    jitter_ms: float = 0.0 # Extra uniformly random delay, 0..jitter_ms
+    error_rate: float = 0.0 # Fraction of PodcastIndex calls answered with a 503
+    rate_limit_rps: float = 0.0 # PodcastIndex calls/sec allowed before 429s (0 = unlimited)
+    retry_after: int = 1 # Retry-After seconds sent with a 429
+    episodes: int = 10 # Episodes returned per feed
+    seed: int = 7
+
+def _title(i: int) -> str:
+    rng = random.Random(i)
+    words = rng.sample(WORDS, rng.choice((1, 2, 3)))
+    title = " ".join(words)
+    if rng.random() < 0.3:
+        title = "The " + title
+    return f"{title} {i}"
+
+def _core(title: str) -> str:
+    """Lower-cases a title and drops a leading 'the' and trailing 'podcast' (search normalization)."""
+    title = title.lower().strip()
+    if title.startswith("the "):
+        title = title[4:]
+    if title.endswith(" podcast"):
+        title = title[:-8]
+    return title
+
+class StubCatalogue:
+    """Deterministic synthetic shows and per-region charts."""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.feeds: Dict[int, Dict[str, Any]] = {}
+        for i in range(1, config.shows + 1):
+            feed_id = FEED_ID_BASE + i
+            self.feeds[feed_id] = {
+                "id": feed_id,
+                "title": _title(i),
+                "url": f"https://feeds.example.com/{i}.xml",
+                "originalUrl": f"https://feeds.example.com/{i}.xml",
+                "itunesId": ITUNES_ID_BASE + i,
+                "description": f"Synthetic show number {i}.",
+                "image": f"https://img.example.com/{i}.jpg",
+                "episodeCount": 50 + i % 200,
+                "lastUpdateTime": 1700000000 + i,
+                "categories": {"1": WORDS[i % len(WORDS)]},
+                "podcastGuid": f"00000000-0000-4000-8000-{i:012d}",
+            }
+        self.by_url = {feed["url"]: feed for feed in self.feeds.values()}
+        self.by_itunes_id = {feed["itunesId"]: feed for feed in self.feeds.values()}
+        self.by_core_title: Dict[str, List[Dict[str, Any]]] = {}
+        for feed in self.feeds.values():
+            self.by_core_title.setdefault(_core(feed["title"]), []).append(feed)
+
+    def chart(self, platform: str, region: str, limit: int) -> List[Dict[str, Any]]:
+        """Top `limit` feeds for a platform/region; charts overlap but are not identical."""
+        rng = random.Random(zlib.crc32(f"{self.config.seed}/{platform}/{region}".encode()))
+        pool = list(self.feeds.values())
+        rng.shuffle(pool)
+        return pool[:limit]
+
+    def spotify_name(self, feed: Dict[str, Any]) -> str:
+        """Spotify sometimes spells a show differently, which forces a title search."""
+        rng = random.Random(feed["id"])
+        roll = rng.random()
+        if roll < 0.15:
+            return feed["title"] + " Podcast"
+        if roll < 0.25 and feed["title"].startswith("The "):
+            return feed["title"][4:]
+        return feed["title"]
+
+    def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        core = _core(query)
+        feeds = list(self.by_core_title.get(core, []))
+        if not feeds:
+            feeds = [feed for key, group in self.by_core_title.items() if core in key for feed in group]
+        return feeds[:limit]
+
+    def episodes(self, feed_id: int, limit: int) -> List[Dict[str, Any]]:
+        rng = random.Random(feed_id)
+        return [
+            {"id": feed_id * 1000 + n, "title": f"Episode {n}", "duration": rng.randint(600, 5400), "datePublished": 1700000000 - n * 86400}
+            for n in range(min(limit, self.config.episodes))
+        ]
+
+class _RateLimiter:
+    def __init__(self, rps: float):
+        self.rps = rps
+        self._tokens = rps
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rps, self._tokens + (now - self._updated) * self.rps)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+class StubApiServer:
+    """Threaded local HTTP server; use start()/stop() or run it with serve_forever()."""
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        self.catalogue = StubCatalogue(self.config)
+        self.limiter = _RateLimiter(self.config.rate_limit_rps) if self.config.rate_limit_rps > 0 else None
+        self.rng = random.Random(self.config.seed)
+        self.rng_lock = threading.Lock()
+        self.requests = 0
+        self.injected: Dict[int, int] = {}
+        self.counter_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point the pipeline at this server."""
+        return {
+            "APPLE_CHARTS_URL_TEMPLATE": self.base_url + "/apple/api/v2/{region}/podcasts/top/{limit}/podcasts.json",
+            "SPOTIFY_CHARTS_URL": self.base_url + "/spotify/api/charts/top",
+            "ITUNES_LOOKUP_URL": self.base_url + "/itunes/lookup",
+            "PODCASTINDEX_BASE_URL": self.base_url + "/podcastindex/api/1.0/",
+        }
+
+    def start(self) -> "StubApiServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _delay(self) -> float:
+        with self.rng_lock:
+            jitter = self.rng.uniform(0, self.config.jitter_ms) if self.config.jitter_ms else 0.0
+        return (self.config.latency_ms + jitter) / 1000
+
+    def _inject_fault(self) -> Optional[Tuple[int, Dict[str, str]]]:
+        """Returns (status, headers) for an injected PodcastIndex failure, or None."""
+        if self.limiter and not self.limiter.allow():
+            return 429, {"Retry-After": str(self.config.retry_after)}
+        if self.config.error_rate:
+            with self.rng_lock:
+                failed = self.rng.random() < self.config.error_rate
+            if failed:
+                return 503, {}
+        return None
+
+    def route(self, path: str, query: Dict[str, str]) -> Tuple[int, Any]:
+        """Returns (status, JSON body) for a request path."""
+        catalogue = self.catalogue
+        parts = path.strip("/").split("/")
+        if path.startswith("/apple/") and path.endswith("/podcasts.json") and len(parts) >= 7:
+            region, limit = parts[3], int(parts[6])
+            results = [{"id": str(feed["itunesId"]), "name": feed["title"]} for feed in catalogue.chart("apple", region, limit)]
+            return 200, {"feed": {"title": "Top Shows", "country": region, "results": results}}
+        if path == "/spotify/api/charts/top":
+            region = query.get("region", "us")
+            return 200, [
+                {"showName": catalogue.spotify_name(feed), "showUri": f"spotify:show:sp{feed['id']}"}
+                for feed in catalogue.chart("spotify", region, 100)
+            ]
+        if path == "/itunes/lookup":
+            results = []
+            for raw_id in query.get("id", "").split(","):
+                feed = catalogue.by_itunes_id.get(int(raw_id)) if raw_id.isdigit() else None
+                if feed:
+                    results.append({"collectionId": feed["itunesId"], "trackId": feed["itunesId"], "feedUrl": feed["url"]})
+            return 200, {"resultCount": len(results), "results": results}
+        if path.startswith("/podcastindex/api/1.0/"):
+            endpoint = path[len("/podcastindex/api/1.0/"):]
+            if endpoint in ("search/byterm", "search/bytitle"):
+                limit = int(query.get("max", 10))
+                query_text = query.get("q", "")
+                if endpoint == "search/bytitle":
+                    feeds = [f for f in catalogue.feeds.values() if f["title"].lower() == query_text.lower()][:limit]
+                else:
+                    feeds = catalogue.search(query_text, limit)
+                return 200, {"status": "true", "feeds": feeds, "count": len(feeds)}
+            if endpoint == "podcasts/byfeedid":
+                feed = catalogue.feeds.get(int(query.get("id", 0)))
+            elif endpoint == "podcasts/byfeedurl":
+                feed = catalogue.by_url.get(query.get("url", ""))
+            elif endpoint == "podcasts/byitunesid":
+                feed = catalogue.by_itunes_id.get(int(query.get("id", 0)))
+            elif endpoint == "episodes/byfeedid":
+                items = catalogue.episodes(int(query.get("id", 0)), int(query.get("max", 10)))
+                return 200, {"status": "true", "items": items, "count": len(items)}
+            else:
+                return 404, {"status": "false", "description": "Unknown endpoint"}
+            return 200, {"status": "true", "feed": feed or []}
+        return 404, {"error": "not found"}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real APIs
+            disable_nagle_algorithm = True
+            wbufsize = 1 << 16 # Headers and body leave in one write, flushed after each request
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                with server.counter_lock:
+                    server.requests += 1
+                delay = server._delay()
+                if delay:
+                    time.sleep(delay)
+                if parts.path.startswith("/podcastindex/"):
+                    fault = server._inject_fault()
+                    if fault:
+                        status, headers = fault
+                        with server.counter_lock:
+                            server.injected[status] = server.injected.get(status, 0) + 1
+                        self._send(status, headers=headers)
+                        return
+                try:
+                    status, payload = server.route(parts.path, query)
+                except (ValueError, IndexError):
+                    status, payload = 400, {"error": "bad request"}
+                self._send(status, json.dumps(payload).encode("utf-8"), {"Content-Type": "application/json"})
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--shows", type=int, default=StubConfig.shows)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of PodcastIndex calls answered with 503")
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0, help="PodcastIndex calls/sec before 429s (0 = unlimited)")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        shows=args.shows, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, rate_limit_rps=args.rate_limit_rps,
+    )
+    server = StubApiServer(config, args.host, args.port)
+    print(f"Stub API server listening on {server.base_url}. Point the pipeline at it with:")
+    for name, value in server.env().items():
+        print(f"  export {name}='{value}'")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import logging
+import os
+import sqlite3
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from schema import HISTORY_SHOW_ID_SQL, ensure_schema
+
+# --- Configuration ---
+DATABASE_NAME = "podcasts.db"
+DELTA_DAYS = (1, 7, 30) # Rank deltas are computed against these offsets
+CHUNK_DAYS = int(os.environ.get("MOVERS_CHUNK_DAYS", "90")) # Chart days per rank matrix during backfills
+LOG_LEVEL = logging.INFO
+
+# Each chart (platform, region) is loaded as a dense rank matrix: one row per
+# day, one column per show, 0 where the show did not chart. Rank deltas,
+# entrants and dropouts for every target day are then whole-array comparisons
+# of the matrix against itself shifted by 1/7/30 days and by one snapshot.
+
+EVENT_NAMES = np.array(["same", "up", "down", "new", "reentry", "dropout"])
+SAME, UP, DOWN, NEW, REENTRY, DROPOUT = range(len(EVENT_NAMES))
+
+EVENT_INSERT_SQL = '''
+    INSERT INTO ChartEvents
+        (platform_id, region_id, day, show_id, event, rank, prev_rank, delta_1d, delta_7d, delta_30d)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def load_history_keys(conn: sqlite3.Connection) -> np.ndarray:
+    """Returns an array mapping each ChartShows show_id to its RankHistory show key."""
+    rows = conn.execute(f"SELECT s.show_id, {HISTORY_SHOW_ID_SQL.format(alias='s')} FROM ChartShows s").fetchall()
+    if not rows:
+        return np.zeros(1, dtype=np.int64)
+    pairs = np.array(rows, dtype=np.int64)
+    keys = np.zeros(pairs[:, 0].max() + 1, dtype=np.int64)
+    keys[pairs[:, 0]] = pairs[:, 1]
+    return keys
+
+def load_first_days(conn: sqlite3.Connection) -> Dict[Tuple[int, int], Dict[int, int]]:
+    """Returns {(platform_id, region_id): {show key: first day charted}} in one pass over RankHistory."""
+    first_days: Dict[Tuple[int, int], Dict[int, int]] = {}
+    for show_id, platform_id, region_id, day in conn.execute('''
+        SELECT show_id, platform_id, region_id, MIN(day) FROM RankHistory
+        GROUP BY show_id, platform_id, region_id
+    '''):
+        first_days.setdefault((platform_id, region_id), {})[show_id] = day
+    return first_days
+
+def compute_events(
+    days: np.ndarray,
+    shows: np.ndarray,
+    ranks: np.ndarray,
+    targets: np.ndarray,
+    first_days: Dict[int, int],
+) -> List[Tuple]:
+    """
+    Computes the events of one chart for the target days.
+
+    Args:
+        days, shows, ranks: The chart's rows (history show key, best rank per
+            day). They must cover every target day, the 30 days before the
+            first target, and the snapshot before it, if there is one.
+        targets: Sorted chart days to compute.
+        first_days: {show key: first day charted}, covering every show in `shows`.
+
+    Returns:
+        (day, show_id, event, rank, prev_rank, delta_1d, delta_7d, delta_30d)
+        tuples, with None for missing values.
+    """
+    if len(days) == 0 or len(targets) == 0:
+        return []
+    start = min(int(days.min()), int(targets[0]) - max(DELTA_DAYS))
+    span = int(targets[-1]) - start + 1
+    columns, show_index = np.unique(shows, return_inverse=True)
+
+    # Rank matrix with an extra all-zero last row, so index -1 means "no chart".
+    matrix = np.zeros((span + 1, len(columns)), dtype=np.int32)
+    matrix[days - start, show_index] = ranks
+
+    snapshot_days = np.unique(days) - start
+    target_rows = targets - start
+    prev_position = np.searchsorted(snapshot_days, target_rows) - 1
+    prev_rows = np.where(prev_position >= 0, snapshot_days[np.maximum(prev_position, 0)], -1)
+
+    now = matrix[target_rows]
+    prev = matrix[prev_rows]
+    present, was = now > 0, prev > 0
+
+    first = np.array([first_days.get(int(key), 0) for key in columns], dtype=np.int64)
+    debut = first[None, :] == targets[:, None]
+    event = np.select(
+        [present & ~was & debut, present & ~was, ~present & was, now < prev, now > prev],
+        [NEW, REENTRY, DROPOUT, UP, DOWN],
+        default=SAME,
+    )
+
+    deltas = []
+    for offset in DELTA_DAYS:
+        then = matrix[target_rows - offset]
+        deltas.append((then - now, present & (then > 0)))
+
+    row, col = np.nonzero(present | was)
+    output = zip(
+        targets[row].tolist(),
+        columns[col].tolist(),
+        EVENT_NAMES[event[row, col]].tolist(),
+        now[row, col].tolist(),
+        prev[row, col].tolist(),
+        *[np.where(valid[row, col], delta[row, col], 0).tolist() for delta, valid in deltas],
+        *[valid[row, col].tolist() for _, valid in deltas],
+    )
+    return [
+        (day, show_id, event_name, rank or None, prev_rank or None,
+         d1 if v1 else None, d7 if v7 else None, d30 if v30 else None)
+        for day, show_id, event_name, rank, prev_rank, d1, d7, d30, v1, v7, v30 in output
+    ]
+
+def load_chart_rows(
+    conn: sqlite3.Connection, history_keys: np.ndarray, platform_id: int, region_id: int, start_day: int, end_day: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns (days, show keys, best ranks) for one chart between two days, one row per show per day."""
+    rows = conn.execute('''
+        SELECT day, rank, show_id FROM ChartEntries
+        WHERE platform_id = ? AND region_id = ? AND day BETWEEN ? AND ?
+    ''', (platform_id, region_id, start_day, end_day)).fetchall()
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    data = np.array(rows, dtype=np.int64)
+    days, ranks, shows = data[:, 0], data[:, 1], history_keys[data[:, 2]]
+    # A show listed twice on one day keeps its best rank (as in RankHistory).
+    order = np.lexsort((ranks, shows, days))
+    days, shows, ranks = days[order], shows[order], ranks[order]
+    first = np.ones(len(days), dtype=bool)
+    first[1:] = (days[1:] != days[:-1]) | (shows[1:] != shows[:-1])
+    return days[first], shows[first], ranks[first]
+
+def update_chart_events(conn: sqlite3.Connection, full: bool = False) -> Counter:
+    """
+    Computes ChartEvents for every chart day not yet computed, or for all chart days with `full`.
+
+    Each chart's days are written in one transaction per chunk, replacing any
+    rows already there for those days.
+
+    Args:
+        conn: An open connection on a podcasts.db with chart data.
+        full: Recompute every chart day instead of only the new ones.
+
+    Returns:
+        A Counter of events written, by event name, plus 'days' (chart days computed).
+    """
+    ensure_schema(conn)
+    charts = conn.execute('''
+        SELECT p.platform_id, r.region_id FROM Platforms p, Regions r
+        WHERE EXISTS (SELECT 1 FROM ChartEntries e WHERE e.platform_id = p.platform_id AND e.region_id = r.region_id)
+    ''').fetchall()
+    history_keys = load_history_keys(conn)
+    first_days = load_first_days(conn)
+    totals: Counter = Counter()
+
+    for platform_id, region_id in charts:
+        done = None if full else conn.execute(
+            "SELECT MAX(day) FROM ChartEvents WHERE platform_id = ? AND region_id = ?", (platform_id, region_id)
+        ).fetchone()[0]
+        targets = np.array([row[0] for row in conn.execute('''
+            SELECT DISTINCT day FROM ChartEntries WHERE platform_id = ? AND region_id = ? AND day > ? ORDER BY day
+        ''', (platform_id, region_id, -1 if done is None else done))], dtype=np.int64)
+
+        for chunk_start in range(0, len(targets), CHUNK_DAYS):
+            chunk = targets[chunk_start:chunk_start + CHUNK_DAYS]
+            previous = conn.execute('''
+                SELECT MAX(day) FROM ChartEntries WHERE platform_id = ? AND region_id = ? AND day < ?
+            ''', (platform_id, region_id, int(chunk[0]))).fetchone()[0]
+            load_from = int(chunk[0]) - max(DELTA_DAYS)
+            if previous is not None:
+                load_from = min(load_from, previous)
+            days, shows, ranks = load_chart_rows(conn, history_keys, platform_id, region_id, load_from, int(chunk[-1]))
+            events = compute_events(days, shows, ranks, chunk, first_days.get((platform_id, region_id), {}))
+            with conn:
+                conn.execute(
+                    f"DELETE FROM ChartEvents WHERE platform_id = ? AND region_id = ? AND day IN ({', '.join('?' * len(chunk))})",
+                    (platform_id, region_id, *chunk.tolist()),
+                )
+                conn.executemany(EVENT_INSERT_SQL, ((platform_id, region_id) + event for event in events))
+            totals.update(event[2] for event in events)
+            totals["days"] += len(chunk)
+        if len(targets):
+            logging.info(f"Chart events for platform {platform_id}, region {region_id}: {len(targets)} days computed")
+    return totals
+
+if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = sqlite3.connect(DATABASE_NAME)
+    try:
+        logging.info(f"Chart events updated: {dict(update_chart_events(conn))}")
+    finally:
+        conn.close()
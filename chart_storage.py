@@ -0,0 +1,122 @@
+import datetime
+import logging
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+# --- Configuration ---
+DEFAULT_REGION = "us"
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# Chart rows are stored as small integers: ChartEntries (platform_id, region_id,
+# day, rank, show_id), with the text living once in the Platforms, Regions and
+# ChartShows dimensions. Top100Lists is a view over them with the original
+# columns (see schema.py, migration 3). Each inserted chart row also updates
+# RankHistory and its weekly/monthly rollups, by trigger (migration 6).
+
+def day_number(date_str: str) -> int:
+    """Converts an ISO date ('YYYY-MM-DD') to days since 1970-01-01."""
+    return datetime.date.fromisoformat(date_str).toordinal() - EPOCH_ORDINAL
+
+def day_to_date(day: int) -> str:
+    """Converts a day number back to an ISO date."""
+    return datetime.date.fromordinal(day + EPOCH_ORDINAL).isoformat()
+
+class ChartDimensions:
+    """
+    Resolves platform names, region codes and (platform, show id, title) triples
+    to their integer keys, inserting new dimension rows as needed.
+
+    Lookups are cached for the lifetime of the instance (one save), so a
+    100-row chart costs at most one query per distinct value.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._platforms: Dict[str, int] = {}
+        self._regions: Dict[str, int] = {}
+        self._shows: Dict[Tuple[int, Optional[str], Optional[str]], int] = {}
+
+    def _get_or_create(self, select_sql: str, insert_sql: str, params: Tuple) -> int:
+        row = self.conn.execute(select_sql, params).fetchone()
+        if row:
+            return row[0]
+        return self.conn.execute(insert_sql, params).lastrowid
+
+    def platform_id(self, name: str) -> int:
+        if name not in self._platforms:
+            self._platforms[name] = self._get_or_create(
+                "SELECT platform_id FROM Platforms WHERE name = ?",
+                "INSERT INTO Platforms (name) VALUES (?)",
+                (name,),
+            )
+        return self._platforms[name]
+
+    def region_id(self, code: str) -> int:
+        if code not in self._regions:
+            self._regions[code] = self._get_or_create(
+                "SELECT region_id FROM Regions WHERE code = ?",
+                "INSERT INTO Regions (code) VALUES (?)",
+                (code,),
+            )
+        return self._regions[code]
+
+    def show_id(self, platform_id: int, platform_show_id: Optional[str], title: Optional[str]) -> int:
+        key = (platform_id, platform_show_id, title)
+        if key not in self._shows:
+            row = self.conn.execute('''
+                SELECT show_id FROM ChartShows
+                WHERE platform_id = ? AND COALESCE(platform_show_id, '') = COALESCE(?, '')
+                  AND COALESCE(title, '') = COALESCE(?, '')
+            ''', key).fetchone()
+            if row:
+                self._shows[key] = row[0]
+            else:
+                self._shows[key] = self.conn.execute(
+                    "INSERT INTO ChartShows (platform_id, platform_show_id, title) VALUES (?, ?, ?)", key
+                ).lastrowid
+        return self._shows[key]
+
+def save_chart_records(
+    conn: sqlite3.Connection,
+    records: List[Dict[str, Any]],
+    default_region: str = DEFAULT_REGION,
+) -> Tuple[int, int]:
+    """
+    Inserts scraped chart records into the normalized chart tables.
+
+    Rows that already exist for (platform, region, date, rank) are left as they
+    are, like the original INSERT OR IGNORE. Rank history is updated in the
+    same statement. The caller owns the transaction.
+
+    Args:
+        conn: An open connection on a migrated podcasts.db.
+        records: Dicts with platform, rank, date and optionally region, title, podcast_id.
+        default_region: Region for records without one.
+
+    Returns:
+        (inserted, ignored) row counts; invalid records are logged and skipped.
+    """
+    dims = ChartDimensions(conn)
+    rows = []
+    for r in records:
+        try:
+            platform_id = dims.platform_id(r["platform"])
+            podcast_id = r.get("podcast_id")
+            rows.append((
+                platform_id,
+                dims.region_id(r.get("region") or default_region),
+                day_number(r["date"]),
+                int(r["rank"]),
+                dims.show_id(platform_id, str(podcast_id) if podcast_id is not None else None, r.get("title")),
+            ))
+        except (KeyError, TypeError, ValueError) as e:
+            logging.error(f"Skipping invalid chart record {r}: {e!r}")
+
+    # rowcount counts only rows this statement inserted, not the ChangeLog and
+    # RankHistory rows its triggers write (conn.total_changes would).
+    cursor = conn.executemany('''
+        INSERT OR IGNORE INTO ChartEntries (platform_id, region_id, day, rank, show_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    inserted = max(cursor.rowcount, 0)
+    return inserted, len(rows) - inserted
@@ -0,0 +1,386 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+from chart_storage import day_number
+from schema import HISTORY_SHOW_ID_SQL
+
+# --- Configuration ---
+DATABASE_NAME = "podcasts.db"
+CACHE_SIZE = int(os.environ.get("DASHBOARD_CACHE_SIZE", "512")) # Cached query results
+CACHE_TTL_SECONDS = float(os.environ.get("DASHBOARD_CACHE_TTL_SECONDS", "900"))
+WATERMARK_POLL_SECONDS = float(os.environ.get("DASHBOARD_WATERMARK_POLL_SECONDS", "10"))
+DEFAULT_REGION = "us"
+
+# Read API for dashboards. Results are cached in process, keyed by query and
+# arguments. The cache is dropped as soon as the database moves past the run
+# watermark it was filled at. The watermark is the ChangeLog sequence (bumped
+# by every committed pipeline write and every delta-sync pull) plus the schema
+# version. It is polled at most every WATERMARK_POLL_SECONDS, so repeated
+# dashboard loads between polls never touch SQLite. A rebuilt database file
+# (delta_sync rebuild) is detected by its inode and reopened.
+
+# --- Result Types ---
+
+class ChartRow(NamedTuple):
+    rank: int
+    show_id: int # RankHistory show key, for show_detail / rank_history
+    title: Optional[str]
+    platform_show_id: Optional[str]
+    event: Optional[str] # vs the previous snapshot: 'new', 'reentry', 'up', 'down' or 'same'
+    delta_1d: Optional[int] # Places climbed since yesterday
+    feed_id: Optional[int]
+    image_url: Optional[str]
+    date: str
+
+class ShowDetail(NamedTuple):
+    show_id: int
+    platform: str
+    platform_show_id: Optional[str]
+    title: Optional[str] # Latest chart title
+    feed_id: Optional[int]
+    podcast_title: Optional[str]
+    description: Optional[str]
+    feed_url: Optional[str]
+    image_url: Optional[str]
+    episode_count: Optional[int]
+    avg_duration_last_10: Optional[int]
+    latest_episode_title: Optional[str]
+    categories: Optional[str] # JSON, as stored in Podcasts
+    linked_show_ids: Tuple[int, ...] # The same show on other platforms (identity map)
+
+class RankPoint(NamedTuple):
+    date: str # The day, or the first day of the week/month
+    best_rank: int
+    worst_rank: int
+    avg_rank: float
+    days_charted: int
+
+class Mover(NamedTuple):
+    show_id: int
+    title: Optional[str]
+    rank: int
+    delta: int # Places climbed (negative: fell) over the window
+    event: str
+    date: str
+
+class SearchResult(NamedTuple):
+    show_id: int
+    platform: str
+    title: str
+    last_charted: Optional[str]
+
+# --- Statements ---
+# Fixed SQL text only: sqlite3 keeps each statement compiled in the
+# connection's statement cache, so a repeated query is never re-parsed.
+
+_HISTORY_KEY = HISTORY_SHOW_ID_SQL.format(alias="s")
+
+WATERMARK_SQL = '''
+    SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'ChangeLog'), 0),
+           (SELECT COALESCE(MAX(version), 0) FROM SchemaVersion)
+'''
+
+LATEST_CHART_SQL = f'''
+    SELECT e.rank, {_HISTORY_KEY}, s.title, s.platform_show_id, ev.event, ev.delta_1d,
+           t.feed_id, pod.image_url, date(e.day + 2440587.5)
+    FROM Platforms p
+    JOIN Regions g ON g.code = :region
+    JOIN ChartEntries e ON e.platform_id = p.platform_id AND e.region_id = g.region_id
+        AND e.day = (SELECT MAX(day) FROM ChartEntries WHERE platform_id = p.platform_id AND region_id = g.region_id)
+    JOIN ChartShows s ON s.show_id = e.show_id
+    LEFT JOIN ChartEvents ev ON ev.platform_id = e.platform_id AND ev.region_id = e.region_id
+        AND ev.day = e.day AND ev.show_id = {_HISTORY_KEY}
+    LEFT JOIN TitleResolutions t ON t.show_id = s.show_id
+    LEFT JOIN Podcasts pod ON pod.podcast_id = t.feed_id
+    WHERE p.name = :platform
+    ORDER BY e.rank
+    LIMIT :limit
+'''
+
+# The key row identifies the show; the newest row with the same platform id
+# has its current title. The feed comes from the identity map, else from the
+# title resolution.
+SHOW_DETAIL_SQL = '''
+    WITH show AS (
+        SELECT k.show_id, p.name AS platform, k.platform_show_id,
+               COALESCE((SELECT MAX(o.show_id) FROM ChartShows o
+                         WHERE o.platform_id = k.platform_id AND o.platform_show_id = k.platform_show_id), k.show_id) AS latest_id
+        FROM ChartShows k JOIN Platforms p ON p.platform_id = k.platform_id
+        WHERE k.show_id = :show_id
+    )
+    SELECT show.show_id, show.platform, show.platform_show_id, latest.title,
+           COALESCE(c.feed_id, t.feed_id) AS feed_id,
+           pod.title, pod.description, pod.feed_url, pod.image_url, pod.episode_count,
+           pod.avg_duration_last_10, pod.latest_episode_title, pod.categories, i.canonical_id
+    FROM show
+    JOIN ChartShows latest ON latest.show_id = show.latest_id
+    LEFT JOIN ShowIdentities i ON i.id_type = lower(show.platform) AND i.external_id = show.platform_show_id
+    LEFT JOIN CanonicalShows c ON c.canonical_id = i.canonical_id
+    LEFT JOIN TitleResolutions t ON t.show_id = latest.show_id
+    LEFT JOIN Podcasts pod ON pod.podcast_id = COALESCE(c.feed_id, t.feed_id)
+'''
+
+LINKED_SHOWS_SQL = f'''
+    SELECT DISTINCT {_HISTORY_KEY}
+    FROM ShowIdentities i
+    JOIN Platforms p ON lower(p.name) = i.id_type
+    JOIN ChartShows s ON s.platform_id = p.platform_id AND s.platform_show_id = i.external_id
+    WHERE i.canonical_id = :canonical_id
+'''
+
+DAILY_HISTORY_SQL = '''
+    SELECT date(h.day + 2440587.5), h.rank, h.rank, h.rank, 1
+    FROM RankHistory h
+    WHERE h.show_id = :show_id
+      AND h.platform_id = (SELECT platform_id FROM ChartShows WHERE show_id = :show_id)
+      AND h.region_id = (SELECT region_id FROM Regions WHERE code = :region)
+      AND h.day >= :since_day
+    ORDER BY h.day
+'''
+
+ROLLUP_HISTORY_SQL = '''
+    SELECT date(h.period_start + 2440587.5), h.best_rank, h.worst_rank, h.avg_rank, h.days_charted
+    FROM RankHistoryRollups h
+    WHERE h.show_id = :show_id AND h.period = :period
+      AND h.platform_id = (SELECT platform_id FROM ChartShows WHERE show_id = :show_id)
+      AND h.region_id = (SELECT region_id FROM Regions WHERE code = :region)
+      AND h.period_start >= :since_day
+    ORDER BY h.period_start
+'''
+
+def _movers_sql(delta_column: str, order: str) -> str:
+    return f'''
+        SELECT ev.show_id, s.title, ev.rank, ev.{delta_column}, ev.event, date(ev.day + 2440587.5)
+        FROM Platforms p
+        JOIN Regions g ON g.code = :region
+        JOIN ChartEvents ev ON ev.platform_id = p.platform_id AND ev.region_id = g.region_id
+            AND ev.day = COALESCE(:day, (SELECT MAX(day) FROM ChartEvents WHERE platform_id = p.platform_id AND region_id = g.region_id))
+        JOIN ChartShows s ON s.show_id = ev.show_id
+        WHERE p.name = :platform AND ev.{delta_column} IS NOT NULL
+        ORDER BY ev.{delta_column} {order}, ev.rank
+        LIMIT :limit
+    '''
+
+# One fixed statement per (window days, direction).
+TOP_MOVERS_SQL = {
+    (window, direction): _movers_sql(f"delta_{window}d", "DESC" if direction == "up" else "ASC")
+    for window in (1, 7, 30)
+    for direction in ("up", "down")
+}
+
+SEARCH_SQL = f'''
+    SELECT {_HISTORY_KEY} AS show_key, p.name, s.title,
+           (SELECT date(MAX(h.day) + 2440587.5) FROM RankHistory h WHERE h.show_id = {_HISTORY_KEY})
+    FROM ChartShows s JOIN Platforms p ON p.platform_id = s.platform_id
+    WHERE s.title LIKE :pattern ESCAPE '\\'
+    GROUP BY show_key
+    ORDER BY MAX(s.title LIKE :prefix ESCAPE '\\') DESC, length(s.title), s.title
+    LIMIT :limit
+'''
+
+# --- Cache ---
+
+class QueryCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl_seconds`."""
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Returns (True, value) for a live entry, else (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] >= self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# --- Queries ---
+
+class DashboardQueries:
+    """
+    Cached, read-only queries over podcasts.db for the dashboard.
+
+    Every method returns immutable values (NamedTuples, tuples of them), so
+    cached results can be shared between callers. One read-only connection
+    is shared behind a lock, so an instance is safe across request threads.
+    """
+
+    def __init__(
+        self,
+        path: str = DATABASE_NAME,
+        cache_size: int = CACHE_SIZE,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+        poll_seconds: float = WATERMARK_POLL_SECONDS,
+    ):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.cache = QueryCache(cache_size, ttl_seconds)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._file_id: Optional[Tuple[int, int]] = None
+        self._watermark: Optional[Tuple[int, int]] = None
+        self._polled_at = float("-inf")
+        self.invalidations = 0
+
+    def _open(self):
+        if self._conn is not None:
+            self._conn.close()
+        uri = Path(self.path).absolute().as_uri() + "?mode=ro"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        stat = os.stat(self.path)
+        self._file_id = (stat.st_dev, stat.st_ino)
+
+    def _check_watermark(self):
+        """Drops the cache if the database moved on since the last poll. Caller holds the lock."""
+        now = time.monotonic()
+        if now - self._polled_at < self.poll_seconds and self._conn is not None:
+            return
+        self._polled_at = now
+        stat = os.stat(self.path)
+        if self._conn is None or (stat.st_dev, stat.st_ino) != self._file_id:
+            self._open() # First use, or the file was replaced (e.g. rebuilt by delta_sync)
+        watermark = tuple(self._conn.execute(WATERMARK_SQL).fetchone())
+        if watermark != self._watermark:
+            if self._watermark is not None:
+                self.invalidations += 1
+                logging.info(f"Dashboard cache invalidated: watermark {self._watermark} -> {watermark}")
+            self.cache.clear()
+            self._watermark = watermark
+
+    def _cached(self, key: Tuple, compute: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            self._check_watermark()
+            hit, value = self.cache.get(key)
+            if hit:
+                return value
+            value = compute(self._conn)
+            self.cache.put(key, value)
+            return value
+
+    def watermark(self) -> Optional[Tuple[int, int]]:
+        """The (ChangeLog seq, schema version) the cached results belong to."""
+        with self._lock:
+            self._check_watermark()
+            return self._watermark
+
+    def latest_chart(self, platform: str, region: str = DEFAULT_REGION, limit: int = 100) -> Tuple[ChartRow, ...]:
+        """The most recent chart for a platform ('Apple', 'Spotify') and region, by rank."""
+        params = {"platform": platform, "region": region, "limit": limit}
+        return self._cached(
+            ("latest_chart", platform, region, limit),
+            lambda conn: tuple(ChartRow(*row) for row in conn.execute(LATEST_CHART_SQL, params)),
+        )
+
+    def show_detail(self, show_id: int) -> Optional[ShowDetail]:
+        """A charted show with its enriched feed details, or None if the show id is unknown."""
+        def compute(conn: sqlite3.Connection) -> Optional[ShowDetail]:
+            row = conn.execute(SHOW_DETAIL_SQL, {"show_id": show_id}).fetchone()
+            if row is None:
+                return None
+            canonical_id = row[-1]
+            linked = () if canonical_id is None else tuple(sorted(
+                key for (key,) in conn.execute(LINKED_SHOWS_SQL, {"canonical_id": canonical_id}) if key != show_id
+            ))
+            return ShowDetail(*row[:-1], linked_show_ids=linked)
+        return self._cached(("show_detail", show_id), compute)
+
+    def rank_history(
+        self, show_id: int, region: str = DEFAULT_REGION, period: str = "day", since: Optional[str] = None,
+    ) -> Tuple[RankPoint, ...]:
+        """
+        A show's rank series on its platform's chart for one region.
+
+        Args:
+            show_id: A show key, as returned by the other queries.
+            region: Chart region code.
+            period: 'day', or 'week' / 'month' for the downsampled series.
+            since: Optional ISO date; earlier points are left out.
+        """
+        if period not in ("day", "week", "month"):
+            raise ValueError(f"Unknown period '{period}', expected 'day', 'week' or 'month'")
+        since_day = 0 if since is None else day_number(since)
+        params = {"show_id": show_id, "region": region, "period": period, "since_day": since_day}
+        sql = DAILY_HISTORY_SQL if period == "day" else ROLLUP_HISTORY_SQL
+        return self._cached(
+            ("rank_history", show_id, region, period, since_day),
+            lambda conn: tuple(RankPoint(*row) for row in conn.execute(sql, params)),
+        )
+
+    def top_movers(
+        self, platform: str, region: str = DEFAULT_REGION, window: int = 1, direction: str = "up",
+        date: Optional[str] = None, limit: int = 10,
+    ) -> Tuple[Mover, ...]:
+        """
+        The biggest climbers ('up') or fallers ('down') over 1, 7 or 30 days on
+        one chart, for `date` (ISO) or the latest computed day.
+        """
+        sql = TOP_MOVERS_SQL.get((window, direction))
+        if sql is None:
+            raise ValueError(f"Unsupported movers query: window {window} (1, 7 or 30), direction '{direction}' (up or down)")
+        day = None if date is None else day_number(date)
+        params = {"platform": platform, "region": region, "day": day, "limit": limit}
+        return self._cached(
+            ("top_movers", platform, region, window, direction, day, limit),
+            lambda conn: tuple(Mover(*row) for row in conn.execute(sql, params)),
+        )
+
+    def search(self, query: str, limit: int = 20) -> Tuple[SearchResult, ...]:
+        """Charted shows whose title contains `query` (case-insensitive), prefix matches first."""
+        escaped = query.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        if not escaped:
+            return ()
+        params = {"pattern": f"%{escaped}%", "prefix": f"{escaped}%", "limit": limit}
+        return self._cached(
+            ("search", escaped.lower(), limit),
+            lambda conn: tuple(SearchResult(*row) for row in conn.execute(SEARCH_SQL, params)),
+        )
+
+    def stats(self) -> str:
+        return (f"{self.cache.hits} cache hits, {self.cache.misses} misses, {len(self.cache)} entries, "
+                f"{self.invalidations} invalidations (watermark {self._watermark})")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+_shared_queries: Dict[str, DashboardQueries] = {}
+_shared_queries_lock = threading.Lock()
+
+def get_dashboard_queries(path: str = DATABASE_NAME) -> DashboardQueries:
+    """Returns the process-wide DashboardQueries for a database path."""
+    with _shared_queries_lock:
+        if path not in _shared_queries:
+            _shared_queries[path] = DashboardQueries(path)
+        return _shared_queries[path]
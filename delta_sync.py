@@ -0,0 +1,409 @@
+"""
+Delta sync of podcasts.db through an object store.
+
+    python delta_sync.py pull --store gs://bucket/podcasts-sync   # fast-forward (or rebuild) podcasts.db
+    python delta_sync.py push --store gs://bucket/podcasts-sync   # publish this run's changes
+    python delta_sync.py rebuild --store ./sync --db copy.db      # base snapshot + every changeset
+
+Triggers (schema migration 5) log every change to the synced tables in
+ChangeLog. `push` writes the changes since the last push as one changeset:
+a gzipped JSONL file in seq order, with only the last change to each row kept.
+`pull` applies the changesets that are newer than the local database. If the
+local database is missing or cannot be fast-forwarded, `pull` rebuilds it from
+the latest base snapshot plus the changesets after it. `push` publishes a new
+base snapshot instead of a changeset on the first push, after a schema
+migration, and every SYNC_SNAPSHOT_EVERY changesets.
+
+Store layout:
+    snapshots/<seq>.db.gz        whole database, containing every change up to seq
+    changesets/<to_seq>.jsonl.gz changes (from_seq, to_seq]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from schema import ensure_schema, schema_version
+
+# --- Configuration ---
+DATABASE_NAME = "podcasts.db"
+SYNC_STORE_URL = os.environ.get("SYNC_STORE_URL", "sync") # gs://bucket/prefix, or a local directory
+SNAPSHOT_EVERY = int(os.environ.get("SYNC_SNAPSHOT_EVERY", "30")) # Changesets between base snapshots
+CHANGESET_FORMAT = 1
+LOG_LEVEL = logging.INFO
+
+SNAPSHOT_PREFIX = "snapshots/"
+CHANGESET_PREFIX = "changesets/"
+
+class SyncError(Exception):
+    """A changeset or snapshot that cannot be applied to this database."""
+
+# --- Object Stores ---
+
+class LocalObjectStore:
+    """Object store in a local directory; names map to relative paths."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def list(self, prefix: str) -> List[str]:
+        directory = os.path.join(self.root, prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(prefix + name for name in os.listdir(directory) if not name.endswith(".tmp"))
+
+    def get(self, name: str) -> bytes:
+        with open(os.path.join(self.root, name), "rb") as f:
+            return f.read()
+
+    def put(self, name: str, data: bytes):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path) # Readers never see a partial object
+
+class GsutilObjectStore:
+    """Object store under a gs:// prefix, driven through the gsutil CLI the workflow already uses."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/") + "/"
+
+    def _gsutil(self, *args: str, data: Optional[bytes] = None) -> subprocess.CompletedProcess:
+        return subprocess.run(["gsutil", "-q", *args], input=data, capture_output=True)
+
+    def list(self, prefix: str) -> List[str]:
+        result = self._gsutil("ls", self.url + prefix)
+        if result.returncode != 0:
+            if b"matched no objects" in result.stderr:
+                return []
+            raise OSError(f"gsutil ls {self.url + prefix} failed: {result.stderr.decode(errors='replace').strip()}")
+        urls = result.stdout.decode().split()
+        return sorted(url[len(self.url):] for url in urls if url.startswith(self.url) and not url.endswith("/"))
+
+    def get(self, name: str) -> bytes:
+        result = self._gsutil("cat", self.url + name)
+        if result.returncode != 0:
+            raise OSError(f"gsutil cat {self.url + name} failed: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout
+
+    def put(self, name: str, data: bytes):
+        result = self._gsutil("cp", "-", self.url + name, data=data)
+        if result.returncode != 0:
+            raise OSError(f"gsutil cp to {self.url + name} failed: {result.stderr.decode(errors='replace').strip()}")
+
+def open_store(url: str = SYNC_STORE_URL):
+    """Returns the object store for a gs:// URL or a local directory path."""
+    if url.startswith("gs://"):
+        return GsutilObjectStore(url)
+    return LocalObjectStore(url)
+
+def _seq_of(name: str) -> int:
+    """Sequence number encoded in a snapshot or changeset name."""
+    return int(os.path.basename(name).split(".", 1)[0])
+
+# --- Sync State ---
+
+def get_state(conn: sqlite3.Connection, name: str, default: int = 0) -> int:
+    row = conn.execute("SELECT value FROM SyncState WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else default
+
+def set_state(conn: sqlite3.Connection, name: str, value: int):
+    conn.execute('''
+        INSERT INTO SyncState (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value
+    ''', (name, value))
+
+def last_change_seq(conn: sqlite3.Connection) -> int:
+    """Highest seq ever handed out by ChangeLog, including pruned rows."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'ChangeLog'").fetchone()
+    return row[0] if row else 0
+
+def _set_last_change_seq(conn: sqlite3.Connection, seq: int):
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'ChangeLog'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('ChangeLog', ?)", (seq,))
+
+def synced_tables(conn: sqlite3.Connection) -> Dict[str, Tuple[List[str], List[str]]]:
+    """Returns {table: (columns, primary key columns)} for every table with change triggers."""
+    names = [row[0] for row in conn.execute(
+        "SELECT DISTINCT tbl_name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'changelog\\_%' ESCAPE '\\'"
+    )]
+    tables = {}
+    for name in names:
+        info = list(conn.execute(f"PRAGMA table_info({name})"))
+        pk_columns = [row[1] for row in sorted((row for row in info if row[5]), key=lambda row: row[5])]
+        tables[name] = ([row[1] for row in info], pk_columns)
+    return tables
+
+# --- Changesets ---
+
+def export_changeset(conn: sqlite3.Connection, since_seq: int) -> Tuple[Optional[bytes], int]:
+    """
+    Serializes the changes logged after `since_seq`.
+
+    Only the last change to each row is kept. Changes stay in seq order, so
+    applying them replays the same final state.
+
+    Args:
+        conn: An open connection on a migrated podcasts.db.
+        since_seq: The last seq already published.
+
+    Returns:
+        (gzipped JSONL bytes, to_seq), or (None, since_seq) when nothing changed.
+    """
+    to_seq = conn.execute("SELECT COALESCE(MAX(seq), ?) FROM ChangeLog", (since_seq,)).fetchone()[0]
+    if to_seq <= since_seq:
+        return None, since_seq
+    rows = conn.execute('''
+        SELECT seq, table_name, op, row_key, row_data FROM ChangeLog
+        WHERE seq IN (
+            SELECT MAX(seq) FROM ChangeLog WHERE seq > ? AND seq <= ? GROUP BY table_name, row_key
+        )
+        ORDER BY seq
+    ''', (since_seq, to_seq)).fetchall()
+    header = {
+        "format": CHANGESET_FORMAT, "from_seq": since_seq, "to_seq": to_seq,
+        "schema_version": schema_version(conn), "created_at": int(time.time()), "changes": len(rows),
+    }
+    lines = [json.dumps(header)]
+    # row_key and row_data are already JSON; embed them without re-encoding.
+    lines.extend(
+        f'[{seq}, {json.dumps(table_name)}, "{op}", {row_key}, {row_data or "null"}]'
+        for seq, table_name, op, row_key, row_data in rows
+    )
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8")), to_seq
+
+def apply_changeset(conn: sqlite3.Connection, data: bytes) -> int:
+    """
+    Applies one changeset in a single transaction and advances the database to its to_seq.
+
+    The changes replayed here are not logged again, and the ChangeLog sequence
+    continues from to_seq, so the next local change gets the same seq it would
+    have had on the database that produced the changeset.
+
+    Args:
+        conn: An open connection on a database at the changeset's from_seq.
+        data: A changeset as produced by export_changeset.
+
+    Returns:
+        The number of changes applied.
+
+    Raises:
+        SyncError: if the changeset does not start where this database is, was
+            written for another schema version, or names an unknown table or column.
+    """
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    header = json.loads(lines[0])
+    if header.get("format") != CHANGESET_FORMAT:
+        raise SyncError(f"Unsupported changeset format {header.get('format')}")
+    current = get_state(conn, "synced_seq")
+    if header["from_seq"] != current:
+        raise SyncError(f"Changeset covers ({header['from_seq']}, {header['to_seq']}] but the database is at {current}")
+    if last_change_seq(conn) > current:
+        raise SyncError(f"Database has unpublished local changes after seq {current}")
+    version = schema_version(conn)
+    if header["schema_version"] != version:
+        raise SyncError(f"Changeset was written at schema version {header['schema_version']}, database is at {version}")
+
+    tables = synced_tables(conn)
+    upsert_sql: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+    conn.commit()
+    with conn:
+        for line in lines[1:]:
+            _, table_name, op, row_key, row_data = json.loads(line)
+            if table_name not in tables:
+                raise SyncError(f"Changeset names unsynced table {table_name!r}")
+            columns, pk_columns = tables[table_name]
+            if op == "delete":
+                where = " AND ".join(f"{c} IS ?" for c in pk_columns)
+                conn.execute(f"DELETE FROM {table_name} WHERE {where}", row_key)
+                continue
+            row_columns = tuple(row_data)
+            sql = upsert_sql.get((table_name, row_columns))
+            if sql is None:
+                unknown = set(row_columns) - set(columns)
+                if unknown:
+                    raise SyncError(f"Changeset has unknown columns {sorted(unknown)} for {table_name}")
+                updates = ", ".join(f"{c} = excluded.{c}" for c in row_columns if c not in pk_columns)
+                sql = upsert_sql[(table_name, row_columns)] = (
+                    f"INSERT INTO {table_name} ({', '.join(row_columns)}) VALUES ({', '.join('?' for _ in row_columns)}) "
+                    f"ON CONFLICT ({', '.join(pk_columns)}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")
+                )
+            conn.execute(sql, tuple(row_data.values()))
+        # Drop what the triggers logged for the replayed rows.
+        conn.execute("DELETE FROM ChangeLog WHERE seq > ?", (current,))
+        _set_last_change_seq(conn, header["to_seq"])
+        set_state(conn, "synced_seq", header["to_seq"])
+    return len(lines) - 1
+
+# --- Snapshots ---
+
+def write_snapshot(conn: sqlite3.Connection, seq: int) -> bytes:
+    """Returns a gzipped copy of the database marked as synced up to `seq`, with an empty ChangeLog."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshot.db")
+        copy = sqlite3.connect(path)
+        try:
+            conn.backup(copy)
+            with copy:
+                copy.execute("DELETE FROM ChangeLog WHERE seq <= ?", (seq,))
+                set_state(copy, "synced_seq", seq)
+                set_state(copy, "base_seq", seq)
+            copy.execute("VACUUM")
+        finally:
+            copy.close()
+        with open(path, "rb") as f:
+            return gzip.compress(f.read())
+
+def restore_snapshot(data: bytes, db_path: str):
+    """Replaces `db_path` with a snapshot, atomically."""
+    tmp_path = db_path + ".restore"
+    with open(tmp_path, "wb") as f:
+        f.write(gzip.decompress(data))
+    os.replace(tmp_path, db_path)
+
+# --- Commands ---
+
+def fast_forward(conn: sqlite3.Connection, store) -> int:
+    """Applies every changeset newer than the database, in order. Returns how many were applied."""
+    current = get_state(conn, "synced_seq")
+    pending = [name for name in store.list(CHANGESET_PREFIX) if _seq_of(name) > current]
+    for name in pending:
+        changes = apply_changeset(conn, store.get(name))
+        logging.info(f"Applied {name} ({changes} changes)")
+    return len(pending)
+
+def rebuild(store, db_path: str) -> int:
+    """
+    Rebuilds `db_path` from the latest base snapshot plus the changesets after it.
+
+    Returns:
+        The seq the rebuilt database is at.
+
+    Raises:
+        SyncError: if the store has no snapshot.
+    """
+    snapshots = store.list(SNAPSHOT_PREFIX)
+    if not snapshots:
+        raise SyncError("The store has no base snapshot")
+    restore_snapshot(store.get(snapshots[-1]), db_path)
+    logging.info(f"Restored base snapshot {snapshots[-1]}")
+    conn = sqlite3.connect(db_path)
+    try:
+        fast_forward(conn, store)
+        return get_state(conn, "synced_seq")
+    finally:
+        conn.close()
+
+def pull(store, db_path: str) -> Optional[int]:
+    """
+    Brings `db_path` up to date with the store: fast-forwards it when possible,
+    otherwise rebuilds it. Returns the seq it is at, or None if the store is
+    empty (the database, if any, is left as it is).
+    """
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            synced = bool(conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SyncState'"
+            ).fetchone()) and get_state(conn, "base_seq", -1) >= 0
+            if synced:
+                applied = fast_forward(conn, store)
+                logging.info(f"Fast-forwarded {db_path} by {applied} changesets to seq {get_state(conn, 'synced_seq')}")
+                return get_state(conn, "synced_seq")
+        except SyncError as e:
+            logging.warning(f"Cannot fast-forward {db_path} ({e}); rebuilding from the base snapshot")
+        finally:
+            conn.close()
+    if not store.list(SNAPSHOT_PREFIX):
+        logging.info("The store has no base snapshot yet; nothing to pull")
+        return None
+    seq = rebuild(store, db_path)
+    logging.info(f"Rebuilt {db_path} at seq {seq}")
+    return seq
+
+def push(store, db_path: str, snapshot_every: int = SNAPSHOT_EVERY) -> str:
+    """
+    Publishes the local changes since the last sync.
+
+    A base snapshot is published instead of a changeset when the store has
+    none, the schema version changed since the last one, or `snapshot_every`
+    changesets were published since it.
+
+    Returns:
+        The name of the published object, or "" if there was nothing to publish.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn)
+        synced = get_state(conn, "synced_seq")
+        base_seq = get_state(conn, "base_seq", -1)
+        snapshots = store.list(SNAPSHOT_PREFIX)
+        since_base = [name for name in store.list(CHANGESET_PREFIX) if _seq_of(name) > base_seq]
+        needs_snapshot = (
+            not snapshots or _seq_of(snapshots[-1]) != base_seq
+            or get_state(conn, "base_schema_version") != schema_version(conn)
+            or len(since_base) >= snapshot_every
+        )
+
+        if needs_snapshot:
+            seq = last_change_seq(conn)
+            name = f"{SNAPSHOT_PREFIX}{seq:012d}.db.gz"
+            with conn:
+                set_state(conn, "base_schema_version", schema_version(conn))
+            data = write_snapshot(conn, seq)
+            store.put(name, data)
+            with conn:
+                conn.execute("DELETE FROM ChangeLog WHERE seq <= ?", (seq,))
+                set_state(conn, "synced_seq", seq)
+                set_state(conn, "base_seq", seq)
+            logging.info(f"Published base snapshot {name} ({len(data) / 1024:.0f} KiB)")
+            return name
+
+        data, to_seq = export_changeset(conn, synced)
+        if data is None:
+            logging.info("No changes since the last sync")
+            return ""
+        name = f"{CHANGESET_PREFIX}{to_seq:012d}.jsonl.gz"
+        store.put(name, data)
+        with conn:
+            conn.execute("DELETE FROM ChangeLog WHERE seq <= ?", (to_seq,))
+            set_state(conn, "synced_seq", to_seq)
+        logging.info(f"Published changeset {name} (seq {synced + 1}..{to_seq}, {len(data) / 1024:.1f} KiB)")
+        return name
+    finally:
+        conn.close()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("pull", "push", "rebuild"))
+    parser.add_argument("--store", default=SYNC_STORE_URL, help="gs://bucket/prefix or a local directory")
+    parser.add_argument("--db", default=DATABASE_NAME, help="SQLite database path")
+    parser.add_argument("--snapshot-every", type=int, default=SNAPSHOT_EVERY,
+                        help="Publish a base snapshot after this many changesets")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    store = open_store(args.store)
+    try:
+        if args.command == "pull":
+            pull(store, args.db)
+        elif args.command == "push":
+            push(store, args.db, args.snapshot_every)
+        else:
+            seq = rebuild(store, args.db)
+            logging.info(f"Rebuilt {args.db} at seq {seq}")
+    except (SyncError, OSError, sqlite3.Error) as e:
+        logging.error(f"{args.command} failed: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
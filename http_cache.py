@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# --- Configuration ---
+HTTP_CACHE_PATH = os.environ.get("HTTP_CACHE_PATH", "http_cache.db")
+HTTP_CACHE_ENABLED = os.environ.get("HTTP_CACHE", "1") != "0"
+
+# How long a stored response is served without contacting the server, by URL
+# path fragment (first match wins). After that it is revalidated with
+# If-None-Match / If-Modified-Since, so an unchanged resource costs a 304.
+ENDPOINT_TTLS = (
+    # Charts are always revalidated: the scrapers stamp rows with today's date,
+    # so a cached copy of yesterday's chart must never be served unchecked.
+    ("/podcasts/top/", 0), # Apple RSS chart
+    ("/charts/top", 0), # Spotify chart
+    ("/lookup", 7 * 86400), # iTunes Lookup (feed URLs rarely change)
+    ("/search/", 86400), # PodcastIndex search/byterm, search/bytitle
+    ("/episodes/", 6 * 3600), # PodcastIndex episodes/byfeedid
+    ("/podcasts/by", 12 * 3600), # PodcastIndex podcasts/byfeedid, byfeedurl, byitunesid
+)
+DEFAULT_TTL = 0 # Anything else is always revalidated
+
+# Response headers kept with a cached body.
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+def cache_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Normalizes a URL plus query params (merged and sorted) into a cache key."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query.extend((str(k), str(v)) for k, v in params.items() if v is not None)
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(sorted(query)), ""))
+
+def ttl_for(url: str) -> int:
+    """Returns the freshness lifetime in seconds for a URL."""
+    path = urlsplit(url).path
+    for fragment, ttl in ENDPOINT_TTLS:
+        if fragment in path:
+            return ttl
+    return DEFAULT_TTL
+
+def _cached_response(key: str, headers: Dict[str, str], body: bytes) -> requests.Response:
+    """Builds a requests.Response for a body served from the cache."""
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.headers = CaseInsensitiveDict(headers)
+    response.url = key
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers) or "utf-8"
+    response.from_cache = True
+    return response
+
+class HttpCache:
+    """
+    Persistent HTTP response cache in a small SQLite file.
+
+    Bodies are stored zlib-compressed with their validators (ETag/Last-Modified).
+    A connection lock makes one instance safe to share across worker threads.
+    """
+
+    def __init__(self, path: str = HTTP_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS HttpCache (
+                cache_key TEXT PRIMARY KEY,
+                headers TEXT NOT NULL, -- JSON of STORED_HEADERS present in the response
+                body BLOB NOT NULL, -- zlib-compressed response body
+                fetched_at INTEGER NOT NULL, -- Last time the server confirmed this body (200 or 304)
+                ttl INTEGER NOT NULL
+            )
+        ''')
+        self._conn.commit()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _load(self, key: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT headers, body, fetched_at, ttl FROM HttpCache WHERE cache_key = ?", (key,)
+            ).fetchone()
+
+    def fresh_response(self, url: str, params: Optional[Dict[str, Any]] = None) -> Optional[requests.Response]:
+        """Returns the cached response if it is still within its TTL, else None."""
+        key = cache_key(url, params)
+        row = self._load(key)
+        if row is None:
+            return None
+        headers, body, fetched_at, ttl = row
+        # A TTL lowered since the entry was stored applies to it at once.
+        if time.time() - fetched_at >= min(ttl, ttl_for(url)):
+            return None
+        self.hits += 1
+        return _cached_response(key, json.loads(headers), zlib.decompress(body))
+
+    def validators(self, url: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+        """Returns conditional-request headers for a stale entry (empty if none is stored)."""
+        row = self._load(cache_key(url, params))
+        if row is None:
+            return {}
+        stored = CaseInsensitiveDict(json.loads(row[0]))
+        conditional = {}
+        if stored.get("ETag"):
+            conditional["If-None-Match"] = stored["ETag"]
+        if stored.get("Last-Modified"):
+            conditional["If-Modified-Since"] = stored["Last-Modified"]
+        return conditional
+
+    def update(self, url: str, params: Optional[Dict[str, Any]], response: requests.Response) -> requests.Response:
+        """
+        Records a network response and returns the response the caller should use.
+
+        A 304 refreshes the stored entry and returns its body as a 200; a cacheable
+        200 is stored; anything else is returned unchanged.
+        """
+        key = cache_key(url, params)
+        now = int(time.time())
+        if response.status_code == 304:
+            row = self._load(key)
+            if row is not None:
+                with self._lock:
+                    self._conn.execute("UPDATE HttpCache SET fetched_at = ? WHERE cache_key = ?", (now, key))
+                    self._conn.commit()
+                self.revalidated += 1
+                return _cached_response(key, json.loads(row[0]), zlib.decompress(row[1]))
+            return response
+
+        self.misses += 1
+        if response.status_code != 200 or "no-store" in response.headers.get("Cache-Control", ""):
+            return response
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO HttpCache (cache_key, headers, body, fetched_at, ttl) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(headers), zlib.compress(response.content), now, ttl_for(url)),
+            )
+            self._conn.commit()
+        return response
+
+    def stats(self) -> str:
+        return f"{self.hits} fresh hits, {self.revalidated} revalidated (304), {self.misses} downloads"
+
+_shared_cache: Optional[HttpCache] = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache() -> Optional[HttpCache]:
+    """Returns the process-wide cache, or None when HTTP_CACHE=0."""
+    global _shared_cache
+    if not HTTP_CACHE_ENABLED:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            try:
+                _shared_cache = HttpCache()
+            except sqlite3.Error as e:
+                logging.warning(f"HTTP cache disabled, could not open {HTTP_CACHE_PATH}: {e}")
+                return None
+        return _shared_cache
@@ -0,0 +1,368 @@
+"""
+Append-only archive of raw API responses, shipped as one segment per run.
+
+    python payload_archive.py push --store gs://bucket/payload-archive --segment-id 123-1
+    python payload_archive.py pull --store gs://bucket/payload-archive --archive full.db
+
+Each run archives into a fresh payload_archive.db holding only its own fetches.
+`push` uploads it as a new gzipped segment object; no existing object is ever
+replaced, so the daily transfer is one run's payloads rather than the whole
+history. `pull` merges every segment not yet merged into a local archive, e.g.
+to replay a run (PIPELINE_REPLAY) or analyse the history.
+
+Store layout:
+    segments/<UTC time>-<segment id>.db.gz   one run's Payloads and PayloadBlobs
+"""
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+from delta_sync import open_store
+
+try:
+    import zstandard # Optional: smaller archive and faster decompression when installed
+except ImportError:
+    zstandard = None
+
+# --- Configuration ---
+PAYLOAD_ARCHIVE_PATH = os.environ.get("PAYLOAD_ARCHIVE_PATH", "payload_archive.db")
+PAYLOAD_ARCHIVE_ENABLED = os.environ.get("PAYLOAD_ARCHIVE", "1") != "0"
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 19
+PAYLOAD_ARCHIVE_STORE_URL = os.environ.get("PAYLOAD_ARCHIVE_STORE_URL", "payload-archive") # gs://bucket/prefix, or a local directory
+LOG_LEVEL = logging.INFO
+
+SEGMENT_PREFIX = "segments/"
+
+# Hostname fragment -> archive source name (anything else uses the hostname).
+SOURCES = (
+    ("podcastindex.org", "podcastindex"),
+    ("itunes.apple.com", "itunes"),
+    ("marketingtools.apple.com", "apple"),
+    ("byspotify.com", "spotify"),
+)
+
+def source_for(url: str) -> str:
+    """Maps a request URL to its archive source name."""
+    host = urlsplit(url).netloc.lower()
+    for fragment, source in SOURCES:
+        if fragment in host:
+            return source
+    return host
+
+def _compress(body: bytes):
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return "zlib", zlib.compress(body, ZLIB_LEVEL)
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This payload is zstd-compressed; install 'zstandard' to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown payload codec '{codec}'")
+
+class PayloadArchive:
+    """
+    Append-only archive of raw API response bodies, in a SQLite file. A run's
+    archive is published as one segment (push_segment) and segments are merged
+    back into a full archive with pull_segments.
+
+    Every fetch is one small Payloads row indexed by (source, endpoint, key,
+    fetched_at). Bodies are compressed and content-addressed in PayloadBlobs, so
+    a response that has not changed since an earlier fetch in the same archive
+    adds no body bytes. Triggers reject UPDATE and DELETE on both tables.
+    """
+
+    def __init__(self, path: str = PAYLOAD_ARCHIVE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS PayloadBlobs (
+                body_hash TEXT PRIMARY KEY, -- SHA-256 of the uncompressed body
+                codec TEXT NOT NULL, -- 'zstd' or 'zlib'
+                body BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS Payloads (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL, -- 'apple', 'spotify', 'itunes', 'podcastindex', ...
+                endpoint TEXT NOT NULL, -- e.g. 'podcasts/byfeedid', 'charts/top'
+                key TEXT NOT NULL, -- Normalized request URL (same as the HTTP cache key)
+                fetched_at INTEGER NOT NULL,
+                status INTEGER NOT NULL,
+                content_type TEXT,
+                body_hash TEXT NOT NULL REFERENCES PayloadBlobs (body_hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_payloads_source_endpoint_key
+                ON Payloads (source, endpoint, key, fetched_at);
+            CREATE INDEX IF NOT EXISTS idx_payloads_key ON Payloads (key, fetched_at);
+            CREATE TRIGGER IF NOT EXISTS payloads_append_only_update BEFORE UPDATE ON Payloads
+                BEGIN SELECT RAISE(ABORT, 'Payloads is append-only'); END;
+            CREATE TRIGGER IF NOT EXISTS payloads_append_only_delete BEFORE DELETE ON Payloads
+                BEGIN SELECT RAISE(ABORT, 'Payloads is append-only'); END;
+            CREATE TRIGGER IF NOT EXISTS payload_blobs_append_only_update BEFORE UPDATE ON PayloadBlobs
+                BEGIN SELECT RAISE(ABORT, 'PayloadBlobs is append-only'); END;
+            CREATE TRIGGER IF NOT EXISTS payload_blobs_append_only_delete BEFORE DELETE ON PayloadBlobs
+                BEGIN SELECT RAISE(ABORT, 'PayloadBlobs is append-only'); END;
+            CREATE TABLE IF NOT EXISTS MergedSegments (
+                name TEXT PRIMARY KEY, -- Store object name of a segment merged by `pull`
+                payloads INTEGER NOT NULL,
+                merged_at INTEGER NOT NULL
+            );
+        ''')
+        self._conn.commit()
+
+    def append(
+        self,
+        source: str,
+        endpoint: str,
+        key: str,
+        body: bytes,
+        status: int = 200,
+        content_type: Optional[str] = None,
+        fetched_at: Optional[int] = None,
+    ):
+        """Appends one fetched response body to the archive."""
+        body_hash = hashlib.sha256(body).hexdigest()
+        fetched_at = int(time.time()) if fetched_at is None else fetched_at
+        with self._lock:
+            with self._conn:
+                exists = self._conn.execute(
+                    "SELECT 1 FROM PayloadBlobs WHERE body_hash = ?", (body_hash,)
+                ).fetchone()
+                if not exists:
+                    codec, data = _compress(body)
+                    self._conn.execute(
+                        "INSERT INTO PayloadBlobs (body_hash, codec, body) VALUES (?, ?, ?)",
+                        (body_hash, codec, data),
+                    )
+                self._conn.execute(
+                    "INSERT INTO Payloads (source, endpoint, key, fetched_at, status, content_type, body_hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (source, endpoint, key, fetched_at, status, content_type, body_hash),
+                )
+
+    def iter_payloads(
+        self,
+        source: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        key: Optional[str] = None,
+        since: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields archived payloads in fetch order, with decompressed bodies.
+
+        Args:
+            source, endpoint, key: Optional exact-match filters.
+            since: Only payloads fetched at or after this Unix time.
+        """
+        clauses, args = [], []
+        for column, value in (("source", source), ("endpoint", endpoint), ("key", key)):
+            if value is not None:
+                clauses.append(f"p.{column} = ?")
+                args.append(value)
+        if since is not None:
+            clauses.append("p.fetched_at >= ?")
+            args.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(f'''
+                SELECT p.source, p.endpoint, p.key, p.fetched_at, p.status, p.content_type, b.codec, b.body
+                FROM Payloads p JOIN PayloadBlobs b ON b.body_hash = p.body_hash
+                {where} ORDER BY p.id
+            ''', args).fetchall()
+        for source_, endpoint_, key_, fetched_at, status, content_type, codec, data in rows:
+            yield {
+                "source": source_,
+                "endpoint": endpoint_,
+                "key": key_,
+                "fetched_at": fetched_at,
+                "status": status,
+                "content_type": content_type,
+                "body": _decompress(codec, data),
+            }
+
+    def latest(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the most recent payload recorded for a request key, or None."""
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT p.status, p.content_type, b.codec, b.body
+                FROM Payloads p JOIN PayloadBlobs b ON b.body_hash = p.body_hash
+                WHERE p.key = ? ORDER BY p.fetched_at DESC, p.id DESC LIMIT 1
+            ''', (key,)).fetchone()
+        if row is None:
+            return None
+        status, content_type, codec, data = row
+        return {"status": status, "content_type": content_type, "body": _decompress(codec, data)}
+
+    def count(self) -> int:
+        """Returns the number of archived payloads."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM Payloads").fetchone()[0]
+
+    def merged_segments(self) -> List[str]:
+        """Returns the names of the segments already merged into this archive."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT name FROM MergedSegments ORDER BY name")]
+
+    def merge_segment(self, name: str, data: bytes) -> int:
+        """
+        Appends the payloads of one gzipped segment, in their fetch order.
+
+        Blobs already in the archive are not stored again. A segment is merged
+        at most once; merging it again is a no-op.
+
+        Returns:
+            The number of payloads added.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "segment.db")
+            with open(path, "wb") as f:
+                f.write(gzip.decompress(data))
+            with self._lock:
+                self._conn.execute("ATTACH DATABASE ? AS segment", (path,))
+                try:
+                    with self._conn:
+                        if self._conn.execute("SELECT 1 FROM MergedSegments WHERE name = ?", (name,)).fetchone():
+                            return 0
+                        self._conn.execute(
+                            "INSERT OR IGNORE INTO PayloadBlobs (body_hash, codec, body) "
+                            "SELECT body_hash, codec, body FROM segment.PayloadBlobs"
+                        )
+                        added = self._conn.execute('''
+                            INSERT INTO Payloads (source, endpoint, key, fetched_at, status, content_type, body_hash)
+                            SELECT source, endpoint, key, fetched_at, status, content_type, body_hash
+                            FROM segment.Payloads ORDER BY id
+                        ''').rowcount
+                        self._conn.execute(
+                            "INSERT INTO MergedSegments (name, payloads, merged_at) VALUES (?, ?, ?)",
+                            (name, added, int(time.time())),
+                        )
+                finally:
+                    self._conn.execute("DETACH DATABASE segment")
+        return added
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_shared_archive: Optional[PayloadArchive] = None
+_shared_archive_lock = threading.Lock()
+
+def get_shared_archive() -> Optional[PayloadArchive]:
+    """Returns the process-wide archive, or None when PAYLOAD_ARCHIVE=0."""
+    global _shared_archive
+    if not PAYLOAD_ARCHIVE_ENABLED:
+        return None
+    with _shared_archive_lock:
+        if _shared_archive is None:
+            try:
+                _shared_archive = PayloadArchive()
+            except sqlite3.Error as e:
+                logging.warning(f"Payload archive disabled, could not open {PAYLOAD_ARCHIVE_PATH}: {e}")
+                return None
+        return _shared_archive
+
+# --- Segments ---
+
+def push_segment(store, path: str = PAYLOAD_ARCHIVE_PATH, segment_id: str = "") -> str:
+    """
+    Uploads the archive at `path` as a new segment.
+
+    Args:
+        store: An object store from delta_sync.open_store.
+        path: The run's archive (only this run's payloads).
+        segment_id: Appended to the segment name, e.g. the CI run id, so
+            concurrent runs never pick the same name.
+
+    Returns:
+        The name of the uploaded segment, or "" if the archive is missing or empty.
+
+    Raises:
+        FileExistsError: if the store already has a segment with that name.
+    """
+    if not os.path.exists(path):
+        logging.info(f"No payload archive at {path}; nothing to push")
+        return ""
+    archive = PayloadArchive(path)
+    try:
+        payloads = archive.count()
+        if not payloads:
+            logging.info(f"Payload archive {path} is empty; nothing to push")
+            return ""
+        with tempfile.TemporaryDirectory() as tmp:
+            copy_path = os.path.join(tmp, "segment.db")
+            copy = sqlite3.connect(copy_path)
+            try:
+                archive._conn.backup(copy)
+                copy.execute("VACUUM")
+            finally:
+                copy.close()
+            with open(copy_path, "rb") as f:
+                data = gzip.compress(f.read())
+    finally:
+        archive.close()
+
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    name = f"{SEGMENT_PREFIX}{stamp}{'-' + segment_id if segment_id else ''}.db.gz"
+    if name in store.list(SEGMENT_PREFIX):
+        raise FileExistsError(f"Payload archive segment {name} already exists")
+    store.put(name, data)
+    logging.info(f"Published payload archive segment {name} ({payloads} payloads, {len(data) / 1024:.0f} KiB)")
+    return name
+
+def pull_segments(store, path: str) -> int:
+    """
+    Merges every segment in the store that is not yet in the archive at `path`
+    (created if missing), oldest first.
+
+    Returns:
+        The number of segments merged.
+    """
+    archive = PayloadArchive(path)
+    try:
+        merged = set(archive.merged_segments())
+        pending = [name for name in store.list(SEGMENT_PREFIX) if name not in merged]
+        for name in pending:
+            added = archive.merge_segment(name, store.get(name))
+            logging.info(f"Merged {name} ({added} payloads)")
+        logging.info(f"Merged {len(pending)} segments into {path} ({archive.count()} payloads)")
+        return len(pending)
+    finally:
+        archive.close()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("push", "pull"))
+    parser.add_argument("--store", default=PAYLOAD_ARCHIVE_STORE_URL, help="gs://bucket/prefix or a local directory")
+    parser.add_argument("--archive", default=PAYLOAD_ARCHIVE_PATH, help="Archive to push, or to merge segments into")
+    parser.add_argument("--segment-id", default="", help="Suffix for the pushed segment's name, e.g. the CI run id")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    store = open_store(args.store)
+    try:
+        if args.command == "push":
+            push_segment(store, args.archive, args.segment_id)
+        else:
+            pull_segments(store, args.archive)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Payload archive {args.command} failed: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
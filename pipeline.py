@@ -0,0 +1,139 @@
+"""
+Runs any subset of the daily pipeline stages in one process.
+
+    python pipeline.py                          # apple spotify movers enrich (the daily run)
+    python pipeline.py apple spotify            # charts only
+    python pipeline.py regions enrich --regions us,gb,ca
+
+Stages always run in pipeline order (charts before enrichment) and share one
+HTTP session, one HTTP cache and one podcasts.db connection. Each stage is
+timed; the run stops at the first stage that raises and exits non-zero.
+"""
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import chart_movers
+import scrape_all_regions
+import scrape_apple_top100
+import scrape_spotify_top100
+import update_all_podcast_details
+from podcast_client import get_response_cache
+
+# --- Configuration ---
+DATABASE_NAME = "podcasts.db"
+DEFAULT_STAGES = ("apple", "spotify", "movers", "enrich")
+LOG_LEVEL = logging.INFO
+
+# --- Stages ---
+
+def run_apple(conn: sqlite3.Connection, args: argparse.Namespace) -> str:
+    records = scrape_apple_top100.scrape_apple_top_podcasts(args.region)
+    scrape_apple_top100.save_chart_data_to_db(records, conn=conn)
+    return f"{len(records)} Apple rows"
+
+def run_spotify(conn: sqlite3.Connection, args: argparse.Namespace) -> str:
+    records = scrape_spotify_top100.scrape_spotify_top100(args.region)
+    scrape_spotify_top100.save_to_db(records, conn=conn)
+    return f"{len(records)} Spotify rows"
+
+def run_regions(conn: sqlite3.Connection, args: argparse.Namespace) -> str:
+    counts = scrape_all_regions.scrape_all_regions(args.regions, conn=conn)
+    return f"{sum(counts.values())} rows across {len(counts)} charts"
+
+def run_movers(conn: sqlite3.Connection, args: argparse.Namespace) -> str:
+    totals = chart_movers.update_chart_events(conn, full=args.full_movers)
+    days = totals.pop("days", 0)
+    return f"{sum(totals.values())} chart events for {days} chart days ({dict(totals) or 'none new'})"
+
+def run_enrich(conn: sqlite3.Connection, args: argparse.Namespace) -> str:
+    if update_all_podcast_details.api_keys_missing():
+        raise RuntimeError("Podcast Index API keys not found in environment variables")
+    update_all_podcast_details.update_all_podcast_details(
+        mode=args.mode, concurrency=args.concurrency, refresh_mode=args.refresh_mode, conn=conn,
+    )
+    return "enrichment finished"
+
+# Pipeline order; requested stages always run in this order.
+STAGES: Dict[str, Callable[[sqlite3.Connection, argparse.Namespace], str]] = {
+    "apple": run_apple,
+    "spotify": run_spotify,
+    "regions": run_regions,
+    "movers": run_movers,
+    "enrich": run_enrich,
+}
+
+def run_pipeline(stages: Sequence[str], conn: sqlite3.Connection, args: argparse.Namespace) -> Dict[str, float]:
+    """
+    Runs the requested stages in pipeline order on one connection.
+
+    Args:
+        stages: Stage names (keys of STAGES).
+        conn: The shared podcasts.db connection.
+        args: Parsed CLI options the stages read.
+
+    Returns:
+        A dict mapping each stage that ran to its wall time in seconds.
+
+    Raises:
+        Whatever the failing stage raised; later stages are not run.
+    """
+    timings: Dict[str, float] = {}
+    for name in (stage for stage in STAGES if stage in stages):
+        logging.info(f"=== Stage '{name}' starting ===")
+        start = time.perf_counter()
+        try:
+            summary = STAGES[name](conn, args)
+        finally:
+            timings[name] = time.perf_counter() - start
+        logging.info(f"=== Stage '{name}' finished in {timings[name]:.1f}s: {summary} ===")
+    return timings
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stages", nargs="*", metavar="stage",
+                        help=f"Stages to run: {', '.join(STAGES)} (default: {' '.join(DEFAULT_STAGES)})")
+    parser.add_argument("--db", default=DATABASE_NAME, help="SQLite database path")
+    parser.add_argument("--region", default=scrape_apple_top100.DEFAULT_APPLE_REGION,
+                        help="Region for the single-region apple/spotify stages")
+    parser.add_argument("--regions", type=lambda value: [r.strip().lower() for r in value.split(",") if r.strip()],
+                        default=scrape_all_regions.CHART_REGIONS, help="Comma-separated regions for the regions stage")
+    parser.add_argument("--full-movers", action="store_true", help="Recompute chart events for every chart day")
+    parser.add_argument("--mode", choices=update_all_podcast_details.ENRICH_MODES, default=update_all_podcast_details.ENRICH_MODE)
+    parser.add_argument("--concurrency", type=int, default=update_all_podcast_details.ENRICH_CONCURRENCY)
+    parser.add_argument("--refresh-mode", choices=update_all_podcast_details.REFRESH_MODES,
+                        default=update_all_podcast_details.REFRESH_MODE)
+    args = parser.parse_args(argv)
+    unknown = [stage for stage in args.stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s) {', '.join(unknown)}; expected any of {', '.join(STAGES)}")
+    args.stages = args.stages or list(DEFAULT_STAGES)
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Pipeline starting: {' '.join(s for s in STAGES if s in args.stages)} (database {args.db})")
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(args.db)
+    try:
+        timings = run_pipeline(args.stages, conn, args)
+    except Exception:
+        logging.exception("Pipeline stage failed")
+        return 1
+    finally:
+        conn.close()
+
+    cache = get_response_cache()
+    if cache:
+        logging.info(f"HTTP cache: {cache.stats()}")
+    breakdown = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items())
+    logging.info(f"Pipeline finished in {time.perf_counter() - start:.1f}s ({breakdown})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,442 @@
+import contextlib
+import contextvars
+import hashlib
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import HttpCache, cache_key, get_shared_cache
+from payload_archive import get_shared_archive, source_for
+from replay_transport import get_replay_adapter, replay_active
+
+# --- Configuration ---
+USER_AGENT = "PodcastDashboard/1.2 (Python Script)"
+PODCASTINDEX_BASE_URL = "https://api.podcastindex.org/api/1.0/"
+# Keep at least as many pooled connections per host as concurrent workers
+# (enrichment threads, or per-region chart requests to one host).
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32"))
+DEFAULT_RETRY_AFTER = 5 # Seconds to back off on a 429 without a usable Retry-After
+
+# Per-call timeouts and retry policy for PodcastIndex requests.
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+BACKOFF_BASE = 0.5 # Seconds; attempt n waits up to BACKOFF_BASE * 2**n
+BACKOFF_CAP = 8.0
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+# --- Shared Session ---
+
+def create_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Builds a requests.Session with a keep-alive connection pool and compressed transfers.
+
+    Args:
+        pool_size: Maximum number of pooled connections kept open per host.
+
+    Returns:
+        A configured requests.Session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    _mount_replay(session)
+    session.headers.update({
+        "User-Agent": USER_AGENT,
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
+
+def _mount_replay(session: requests.Session):
+    """Routes every request on `session` to the replay transport when replay mode is on."""
+    replay = get_replay_adapter()
+    if replay is not None and session.get_adapter("http://") is not replay:
+        session.mount("https://", replay)
+        session.mount("http://", replay)
+
+_shared_session: Optional[requests.Session] = None
+_shared_session_lock = threading.Lock()
+
+def get_shared_session() -> requests.Session:
+    """Returns the process-wide session used by the scrapers and the PodcastIndex client."""
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = create_session()
+        else:
+            _mount_replay(_shared_session) # Replay may have been enabled after creation
+        return _shared_session
+
+def get_response_cache() -> Optional[HttpCache]:
+    """Returns the shared HTTP cache, or None when it is disabled or responses are replayed."""
+    return None if replay_active() else get_shared_cache()
+
+# --- Call Timing ---
+
+class CallStats:
+    """Thread-safe per-endpoint record of network call latencies (cache hits are not calls)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, List[float]] = {}
+        self._errors: Dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, status: Optional[int]):
+        """Records one attempt; status is None when it raised (timeout, connection error)."""
+        with self._lock:
+            self._latencies.setdefault(endpoint, []).append(seconds)
+            if status is None or status >= 400:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+            self._errors.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns {endpoint: {"calls", "errors", "p50", "p95", "p99", "max"}} with
+        latencies in seconds, plus an "all" entry across every endpoint.
+        """
+        with self._lock:
+            groups = {endpoint: sorted(values) for endpoint, values in self._latencies.items()}
+            errors = dict(self._errors)
+        if groups:
+            groups["all"] = sorted(v for values in groups.values() for v in values)
+            errors["all"] = sum(errors.values())
+        return {
+            endpoint: {
+                "calls": len(values),
+                "errors": errors.get(endpoint, 0),
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "p99": _percentile(values, 99),
+                "max": values[-1],
+            }
+            for endpoint, values in groups.items()
+        }
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+call_stats = CallStats()
+
+def _timed_get(session: requests.Session, endpoint: str, url: str, **kwargs) -> requests.Response:
+    """session.get() that records the attempt's latency in call_stats."""
+    start = time.perf_counter()
+    status = None
+    try:
+        response = session.get(url, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        call_stats.record(endpoint, time.perf_counter() - start, status)
+
+def archive_response(
+    url: str,
+    params: Optional[Dict[str, Any]],
+    response: requests.Response,
+    endpoint: Optional[str] = None,
+):
+    """Appends a freshly downloaded 200 body to the shared payload archive."""
+    archive = None if replay_active() else get_shared_archive()
+    if archive is None or response.status_code != 200 or getattr(response, "from_cache", False):
+        return
+    try:
+        archive.append(
+            source_for(url),
+            endpoint or urlsplit(url).path.strip("/"),
+            cache_key(url, params),
+            response.content,
+            status=response.status_code,
+            content_type=response.headers.get("Content-Type"),
+        )
+    except sqlite3.Error as e:
+        logging.warning(f"Could not archive response from {url}: {e}")
+
+def http_get(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Any = 10,
+    endpoint: Optional[str] = None,
+) -> requests.Response:
+    """
+    GETs a URL on the shared session through the shared on-disk HTTP cache.
+
+    A fresh cached response is returned without a request; a stale one is
+    revalidated with a conditional GET (a 304 comes back as the cached 200).
+    Downloaded bodies are appended to the payload archive.
+
+    Args:
+        url: The URL, optionally with a query string.
+        params: Extra query parameters.
+        headers: Extra request headers.
+        timeout: requests timeout (seconds or a (connect, read) tuple).
+        endpoint: Archive endpoint name (defaults to the URL path).
+
+    Returns:
+        A requests.Response (with `from_cache = True` when served from the cache).
+    """
+    cache = get_response_cache()
+    if cache:
+        cached = cache.fresh_response(url, params)
+        if cached is not None:
+            return cached
+        headers = {**(headers or {}), **cache.validators(url, params)}
+    response = _timed_get(
+        get_shared_session(), endpoint or urlsplit(url).path.strip("/"), url,
+        params=params, headers=headers, timeout=timeout,
+    )
+    archive_response(url, params, response, endpoint)
+    return cache.update(url, params, response) if cache else response
+
+# --- Deadlines ---
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised when the current request deadline leaves no time for another attempt."""
+
+# Absolute time.monotonic() deadline for requests made in the current context
+# (one enrichment worker thread handles one title at a time).
+_request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+@contextlib.contextmanager
+def request_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Bounds the total time of every client request made inside the block.
+
+    Nested deadlines never extend an outer one. None leaves the current deadline as is.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    outer = _request_deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current deadline, or None if there is no deadline."""
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def request_timeout() -> Tuple[float, float]:
+    """Returns the (connect, read) timeout for the next call, clipped to the current deadline."""
+    remaining = remaining_time()
+    if remaining is None:
+        return CONNECT_TIMEOUT, READ_TIMEOUT
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining)
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for retry number `attempt` (0-based)."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+# --- Rate Limiting ---
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `burst` saved up."""
+
+    def __init__(self, rate: float, burst: int):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be > 0 and burst must be >= 1")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        Blocks until a token is available, then takes it.
+
+        Args:
+            timeout: Longest time to wait, e.g. the time left before the request
+                deadline. None waits as long as it takes.
+
+        Raises:
+            DeadlineExceeded: if the next token (or the end of a pause) is further
+                away than `timeout`. It is raised before waiting, not after.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded(f"Rate limiter wait of {wait:.2f}s would pass the request deadline")
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for `seconds` (e.g. after a 429) and empties the bucket."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """Returns the Retry-After header (delta-seconds or HTTP date) as seconds to wait."""
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+# --- PodcastIndex Client ---
+
+class PodcastIndexClient:
+    """
+    PodcastIndex API client on a pooled keep-alive session.
+
+    Auth headers are rebuilt at most once per second (X-Auth-Date has one-second
+    resolution), every live request goes through the optional shared rate limiter
+    (replayed ones skip it), and
+    every call has connect/read timeouts, bounded retries and honors the current
+    request_deadline(). Responses go through the on-disk HTTP cache, so fresh
+    entries cost no request (and no rate-limit token) and stale ones a conditional GET.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        api_secret: str,
+        base_url: str = PODCASTINDEX_BASE_URL,
+        session: Optional[requests.Session] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_retries: int = MAX_RETRIES,
+        cache: Optional[HttpCache] = None,
+    ):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.base_url = base_url
+        self._session = session
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.cache = cache
+        self._auth_date = None
+        self._auth_headers: Dict[str, str] = {}
+        self._auth_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """The session given at construction, else the shared one (resolved on first use)."""
+        return self._session or get_shared_session()
+
+    def auth_headers(self) -> Dict[str, str]:
+        """Returns the authentication headers, reusing them within the same second."""
+        auth_date = str(int(time.time()))
+        with self._auth_lock:
+            if auth_date != self._auth_date:
+                auth_string = self.api_key + self.api_secret + auth_date
+                self._auth_headers = {
+                    "X-Auth-Key": self.api_key,
+                    "X-Auth-Date": auth_date,
+                    "Authorization": hashlib.sha1(auth_string.encode("utf-8")).hexdigest(),
+                }
+                self._auth_date = auth_date
+            return self._auth_headers
+
+    def get(self, endpoint: str, params: Dict[str, Any]) -> requests.Response:
+        """
+        GETs a PodcastIndex endpoint with timeouts, retries and the current deadline.
+
+        Connection errors, timeouts and 5xx responses are retried with jittered
+        exponential backoff. A 429 pauses the whole rate limiter for Retry-After
+        before retrying. No attempt, backoff, rate-limit wait or Retry-After pause
+        runs past the deadline set with request_deadline().
+
+        Args:
+            endpoint: Path relative to the API base URL, e.g. 'search/byterm'.
+            params: Query parameters.
+
+        Returns:
+            The final requests.Response (which may still be a 429/5xx once retries run out).
+
+        Raises:
+            requests.exceptions.RequestException: if the last attempt failed to
+                connect or timed out, or DeadlineExceeded if the deadline ran out.
+        """
+        url = self.base_url + endpoint
+        cache = self.cache if self.cache is not None else get_response_cache()
+        if cache:
+            cached = cache.fresh_response(url, params)
+            if cached is not None:
+                return cached
+        # Replayed responses never reach PodcastIndex, so pacing them would only
+        # measure the rate limit.
+        rate_limiter = None if replay_active() else self.rate_limiter
+        attempt = 0
+        while True:
+            if rate_limiter:
+                rate_limiter.acquire(remaining_time())
+            headers = self.auth_headers()
+            if cache:
+                headers = {**headers, **cache.validators(url, params)}
+            try:
+                response = _timed_get(self.session, endpoint, url, headers=headers, params=params, timeout=request_timeout())
+            except DeadlineExceeded:
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                logging.warning(f"{type(e).__name__} from {endpoint}, retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+            else:
+                if response.status_code == 429 and attempt < self.max_retries:
+                    delay = parse_retry_after(response.headers.get("Retry-After"))
+                    logging.warning(f"429 from {endpoint}, pausing requests for {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                    if rate_limiter:
+                        rate_limiter.pause(delay)
+                        remaining = remaining_time()
+                        if remaining is not None and remaining <= delay:
+                            raise DeadlineExceeded(f"Retry-After from {endpoint} would pass the request deadline")
+                        delay = 0 # acquire() waits out the pause
+                elif response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                    delay = backoff_delay(attempt)
+                    logging.warning(f"HTTP {response.status_code} from {endpoint}, retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+                else:
+                    archive_response(url, params, response, endpoint)
+                    return cache.update(url, params, response) if cache else response
+
+            remaining = remaining_time()
+            if remaining is not None and remaining <= delay:
+                raise DeadlineExceeded(f"Request deadline exceeded while retrying {endpoint}")
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,116 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from http_cache import cache_key
+from payload_archive import PayloadArchive
+
+# --- Configuration ---
+# Path of a payload archive to replay instead of using the network, e.g.
+# PIPELINE_REPLAY=payload_archive.db. Empty means live mode.
+REPLAY_ARCHIVE_PATH = os.environ.get("PIPELINE_REPLAY", "")
+# Simulated network time per replayed request: a fixed part plus uniform jitter.
+REPLAY_LATENCY_MS = float(os.environ.get("REPLAY_LATENCY_MS", "0"))
+REPLAY_JITTER_MS = float(os.environ.get("REPLAY_JITTER_MS", "0"))
+REPLAY_MISSING_STATUS = 404 # Returned for requests that were never recorded
+
+class ReplayAdapter(BaseAdapter):
+    """
+    requests transport adapter that answers every request from a payload archive.
+
+    The prepared request URL is normalized with the HTTP cache key function (the
+    same key the archive was recorded under) and the most recent recorded body is
+    returned. Requests that were never recorded get a 404, so a replayed run makes
+    the same decisions a live run would for a missing resource. Nothing touches
+    the network.
+    """
+
+    def __init__(self, archive: PayloadArchive, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        super().__init__()
+        self.archive = archive
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.replayed = 0
+        self.missing = 0
+        self._lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        delay_ms = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+        key = cache_key(request.url)
+        payload = self.archive.latest(key)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.connection = self
+        if payload is None:
+            with self._lock:
+                self.missing += 1
+            logging.debug(f"Replay: no recorded response for {key}")
+            response.status_code = REPLAY_MISSING_STATUS
+            response.reason = "Not Recorded"
+            response._content = b""
+            return response
+
+        with self._lock:
+            self.replayed += 1
+        response.status_code = payload["status"]
+        response.reason = "OK"
+        response._content = payload["body"]
+        if payload["content_type"]:
+            response.headers = CaseInsensitiveDict({"Content-Type": payload["content_type"]})
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers) or "utf-8"
+        return response
+
+    def close(self):
+        pass
+
+    def stats(self) -> str:
+        return f"{self.replayed} replayed, {self.missing} not recorded"
+
+_replay_adapter: Optional[ReplayAdapter] = None
+
+def enable_replay(
+    path: str,
+    latency_ms: float = REPLAY_LATENCY_MS,
+    jitter_ms: float = REPLAY_JITTER_MS,
+) -> ReplayAdapter:
+    """
+    Switches the process to replay mode.
+
+    The shared session and any session created afterwards answer from the archive
+    at `path`. While replaying, the HTTP cache and payload archiving are off so
+    every call goes through the replay transport and the archive is never written.
+
+    Args:
+        path: A payload archive recorded by a live run.
+        latency_ms: Fixed delay added to every replayed request.
+        jitter_ms: Extra uniformly random delay, 0..jitter_ms.
+
+    Returns:
+        The ReplayAdapter now in use.
+    """
+    global _replay_adapter
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Replay archive {path} does not exist")
+    _replay_adapter = ReplayAdapter(PayloadArchive(path), latency_ms, jitter_ms)
+    logging.info(f"Replay mode: serving responses from {path} (latency {latency_ms:g}ms + up to {jitter_ms:g}ms jitter)")
+    return _replay_adapter
+
+def get_replay_adapter() -> Optional[ReplayAdapter]:
+    """Returns the active ReplayAdapter (enabling PIPELINE_REPLAY on first use), or None in live mode."""
+    if _replay_adapter is None and REPLAY_ARCHIVE_PATH:
+        enable_replay(REPLAY_ARCHIVE_PATH)
+    return _replay_adapter
+
+def replay_active() -> bool:
+    return get_replay_adapter() is not None
@@ -0,0 +1,775 @@
+import logging
+import sqlite3
+import time
+from typing import Callable, List, Tuple
+
+# --- Configuration ---
+DEFAULT_REGION = "us" # Region assumed for chart rows stored before regions existed
+
+# --- Migrations ---
+# Every schema change is a numbered migration applied once, in order, inside one
+# transaction, and recorded in SchemaVersion. A migration is a frozen snapshot:
+# change the schema by appending a new one, never by editing an applied one.
+
+def _create_top100lists(conn: sqlite3.Connection, table_name: str):
+    conn.execute(f'''
+        CREATE TABLE {table_name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            platform TEXT NOT NULL,
+            region TEXT NOT NULL DEFAULT '{DEFAULT_REGION}',
+            rank INTEGER NOT NULL,
+            title TEXT,
+            podcast_id TEXT, -- Store as TEXT as IDs can be alphanumeric
+            date TEXT NOT NULL,
+            UNIQUE(platform, region, date, rank)
+        )
+    ''')
+
+def _create_change_triggers(conn: sqlite3.Connection, table_name: str):
+    """
+    (Re)creates the triggers that record every change to `table_name` in
+    ChangeLog: the row's primary key and, for inserts and updates, the whole
+    row as JSON. Re-run it after adding columns to a synced table.
+    """
+    info = list(conn.execute(f"PRAGMA table_info({table_name})"))
+    columns = [row[1] for row in info]
+    pk_columns = [row[1] for row in sorted((row for row in info if row[5]), key=lambda row: row[5])]
+    def key(alias): return "json_array(" + ", ".join(f"{alias}.{c}" for c in pk_columns) + ")"
+    def row(alias): return "json_object(" + ", ".join(f"'{c}', {alias}.{c}" for c in columns) + ")"
+    log = "INSERT INTO ChangeLog (table_name, op, row_key, row_data)"
+    for op in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS changelog_{table_name}_{op}")
+    conn.execute(f'''
+        CREATE TRIGGER changelog_{table_name}_insert AFTER INSERT ON {table_name} BEGIN
+            {log} VALUES ('{table_name}', 'upsert', {key("NEW")}, {row("NEW")});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER changelog_{table_name}_update AFTER UPDATE ON {table_name} BEGIN
+            {log} SELECT '{table_name}', 'delete', {key("OLD")}, NULL WHERE {key("OLD")} IS NOT {key("NEW")};
+            {log} VALUES ('{table_name}', 'upsert', {key("NEW")}, {row("NEW")});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER changelog_{table_name}_delete AFTER DELETE ON {table_name} BEGIN
+            {log} VALUES ('{table_name}', 'delete', {key("OLD")}, NULL);
+        END
+    ''')
+
+def _migrate_001_baseline(conn: sqlite3.Connection):
+    """
+    Brings any earlier podcasts.db to the baseline layout, keeping every row.
+
+    Top100Lists from before the region dimension is rebuilt with a region column
+    (existing rows tagged DEFAULT_REGION, unique key (platform, region, date, rank));
+    Podcasts gets the columns added after its original layout.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(Top100Lists)")}
+    if columns and "region" not in columns:
+        logging.info("Upgrading Top100Lists with a region column (existing rows tagged '%s')", DEFAULT_REGION)
+        _create_top100lists(conn, "Top100Lists_new")
+        conn.execute(f'''
+            INSERT INTO Top100Lists_new (id, platform, region, rank, title, podcast_id, date)
+            SELECT id, platform, '{DEFAULT_REGION}', rank, title, podcast_id, date FROM Top100Lists
+        ''')
+        # The view is recreated below, after the swap.
+        conn.execute("DROP VIEW IF EXISTS ChartPodcasts")
+        conn.execute("DROP TABLE Top100Lists")
+        conn.execute("ALTER TABLE Top100Lists_new RENAME TO Top100Lists")
+    elif not columns:
+        _create_top100lists(conn, "Top100Lists")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_top100lists_date_region ON Top100Lists (date, region)")
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Podcasts (
+            podcast_id INTEGER PRIMARY KEY,
+            title TEXT,
+            description TEXT,
+            feed_url TEXT,
+            image_url TEXT,
+            episode_count INTEGER,
+            avg_duration_last_10 INTEGER,
+            latest_episode_title TEXT,
+            last_update_time INTEGER,
+            categories TEXT,
+            podcast_guid TEXT,
+            original_url TEXT,
+            chart_title TEXT, -- Top100Lists title this row was resolved from
+            refreshed_at INTEGER -- Unix time this row was last fetched from the API
+        )
+    ''')
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(Podcasts)")}
+    for column, column_type in (("chart_title", "TEXT"), ("refreshed_at", "INTEGER")):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE Podcasts ADD COLUMN {column} {column_type}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_podcasts_chart_title ON Podcasts (chart_title)")
+
+    # Which feed each chart title resolved to.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS TitleResolutions (
+            chart_title TEXT NOT NULL,
+            platform TEXT NOT NULL,
+            feed_id INTEGER NOT NULL,
+            match_ratio REAL,
+            matched_endpoint TEXT, -- e.g. 'search/byterm' or 'search/bytitle'
+            resolved_at INTEGER NOT NULL,
+            PRIMARY KEY (chart_title, platform)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_title_resolutions_feed_id ON TitleResolutions (feed_id)")
+
+    # Negative cache of titles that searched without a good match.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ResolutionFailures (
+            chart_title TEXT PRIMARY KEY,
+            failure_count INTEGER NOT NULL,
+            best_ratio REAL,
+            first_failed_at INTEGER NOT NULL,
+            last_failed_at INTEGER NOT NULL,
+            next_retry_at INTEGER NOT NULL
+        )
+    ''')
+
+    # Enrichment run checkpoints.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS EnrichmentRuns (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at INTEGER NOT NULL,
+            finished_at INTEGER,
+            status TEXT NOT NULL, -- 'running', then 'completed' (or 'abandoned' if superseded)
+            mode TEXT,
+            refresh_mode TEXT,
+            total_titles INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS EnrichmentProgress (
+            run_id INTEGER NOT NULL REFERENCES EnrichmentRuns (run_id),
+            chart_title TEXT NOT NULL,
+            stage TEXT NOT NULL, -- Pipeline stage, e.g. 'enrich'
+            status TEXT NOT NULL, -- 'done', 'unresolved' (negative-cached) or 'error' (retried on resume)
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (run_id, chart_title, stage)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_enrichment_runs_status ON EnrichmentRuns (status, started_at)")
+
+    # Dashboard view: chart rows joined to their resolved feed on the
+    # TitleResolutions primary key, then to Podcasts on its integer key.
+    conn.execute("DROP VIEW IF EXISTS ChartPodcasts")
+    conn.execute('''
+        CREATE VIEW ChartPodcasts AS
+        SELECT
+            t.platform,
+            t.region,
+            t.rank,
+            t.date,
+            t.title AS chart_title,
+            t.podcast_id AS platform_podcast_id,
+            r.feed_id,
+            r.match_ratio,
+            p.title,
+            p.description,
+            p.feed_url,
+            p.image_url,
+            p.episode_count,
+            p.avg_duration_last_10,
+            p.latest_episode_title,
+            p.last_update_time,
+            p.categories,
+            p.podcast_guid
+        FROM Top100Lists t
+        LEFT JOIN TitleResolutions r ON r.chart_title = t.title AND r.platform = t.platform
+        LEFT JOIN Podcasts p ON p.podcast_id = r.feed_id
+    ''')
+
+def _migrate_002_access_path_indexes(conn: sqlite3.Connection):
+    """
+    Covering indexes for the pipeline's and the dashboard's lookups.
+
+    - Enrichment's per-title GROUP BY (title, platform, podcast_id, plus the
+      rowid for ORDER BY MIN(id)) is answered from idx_top100lists_title alone.
+    - SELECT DISTINCT title walks idx_top100lists_title instead of the table.
+    - Rank history by title or by platform id, and "latest chart" by
+      (platform, region, date), read only index pages.
+    """
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_top100lists_title
+            ON Top100Lists (title, platform, podcast_id, region, date, rank)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_top100lists_podcast_id
+            ON Top100Lists (podcast_id, platform, region, date, rank)
+    ''')
+    # (date, region) is superseded by a covering (date, platform, region, rank, title, podcast_id).
+    conn.execute("DROP INDEX IF EXISTS idx_top100lists_date_region")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_top100lists_date
+            ON Top100Lists (date, platform, region, rank, title, podcast_id)
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_podcasts_title ON Podcasts (title COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_podcasts_guid ON Podcasts (podcast_guid)")
+
+def _migrate_003_normalized_charts(conn: sqlite3.Connection):
+    """
+    Replaces the Top100Lists table with integer-keyed chart storage.
+
+    Each chart row becomes five small integers in ChartEntries (platform_id,
+    region_id, day, rank, show_id), a WITHOUT ROWID table clustered on its
+    (platform_id, region_id, day, rank) key. Platform names, region codes and
+    (platform show id, title) pairs are stored once in Platforms, Regions and
+    ChartShows. Days are counted from 1970-01-01.
+
+    Top100Lists becomes a view with the original columns. Its id is a key that
+    orders rows by (day, platform, region, rank), i.e. by first appearance. An
+    INSTEAD OF INSERT trigger accepts inserts in the old shape. ChartPodcasts
+    is rebuilt on the new tables.
+    """
+    conn.execute('''
+        CREATE TABLE Platforms (
+            platform_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    conn.executemany("INSERT INTO Platforms (platform_id, name) VALUES (?, ?)", [(1, "Apple"), (2, "Spotify")])
+    conn.execute('''
+        CREATE TABLE Regions (
+            region_id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE -- Two-letter region code, e.g. 'us'
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE ChartShows (
+            show_id INTEGER PRIMARY KEY, -- Surrogate key, assigned in order of first appearance
+            platform_id INTEGER NOT NULL REFERENCES Platforms (platform_id),
+            platform_show_id TEXT, -- Apple numeric id or Spotify show id, as scraped
+            title TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE UNIQUE INDEX idx_chart_shows_key
+            ON ChartShows (platform_id, COALESCE(platform_show_id, ''), COALESCE(title, ''))
+    ''')
+    conn.execute("CREATE INDEX idx_chart_shows_title ON ChartShows (title, platform_id, platform_show_id)")
+    conn.execute("CREATE INDEX idx_chart_shows_platform_show_id ON ChartShows (platform_show_id)")
+    conn.execute('''
+        CREATE TABLE ChartEntries (
+            platform_id INTEGER NOT NULL,
+            region_id INTEGER NOT NULL,
+            day INTEGER NOT NULL, -- Days since 1970-01-01
+            rank INTEGER NOT NULL,
+            show_id INTEGER NOT NULL,
+            PRIMARY KEY (platform_id, region_id, day, rank)
+        ) WITHOUT ROWID
+    ''')
+    # Rank history of one show without touching the table.
+    conn.execute("CREATE INDEX idx_chart_entries_show ON ChartEntries (show_id, day)")
+
+    # Copy the existing rows (ordered by id, so show_id follows first appearance).
+    conn.execute("INSERT OR IGNORE INTO Platforms (name) SELECT DISTINCT platform FROM Top100Lists ORDER BY platform")
+    conn.execute("INSERT INTO Regions (code) SELECT DISTINCT region FROM Top100Lists ORDER BY region")
+    conn.execute('''
+        INSERT INTO ChartShows (platform_id, platform_show_id, title)
+        SELECT p.platform_id, t.podcast_id, t.title
+        FROM Top100Lists t JOIN Platforms p ON p.name = t.platform
+        GROUP BY p.platform_id, COALESCE(t.podcast_id, ''), COALESCE(t.title, '')
+        ORDER BY MIN(t.id)
+    ''')
+    conn.execute('''
+        INSERT INTO ChartEntries (platform_id, region_id, day, rank, show_id)
+        SELECT p.platform_id, r.region_id, CAST(julianday(t.date) - 2440587.5 AS INTEGER), t.rank, s.show_id
+        FROM Top100Lists t
+        JOIN Platforms p ON p.name = t.platform
+        JOIN Regions r ON r.code = t.region
+        JOIN ChartShows s ON s.platform_id = p.platform_id
+            AND COALESCE(s.platform_show_id, '') = COALESCE(t.podcast_id, '')
+            AND COALESCE(s.title, '') = COALESCE(t.title, '')
+    ''')
+
+    conn.execute("DROP VIEW IF EXISTS ChartPodcasts")
+    conn.execute("DROP TABLE Top100Lists")
+    conn.execute('''
+        CREATE VIEW Top100Lists AS
+        SELECT
+            ((e.day * 256 + e.platform_id) * 4096 + e.region_id) * 1024 + e.rank AS id,
+            p.name AS platform,
+            r.code AS region,
+            e.rank,
+            s.title,
+            s.platform_show_id AS podcast_id,
+            date(e.day + 2440587.5) AS date
+        FROM ChartEntries e
+        JOIN Platforms p ON p.platform_id = e.platform_id
+        JOIN Regions r ON r.region_id = e.region_id
+        JOIN ChartShows s ON s.show_id = e.show_id
+    ''')
+    # Inserts in the old shape. Dimension rows are added with NOT EXISTS rather
+    # than OR IGNORE because an outer INSERT's conflict policy overrides the
+    # trigger's; an outer INSERT OR IGNORE still skips existing chart rows.
+    conn.execute(f'''
+        CREATE TRIGGER top100lists_insert INSTEAD OF INSERT ON Top100Lists
+        BEGIN
+            INSERT INTO Platforms (name)
+                SELECT NEW.platform WHERE NOT EXISTS (SELECT 1 FROM Platforms WHERE name = NEW.platform);
+            INSERT INTO Regions (code)
+                SELECT COALESCE(NEW.region, '{DEFAULT_REGION}')
+                WHERE NOT EXISTS (SELECT 1 FROM Regions WHERE code = COALESCE(NEW.region, '{DEFAULT_REGION}'));
+            INSERT INTO ChartShows (platform_id, platform_show_id, title)
+                SELECT p.platform_id, NEW.podcast_id, NEW.title FROM Platforms p
+                WHERE p.name = NEW.platform AND NOT EXISTS (
+                    SELECT 1 FROM ChartShows s
+                    WHERE s.platform_id = p.platform_id
+                      AND COALESCE(s.platform_show_id, '') = COALESCE(NEW.podcast_id, '')
+                      AND COALESCE(s.title, '') = COALESCE(NEW.title, ''));
+            INSERT INTO ChartEntries (platform_id, region_id, day, rank, show_id)
+                SELECT p.platform_id, r.region_id, CAST(julianday(NEW.date) - 2440587.5 AS INTEGER), NEW.rank, s.show_id
+                FROM Platforms p
+                JOIN Regions r ON r.code = COALESCE(NEW.region, '{DEFAULT_REGION}')
+                JOIN ChartShows s ON s.platform_id = p.platform_id
+                    AND COALESCE(s.platform_show_id, '') = COALESCE(NEW.podcast_id, '')
+                    AND COALESCE(s.title, '') = COALESCE(NEW.title, '')
+                WHERE p.name = NEW.platform;
+        END
+    ''')
+    conn.execute('''
+        CREATE VIEW ChartPodcasts AS
+        SELECT
+            pl.name AS platform,
+            rg.code AS region,
+            e.rank,
+            date(e.day + 2440587.5) AS date,
+            s.title AS chart_title,
+            s.platform_show_id AS platform_podcast_id,
+            r.feed_id,
+            r.match_ratio,
+            p.title,
+            p.description,
+            p.feed_url,
+            p.image_url,
+            p.episode_count,
+            p.avg_duration_last_10,
+            p.latest_episode_title,
+            p.last_update_time,
+            p.categories,
+            p.podcast_guid
+        FROM ChartEntries e
+        JOIN Platforms pl ON pl.platform_id = e.platform_id
+        JOIN Regions rg ON rg.region_id = e.region_id
+        JOIN ChartShows s ON s.show_id = e.show_id
+        LEFT JOIN TitleResolutions r ON r.chart_title = s.title AND r.platform = pl.name
+        LEFT JOIN Podcasts p ON p.podcast_id = r.feed_id
+    ''')
+
+def _migrate_004_show_identities(conn: sqlite3.Connection):
+    """
+    Adds the cross-platform show identity map.
+
+    CanonicalShows has one row per PodcastIndex feed. ShowIdentities maps each
+    known external id (id_type 'apple', 'spotify', 'podcastindex_feed',
+    'podcastindex_guid') to its canonical show. The map is seeded from the
+    title resolutions so far; a platform id resolved to several feeds keeps
+    the first.
+    """
+    conn.execute('''
+        CREATE TABLE CanonicalShows (
+            canonical_id INTEGER PRIMARY KEY,
+            feed_id INTEGER NOT NULL UNIQUE, -- PodcastIndex feed id
+            podcast_guid TEXT,
+            title TEXT,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE ShowIdentities (
+            id_type TEXT NOT NULL, -- 'apple', 'spotify', 'podcastindex_feed' or 'podcastindex_guid'
+            external_id TEXT NOT NULL,
+            canonical_id INTEGER NOT NULL REFERENCES CanonicalShows (canonical_id),
+            linked_at INTEGER NOT NULL,
+            PRIMARY KEY (id_type, external_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX idx_show_identities_canonical ON ShowIdentities (canonical_id, id_type)")
+
+    now = int(time.time())
+    conn.execute('''
+        INSERT INTO CanonicalShows (feed_id, podcast_guid, title, updated_at)
+        SELECT r.feed_id, p.podcast_guid, p.title, ?
+        FROM TitleResolutions r LEFT JOIN Podcasts p ON p.podcast_id = r.feed_id
+        GROUP BY r.feed_id ORDER BY MIN(r.resolved_at)
+    ''', (now,))
+    conn.execute('''
+        INSERT INTO ShowIdentities (id_type, external_id, canonical_id, linked_at)
+        SELECT 'podcastindex_feed', CAST(feed_id AS TEXT), canonical_id, ? FROM CanonicalShows
+    ''', (now,))
+    conn.execute('''
+        INSERT OR IGNORE INTO ShowIdentities (id_type, external_id, canonical_id, linked_at)
+        SELECT 'podcastindex_guid', podcast_guid, canonical_id, ? FROM CanonicalShows
+        WHERE podcast_guid IS NOT NULL ORDER BY canonical_id
+    ''', (now,))
+    conn.execute('''
+        INSERT OR IGNORE INTO ShowIdentities (id_type, external_id, canonical_id, linked_at)
+        SELECT lower(p.name), s.platform_show_id, c.canonical_id, ?
+        FROM ChartShows s
+        JOIN Platforms p ON p.platform_id = s.platform_id
+        JOIN TitleResolutions r ON r.chart_title = s.title AND r.platform = p.name
+        JOIN CanonicalShows c ON c.feed_id = r.feed_id
+        WHERE s.platform_show_id IS NOT NULL
+        ORDER BY r.resolved_at
+    ''', (now,))
+
+def _migrate_005_change_log(conn: sqlite3.Connection):
+    """
+    Adds the change log behind delta sync (see delta_sync.py).
+
+    Triggers on every synced table append the changed row to ChangeLog, whose
+    seq orders all changes. SyncState holds the sync bookkeeping (e.g. the last
+    seq published to the object store). Derived and bookkeeping tables
+    (SchemaVersion, sqlite_stat1, ChangeLog itself) are not synced.
+    """
+    conn.execute('''
+        CREATE TABLE ChangeLog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, -- Never reused, so it can order changesets
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL, -- 'upsert' or 'delete'
+            row_key TEXT NOT NULL, -- JSON array of the primary key values
+            row_data TEXT -- JSON object of the row after an upsert
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE SyncState (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    for table_name in (
+        "Platforms", "Regions", "ChartShows", "ChartEntries",
+        "Podcasts", "TitleResolutions", "ResolutionFailures",
+        "EnrichmentRuns", "EnrichmentProgress",
+        "CanonicalShows", "ShowIdentities",
+    ):
+        _create_change_triggers(conn, table_name)
+
+# Stable history key for a chart show: the first ChartShows row with the same
+# platform show id, so a renamed show keeps one series. `alias` is a ChartShows row.
+HISTORY_SHOW_ID_SQL = '''COALESCE((
+    SELECT MIN(o.show_id) FROM ChartShows o
+    WHERE o.platform_id = {alias}.platform_id AND o.platform_show_id = {alias}.platform_show_id
+), {alias}.show_id)'''
+# First day of the week (Monday) and of the month containing `day`, as day numbers.
+_WEEK_START = "({day} - ({day} + 3) % 7)"
+_MONTH_START = "CAST(julianday(date({day} + 2440587.5, 'start of month')) - 2440587.5 AS INTEGER)"
+_MONTH_END = "CAST(julianday(date({day} + 2440587.5, 'start of month', '+1 month')) - 2440587.5 AS INTEGER) - 1"
+
+def _migrate_006_rank_history(conn: sqlite3.Connection):
+    """
+    Adds per-show rank history, maintained by triggers on ChartEntries.
+
+    RankHistory has one row per (show, platform, region, day), with the show's
+    best rank that day. The show is its first ChartShows row for the same
+    platform show id, so renames keep one series. RankHistoryRollups holds
+    weekly and monthly summaries of the same series. Inserting a chart row
+    updates its day and the week and month containing it, in the same
+    transaction. Both tables are derived, so delta sync does not ship them:
+    replicas rebuild them as changesets are applied.
+    """
+    conn.execute('''
+        CREATE TABLE RankHistory (
+            show_id INTEGER NOT NULL, -- First ChartShows row for this platform show id
+            platform_id INTEGER NOT NULL,
+            region_id INTEGER NOT NULL,
+            day INTEGER NOT NULL, -- Days since 1970-01-01
+            rank INTEGER NOT NULL, -- Best rank that day
+            PRIMARY KEY (show_id, platform_id, region_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE RankHistoryRollups (
+            show_id INTEGER NOT NULL,
+            period TEXT NOT NULL, -- 'week' (starting Monday) or 'month'
+            platform_id INTEGER NOT NULL,
+            region_id INTEGER NOT NULL,
+            period_start INTEGER NOT NULL, -- Day number of the period's first day
+            days_charted INTEGER NOT NULL,
+            best_rank INTEGER NOT NULL,
+            worst_rank INTEGER NOT NULL,
+            avg_rank REAL NOT NULL,
+            PRIMARY KEY (show_id, period, platform_id, region_id, period_start)
+        ) WITHOUT ROWID
+    ''')
+
+    # Backfill from the chart rows so far.
+    conn.execute(f'''
+        INSERT INTO RankHistory (show_id, platform_id, region_id, day, rank)
+        SELECT {HISTORY_SHOW_ID_SQL.format(alias="s")}, e.platform_id, e.region_id, e.day, MIN(e.rank)
+        FROM ChartEntries e JOIN ChartShows s ON s.show_id = e.show_id
+        GROUP BY 1, e.platform_id, e.region_id, e.day
+    ''')
+    for period, start in (("week", _WEEK_START), ("month", _MONTH_START)):
+        conn.execute(f'''
+            INSERT INTO RankHistoryRollups
+                (show_id, period, platform_id, region_id, period_start, days_charted, best_rank, worst_rank, avg_rank)
+            SELECT show_id, '{period}', platform_id, region_id, {start.format(day="day")},
+                   COUNT(*), MIN(rank), MAX(rank), AVG(rank)
+            FROM RankHistory
+            GROUP BY show_id, platform_id, region_id, {start.format(day="day")}
+        ''')
+
+    # Incremental maintenance: the new day, then its week and month recomputed
+    # from at most 31 daily rows each.
+    history_show_id = HISTORY_SHOW_ID_SQL.format(alias="s")
+    rollups = "\n".join(f'''
+            INSERT INTO RankHistoryRollups
+                (show_id, period, platform_id, region_id, period_start, days_charted, best_rank, worst_rank, avg_rank)
+            SELECT h.show_id, '{period}', h.platform_id, h.region_id, {start.format(day="NEW.day")},
+                   COUNT(*), MIN(h.rank), MAX(h.rank), AVG(h.rank)
+            FROM ChartShows s JOIN RankHistory h
+                ON h.show_id = {history_show_id} AND h.platform_id = NEW.platform_id AND h.region_id = NEW.region_id
+                AND h.day BETWEEN {start.format(day="NEW.day")} AND {end.format(day="NEW.day")}
+            WHERE s.show_id = NEW.show_id
+            GROUP BY h.show_id, h.platform_id, h.region_id
+            ON CONFLICT (show_id, period, platform_id, region_id, period_start) DO UPDATE SET
+                days_charted = excluded.days_charted,
+                best_rank = excluded.best_rank,
+                worst_rank = excluded.worst_rank,
+                avg_rank = excluded.avg_rank;'''
+        for period, start, end in (
+            ("week", _WEEK_START, _WEEK_START + " + 6"),
+            ("month", _MONTH_START, _MONTH_END),
+        )
+    )
+    conn.execute(f'''
+        CREATE TRIGGER rank_history_insert AFTER INSERT ON ChartEntries BEGIN
+            INSERT INTO RankHistory (show_id, platform_id, region_id, day, rank)
+            SELECT {history_show_id}, NEW.platform_id, NEW.region_id, NEW.day, NEW.rank
+            FROM ChartShows s WHERE s.show_id = NEW.show_id
+            ON CONFLICT (show_id, platform_id, region_id, day) DO UPDATE SET rank = excluded.rank
+            WHERE excluded.rank < rank;
+            {rollups}
+        END
+    ''')
+
+def _migrate_007_chart_events(conn: sqlite3.Connection):
+    """
+    Adds ChartEvents, written by the movers stage (chart_movers.py).
+
+    It has one row per show per chart day, and one per show that dropped out
+    that day. Each row has the event against the previous snapshot, plus the
+    rank deltas against 1, 7 and 30 days earlier. Shows use the RankHistory
+    key. The table is synced, because replicas cannot derive it without
+    running the stage.
+    """
+    conn.execute('''
+        CREATE TABLE ChartEvents (
+            platform_id INTEGER NOT NULL,
+            region_id INTEGER NOT NULL,
+            day INTEGER NOT NULL, -- Days since 1970-01-01
+            show_id INTEGER NOT NULL, -- RankHistory show key
+            event TEXT NOT NULL, -- 'new', 'reentry', 'dropout', 'up', 'down' or 'same' vs the previous snapshot
+            rank INTEGER, -- NULL for dropouts
+            prev_rank INTEGER, -- Rank in the previous snapshot; NULL for entrants
+            delta_1d INTEGER, -- Places climbed since 1/7/30 days ago; NULL unless charted on both days
+            delta_7d INTEGER,
+            delta_30d INTEGER,
+            PRIMARY KEY (platform_id, region_id, day, show_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX idx_chart_events_day_event ON ChartEvents (day, event, platform_id, region_id)")
+    conn.execute("CREATE INDEX idx_chart_events_show ON ChartEvents (show_id, day)")
+    _create_change_triggers(conn, "ChartEvents")
+
+def _migrate_008_identity_link_provenance(conn: sqlite3.Connection):
+    """
+    Records how each ShowIdentities link was made, so that links from weak
+    title matches can be pruned (see show_identity.prune_identity_links).
+
+    link_method is the resolution endpoint ('podcasts/byitunesid',
+    'search/byterm', ...) or 'feed' for a feed's own id and GUID. match_ratio
+    is the title match ratio. Platform links are backfilled from their title
+    resolution. Links whose resolution only says 'identity' are left
+    unknown (NULL), because that endpoint hides how the show was first
+    matched. Those resolutions are dropped, so their titles resolve again.
+    """
+    conn.execute("ALTER TABLE ShowIdentities ADD COLUMN link_method TEXT")
+    conn.execute("ALTER TABLE ShowIdentities ADD COLUMN match_ratio REAL")
+    conn.execute("DELETE FROM TitleResolutions WHERE matched_endpoint = 'identity'")
+    conn.execute('''
+        UPDATE ShowIdentities SET link_method = 'feed', match_ratio = 1.0
+        WHERE id_type IN ('podcastindex_feed', 'podcastindex_guid')
+    ''')
+    conn.execute('''
+        UPDATE ShowIdentities SET (link_method, match_ratio) = (
+            SELECT r.matched_endpoint, r.match_ratio
+            FROM ChartShows s
+            JOIN Platforms p ON p.platform_id = s.platform_id
+            JOIN TitleResolutions r ON r.chart_title = s.title AND r.platform = p.name
+            JOIN CanonicalShows c ON c.feed_id = r.feed_id
+            WHERE lower(p.name) = ShowIdentities.id_type
+              AND s.platform_show_id = ShowIdentities.external_id
+              AND c.canonical_id = ShowIdentities.canonical_id
+            ORDER BY r.resolved_at DESC LIMIT 1
+        )
+        WHERE id_type NOT IN ('podcastindex_feed', 'podcastindex_guid')
+    ''')
+    _create_change_triggers(conn, "ShowIdentities")
+
+def _migrate_009_unsync_run_bookkeeping(conn: sqlite3.Connection):
+    """
+    Stops logging EnrichmentRuns and EnrichmentProgress in ChangeLog.
+
+    They are per-machine checkpoints for resuming an interrupted run, not
+    chart or enrichment data. A replica has no use for another machine's run
+    state, and progress rows made up a large part of every changeset.
+    Their triggers and logged changes are dropped.
+    """
+    for table_name in ("EnrichmentRuns", "EnrichmentProgress"):
+        for op in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS changelog_{table_name}_{op}")
+        conn.execute("DELETE FROM ChangeLog WHERE table_name = ?", (table_name,))
+
+def _migrate_010_show_keyed_resolutions(conn: sqlite3.Connection):
+    """
+    Keys TitleResolutions on the integer ChartShows.show_id instead of
+    (chart title, platform) text, so ChartPodcasts and the dashboard join
+    chart rows to their feed on an integer key.
+
+    Each chart show gets the resolution of its (title, platform). A chart show
+    added later inherits the resolution of an existing show with the same
+    platform and title (title_resolution_inherit trigger), as the text join did,
+    until enrichment resolves it itself.
+    """
+    conn.execute("DROP VIEW IF EXISTS ChartPodcasts")
+    conn.execute('''
+        CREATE TABLE TitleResolutions_new (
+            show_id INTEGER PRIMARY KEY REFERENCES ChartShows (show_id),
+            feed_id INTEGER NOT NULL,
+            match_ratio REAL,
+            matched_endpoint TEXT, -- e.g. 'podcasts/byitunesid' or 'search/byterm'
+            resolved_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO TitleResolutions_new (show_id, feed_id, match_ratio, matched_endpoint, resolved_at)
+        SELECT s.show_id, r.feed_id, r.match_ratio, r.matched_endpoint, r.resolved_at
+        FROM ChartShows s
+        JOIN Platforms p ON p.platform_id = s.platform_id
+        JOIN TitleResolutions r ON r.chart_title = s.title AND r.platform = p.name
+    ''')
+    conn.execute("DROP TABLE TitleResolutions")
+    conn.execute("ALTER TABLE TitleResolutions_new RENAME TO TitleResolutions")
+    conn.execute("CREATE INDEX idx_title_resolutions_feed_id ON TitleResolutions (feed_id)")
+    _create_change_triggers(conn, "TitleResolutions")
+    conn.execute('''
+        CREATE TRIGGER title_resolution_inherit AFTER INSERT ON ChartShows
+        WHEN NEW.title IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO TitleResolutions (show_id, feed_id, match_ratio, matched_endpoint, resolved_at)
+            SELECT NEW.show_id, r.feed_id, r.match_ratio, r.matched_endpoint, r.resolved_at
+            FROM ChartShows o JOIN TitleResolutions r ON r.show_id = o.show_id
+            WHERE o.title = NEW.title AND o.platform_id = NEW.platform_id AND o.show_id <> NEW.show_id
+            ORDER BY r.resolved_at DESC LIMIT 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE VIEW ChartPodcasts AS
+        SELECT
+            pl.name AS platform,
+            rg.code AS region,
+            e.rank,
+            date(e.day + 2440587.5) AS date,
+            s.title AS chart_title,
+            s.platform_show_id AS platform_podcast_id,
+            r.feed_id,
+            r.match_ratio,
+            p.title,
+            p.description,
+            p.feed_url,
+            p.image_url,
+            p.episode_count,
+            p.avg_duration_last_10,
+            p.latest_episode_title,
+            p.last_update_time,
+            p.categories,
+            p.podcast_guid
+        FROM ChartEntries e
+        JOIN Platforms pl ON pl.platform_id = e.platform_id
+        JOIN Regions rg ON rg.region_id = e.region_id
+        JOIN ChartShows s ON s.show_id = e.show_id
+        LEFT JOIN TitleResolutions r ON r.show_id = s.show_id
+        LEFT JOIN Podcasts p ON p.podcast_id = r.feed_id
+    ''')
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "Baseline tables, upgraded in place from earlier layouts", _migrate_001_baseline),
+    (2, "Covering indexes for pipeline and dashboard access paths", _migrate_002_access_path_indexes),
+    (3, "Normalized integer-keyed chart storage; Top100Lists becomes a view", _migrate_003_normalized_charts),
+    (4, "Cross-platform show identity map", _migrate_004_show_identities),
+    (5, "Change log and sync state for delta sync", _migrate_005_change_log),
+    (6, "Per-show rank history with weekly and monthly rollups", _migrate_006_rank_history),
+    (7, "Chart movers, entrants and dropouts", _migrate_007_chart_events),
+    (8, "How each show identity link was made", _migrate_008_identity_link_provenance),
+    (9, "Run checkpoints are no longer synced", _migrate_009_unsync_run_bookkeeping),
+    (10, "Title resolutions keyed on the chart show id", _migrate_010_show_keyed_resolutions),
+]
+# Migrations that free a lot of pages; the file is compacted (VACUUM) after them.
+VACUUM_AFTER = frozenset({3})
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# --- Runner ---
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Returns the highest applied migration, or 0 for a database that predates SchemaVersion."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS SchemaVersion (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM SchemaVersion").fetchone()[0]
+
+def ensure_schema(conn: sqlite3.Connection) -> int:
+    """
+    Applies every pending migration to a podcasts.db connection, then refreshes
+    the query planner statistics (ANALYZE) if anything changed.
+
+    Each migration runs in its own transaction together with its SchemaVersion
+    row, so an interrupted upgrade resumes at the failed step. Up to date
+    databases cost a single query.
+
+    Args:
+        conn: An open SQLite connection with no transaction in progress.
+
+    Returns:
+        The schema version after migrating.
+
+    Raises:
+        sqlite3.Error: if a migration fails (it is rolled back).
+    """
+    current = schema_version(conn)
+    conn.commit()
+    if current >= LATEST_VERSION:
+        return current
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        start = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE") # Take the write lock before re-checking the version
+        try:
+            if conn.execute("SELECT 1 FROM SchemaVersion WHERE version = ?", (version,)).fetchone():
+                conn.rollback() # Another process applied it meanwhile
+                continue
+            migrate(conn)
+            conn.execute(
+                "INSERT INTO SchemaVersion (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, int(time.time())),
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        logging.info(f"Applied schema migration {version} ({description}) in {time.monotonic() - start:.2f}s")
+    conn.execute("ANALYZE")
+    conn.commit()
+    if any(current < version for version in VACUUM_AFTER):
+        conn.execute("VACUUM") # Must run outside a transaction
+    return LATEST_VERSION
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from scrape_apple_top100 import PLATFORM_NAME_APPLE, save_chart_data_to_db, scrape_apple_top_podcasts
+from scrape_spotify_top100 import PLATFORM_NAME, save_to_db, scrape_spotify_top100
+
+# --- Configuration ---
+# Regions where both Apple and Spotify publish podcast charts. Override with a
+# comma-separated CHART_REGIONS, e.g. "us,gb,ca".
+DEFAULT_CHART_REGIONS = (
+    "us,gb,ca,au,nz,ie,de,at,fr,es,it,nl,se,pl,br,mx,ar,cl,co,in,id,ph,jp"
+)
+CHART_REGIONS = [r.strip().lower() for r in os.environ.get("CHART_REGIONS", DEFAULT_CHART_REGIONS).split(",") if r.strip()]
+# Every (platform, region) chart is fetched at once up to this many in flight,
+# so a full snapshot takes about as long as the slowest single request.
+FANOUT_CONCURRENCY = int(os.environ.get("FANOUT_CONCURRENCY", "64"))
+LOG_LEVEL = logging.INFO
+
+SCRAPERS = {
+    PLATFORM_NAME_APPLE: scrape_apple_top_podcasts,
+    PLATFORM_NAME: scrape_spotify_top100,
+}
+SAVERS = {
+    PLATFORM_NAME_APPLE: save_chart_data_to_db,
+    PLATFORM_NAME: save_to_db,
+}
+
+async def fetch_all_charts(
+    regions: Sequence[str] = CHART_REGIONS,
+    platforms: Sequence[str] = tuple(SCRAPERS),
+    concurrency: int = FANOUT_CONCURRENCY,
+) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+    """
+    Fetches the chart for every (platform, region) pair concurrently.
+
+    Args:
+        regions: Two-letter region codes.
+        platforms: Platform names (keys of SCRAPERS).
+        concurrency: Maximum number of chart requests in flight.
+
+    Returns:
+        A dict mapping (platform, region) to that chart's records (empty on failure).
+    """
+    loop = asyncio.get_running_loop()
+    jobs = [(platform, region) for platform in platforms for region in regions]
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(jobs))), thread_name_prefix="charts") as executor:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(executor, SCRAPERS[platform], region) for platform, region in jobs
+        ))
+    return dict(zip(jobs, results))
+
+def scrape_all_regions(
+    regions: Sequence[str] = CHART_REGIONS,
+    platforms: Sequence[str] = tuple(SCRAPERS),
+    concurrency: int = FANOUT_CONCURRENCY,
+    conn: Optional[sqlite3.Connection] = None,
+) -> Dict[Tuple[str, str], int]:
+    """
+    Fetches every (platform, region) chart concurrently and saves them to the database
+    (through `conn` when given, else each saver's default database file).
+
+    Returns:
+        A dict mapping (platform, region) to the number of records scraped.
+    """
+    start = time.monotonic()
+    charts = asyncio.run(fetch_all_charts(regions, platforms, concurrency))
+    logging.info(f"Fetched {len(charts)} charts in {time.monotonic() - start:.1f}s")
+
+    # One write (and one transaction) per platform for the whole snapshot.
+    for platform in platforms:
+        records = [r for (p, _), chart in charts.items() if p == platform for r in chart]
+        SAVERS[platform](records, conn=conn)
+
+    empty = sorted(f"{p}/{r}" for (p, r), chart in charts.items() if not chart)
+    if empty:
+        logging.warning(f"No data for {len(empty)} charts: {', '.join(empty)}")
+    return {key: len(chart) for key, chart in charts.items()}
+
+if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Starting multi-region chart scrape for {len(CHART_REGIONS)} regions...")
+    counts = scrape_all_regions()
+    logging.info(f"Script finished. Scraped {sum(counts.values())} rows across {len(counts)} charts.")
@@ -6,9 +6,16 @@ import json
 import logging
 from typing import List, Dict, Optional, Any # For type hinting
 
+from chart_storage import save_chart_records
+from schema import ensure_schema
+from podcast_client import http_get
+
 # --- Configuration ---
-# Apple's RSS Feed Generator URL structure
-APPLE_API_BASE_URL_TEMPLATE = "https://rss.marketingtools.apple.com/api/v2/{region}/podcasts/top/{limit}/podcasts.json"
+# Apple's RSS Feed Generator URL structure (override to point at a local stub server)
+APPLE_API_BASE_URL_TEMPLATE = os.environ.get(
+    "APPLE_CHARTS_URL_TEMPLATE",
+    "https://rss.marketingtools.apple.com/api/v2/{region}/podcasts/top/{limit}/podcasts.json",
+)
 DEFAULT_APPLE_REGION = "us"
 DEFAULT_LIMIT = 100
 PLATFORM_NAME_APPLE = "Apple" # Specific constant for Apple
@@ -16,9 +23,8 @@ DATABASE_NAME = "podcasts.db" # Shared constant (same as Spotify script)
 LOG_LEVEL = logging.INFO # Change to logging.DEBUG for more verbose output
 
 # --- Setup Logging ---
-# BasicConfig should ideally be called only once if running multiple scrapers
-# in sequence within the same execution. If run as separate scripts, this is fine.
-logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging is configured by whoever runs the scrape (the __main__ block below, or
+# pipeline.py for in-process runs), so importing this module has no side effects.
 
 def scrape_apple_top_podcasts(
     region: str = DEFAULT_APPLE_REGION,
@@ -38,7 +44,7 @@ def scrape_apple_top_podcasts(
     logging.info(f"Requesting Apple chart data from: {url}")
     records = []
     try:
-        response = requests.get(url, timeout=10) # Added timeout
+        response = http_get(url, timeout=10, endpoint="podcasts/top") # Pooled session, HTTP cache, payload archive
         logging.info(f"HTTP status: {response.status_code}")
         # Log response snippet only if debugging
         logging.debug(f"Response snippet: {response.text[:200]}...")
@@ -70,6 +76,7 @@ def scrape_apple_top_podcasts(
                  "rank": i + 1, # Rank based on position in the list
                  "title": pod_data.get("name"), # Key is 'name' in Apple's API
                  "podcast_id": pod_data.get("id"), # Key is 'id' in Apple's API
+                 "region": region,
                  "date": today
              })
 
@@ -86,7 +93,11 @@ def scrape_apple_top_podcasts(
 
     return records
 
-def save_chart_data_to_db(records: List[Dict[str, Any]], db_path: str = DATABASE_NAME):
+def save_chart_data_to_db(
+    records: List[Dict[str, Any]],
+    db_path: str = DATABASE_NAME,
+    conn: Optional[sqlite3.Connection] = None,
+):
     """
     Saves scraped podcast chart records (from any platform) to the SQLite database.
     (This function is identical to the improved Spotify one and can be reused)
@@ -94,58 +105,33 @@ def save_chart_data_to_db(records: List[Dict[str, Any]], db_path: str = DATABASE
     Args:
         records: A list of podcast record dictionaries.
         db_path: The path to the SQLite database file.
+        conn: An open connection to use instead of db_path (left open, committed).
     """
     if not records:
         logging.warning("No records provided to save.")
         return
 
+    own_conn = conn is None
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS Top100Lists (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    platform TEXT NOT NULL,
-                    rank INTEGER NOT NULL,
-                    title TEXT,
-                    podcast_id TEXT, -- Store as TEXT as IDs can be alphanumeric
-                    date TEXT NOT NULL,
-                    UNIQUE(platform, rank, date)
-                )
-            ''')
-            # Optional: Add index for performance
-            # cursor.execute('CREATE INDEX IF NOT EXISTS idx_platform_rank_date ON Top100Lists (platform, rank, date);')
-
-            insert_count = 0
-            ignore_count = 0
-            for r in records:
-                # Validate required keys before attempting insert
-                required_keys = ["platform", "rank", "date"]
-                if not all(key in r for key in required_keys):
-                     logging.error(f"Record missing required keys: {r}. Skipping.")
-                     continue
-                try:
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO Top100Lists(platform, rank, title, podcast_id, date)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (r["platform"], r["rank"], r.get("title"), r.get("podcast_id"), r["date"])) # Use .get for optional fields
-                    if cursor.rowcount > 0:
-                        insert_count += 1
-                    else:
-                        ignore_count += 1
-                except sqlite3.Error as e:
-                     logging.error(f"Failed to insert record: {r} - Error: {e}")
-                except KeyError as e: # Should be caught by the check above, but as fallback
-                    logging.error(f"Missing key {e} in record: {r}")
-
-
+        if own_conn:
+            conn = sqlite3.connect(db_path)
+        with conn:
+            # Shared, versioned schema (migrations) lives in schema.py
+            ensure_schema(conn)
+            # Rows go to the integer-keyed chart tables; duplicates of an existing
+            # (platform, region, date, rank) are ignored.
+            insert_count, ignore_count = save_chart_records(conn, records, DEFAULT_APPLE_REGION)
             logging.info(f"Database operation complete for {records[0]['platform']} data. Inserted: {insert_count}, Ignored (duplicates): {ignore_count}")
 
     except sqlite3.Error as e:
         logging.error(f"Database error connecting or creating table: {e}")
+    finally:
+        if own_conn and conn is not None:
+            conn.close()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
     logging.info("Starting Apple Top Podcasts scrape...")
     # Using default region 'us' and limit 100
     scraped_data_apple = scrape_apple_top_podcasts()
@@ -6,16 +6,20 @@ import json
 import logging
 from typing import List, Dict, Optional, Any # For type hinting
 
+from chart_storage import save_chart_records
+from schema import ensure_schema
+from podcast_client import http_get
+
 # --- Configuration ---
 # Note: This API endpoint is not officially documented by Spotify and may change/break.
-API_BASE_URL = "https://podcastcharts.byspotify.com/api/charts/top"
+API_BASE_URL = os.environ.get("SPOTIFY_CHARTS_URL", "https://podcastcharts.byspotify.com/api/charts/top")
 DEFAULT_REGION = "us"
 PLATFORM_NAME = "Spotify"
 DATABASE_NAME = "podcasts.db"
 LOG_LEVEL = logging.INFO # Change to logging.DEBUG for more verbose output
 
 # --- Setup Logging ---
-logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configured in the __main__ block (or by pipeline.py), not at import time.
 
 def scrape_spotify_top100(region: str = DEFAULT_REGION) -> List[Dict[str, Any]]:
     """
@@ -31,7 +35,7 @@ def scrape_spotify_top100(region: str = DEFAULT_REGION) -> List[Dict[str, Any]]:
     logging.info(f"Requesting Spotify chart data from: {url}")
     records = []
     try:
-        response = requests.get(url, timeout=10) # Added timeout
+        response = http_get(url, timeout=10, endpoint="charts/top") # Pooled session, HTTP cache, payload archive
         logging.info(f"HTTP status: {response.status_code}")
         response.raise_for_status() # Raise an HTTPError for bad status codes (4xx or 5xx)
 
@@ -56,6 +60,7 @@ def scrape_spotify_top100(region: str = DEFAULT_REGION) -> List[Dict[str, Any]]:
                  "rank": i + 1,
                  "title": pod_data.get("showName"),
                  "podcast_id": podcast_id, # Store the extracted ID or None
+                 "region": region,
                  "date": today
              })
 
@@ -72,63 +77,44 @@ def scrape_spotify_top100(region: str = DEFAULT_REGION) -> List[Dict[str, Any]]:
 
     return records
 
-def save_to_db(records: List[Dict[str, Any]], db_path: str = DATABASE_NAME):
+def save_to_db(
+    records: List[Dict[str, Any]],
+    db_path: str = DATABASE_NAME,
+    conn: Optional[sqlite3.Connection] = None,
+):
     """
     Saves scraped podcast chart records to the SQLite database.
 
     Args:
         records: A list of podcast record dictionaries.
         db_path: The path to the SQLite database file.
+        conn: An open connection to use instead of db_path (left open, committed).
     """
     if not records:
         logging.warning("No records provided to save.")
         return
 
-    # Use context manager for connection handling
+    # Use context manager for the transaction; only a connection opened here is closed here
+    own_conn = conn is None
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            # Use IF NOT EXISTS for robustness
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS Top100Lists (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    platform TEXT NOT NULL,
-                    rank INTEGER NOT NULL,
-                    title TEXT,
-                    podcast_id TEXT,
-                    date TEXT NOT NULL,
-                    UNIQUE(platform, rank, date)
-                )
-            ''')
-            # Consider adding an index for faster lookups if the table grows large
-            # cursor.execute('CREATE INDEX IF NOT EXISTS idx_platform_rank_date ON Top100Lists (platform, rank, date);')
-
-            insert_count = 0
-            ignore_count = 0
-            for r in records:
-                try:
-                    # Use INSERT OR IGNORE to handle the UNIQUE constraint gracefully
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO Top100Lists(platform, rank, title, podcast_id, date)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (r["platform"], r["rank"], r["title"], r["podcast_id"], r["date"]))
-                    if cursor.rowcount > 0:
-                        insert_count += 1
-                    else:
-                        ignore_count += 1
-                except sqlite3.Error as e:
-                     logging.error(f"Failed to insert record: {r} - Error: {e}")
-                except KeyError as e:
-                    logging.error(f"Missing key {e} in record: {r}")
-
-
-            # Commit happens automatically when 'with' block exits successfully
+        if own_conn:
+            conn = sqlite3.connect(db_path)
+        with conn:
+            # Shared, versioned schema (migrations) lives in schema.py
+            ensure_schema(conn)
+            # Rows go to the integer-keyed chart tables; duplicates of an existing
+            # (platform, region, date, rank) are ignored.
+            insert_count, ignore_count = save_chart_records(conn, records, DEFAULT_REGION)
             logging.info(f"Database operation complete. Inserted: {insert_count}, Ignored (duplicates): {ignore_count}")
 
     except sqlite3.Error as e:
         logging.error(f"Database error: {e}")
+    finally:
+        if own_conn and conn is not None:
+            conn.close()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
     logging.info("Starting Spotify Top 100 scrape...")
     scraped_data = scrape_spotify_top100() # Uses default region 'us'
 
@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+# --- Configuration ---
+# ShowIdentities.id_type values. Chart platforms use their lowercased name
+# ('apple', 'spotify'), so a new chart platform needs no code change here.
+FEED_ID_TYPE = "podcastindex_feed"
+GUID_ID_TYPE = "podcastindex_guid"
+
+# ShowIdentities.link_method for a feed's own id and GUID. Platform ids record
+# the endpoint that resolved them instead.
+FEED_LINK_METHOD = "feed"
+# Resolutions that identify the show itself rather than match its title.
+DIRECT_LINK_METHODS = ("podcasts/byfeedurl", "podcasts/byitunesid")
+# A platform id resolved by title search is only linked at or above this ratio.
+# Links below it, or of unknown origin, are pruned before each enrichment run.
+IDENTITY_LINK_MIN_RATIO = float(os.environ.get("IDENTITY_LINK_MIN_RATIO", "0.9"))
+
+# A canonical show is one PodcastIndex feed. Every external id we trust for it
+# (Apple id, Spotify show id, feed id, feed GUID) points at its CanonicalShows
+# row, so later runs enrich it once, by feed id, whatever title each chart uses.
+
+def platform_id_type(platform: str) -> str:
+    """Returns the ShowIdentities id_type for a chart platform's show ids."""
+    return platform.lower()
+
+def is_trusted_link(link_method: Optional[str], match_ratio: Optional[float], min_ratio: float = IDENTITY_LINK_MIN_RATIO) -> bool:
+    """True if a resolution is strong enough to link platform ids to its show permanently."""
+    return link_method in DIRECT_LINK_METHODS or (match_ratio is not None and match_ratio >= min_ratio)
+
+def prune_identity_links(conn: sqlite3.Connection, min_ratio: float = IDENTITY_LINK_MIN_RATIO) -> int:
+    """
+    Deletes platform id links that is_trusted_link would not make today.
+
+    Their shows go back to title resolution on the next enrichment run.
+    Feed id and GUID links are kept. The caller owns the transaction.
+
+    Returns:
+        The number of links deleted.
+    """
+    placeholders = ", ".join("?" for _ in DIRECT_LINK_METHODS)
+    return conn.execute(f'''
+        DELETE FROM ShowIdentities
+        WHERE id_type NOT IN (?, ?)
+          AND COALESCE(link_method IN ({placeholders}), 0) = 0
+          AND COALESCE(match_ratio, 0) < ?
+    ''', (FEED_ID_TYPE, GUID_ID_TYPE, *DIRECT_LINK_METHODS, min_ratio)).rowcount
+
+def load_enrichment_items(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """
+    Groups the charted shows into one enrichment item per canonical show.
+
+    Chart shows whose platform id is already mapped are grouped by canonical
+    show, whatever their titles. Unmapped shows are grouped by title and join
+    the canonical show charting under the same title, if there is one.
+
+    Args:
+        conn: An open connection on a migrated podcasts.db.
+
+    Returns:
+        Items in order of first appearance, each a dict with:
+            title: The first title the show charted under (the item's key).
+            titles: Every title it charted under.
+            platforms: Platforms it charted on.
+            itunes_id: Its Apple id, if Apple charts it.
+            chart_shows: (platform, platform_show_id, title, show_id) for each chart listing.
+            canonical_id, feed_id: The known canonical show and its feed, or None.
+            link_method, match_ratio: How the known show was linked (a
+                direct method if any of its listings has one), or None.
+    """
+    rows = conn.execute('''
+        SELECT p.name, s.platform_show_id, s.title, s.show_id, c.canonical_id, c.feed_id, i.link_method, i.match_ratio
+        FROM ChartShows s
+        JOIN Platforms p ON p.platform_id = s.platform_id
+        LEFT JOIN ShowIdentities i ON i.id_type = lower(p.name) AND i.external_id = s.platform_show_id
+        LEFT JOIN CanonicalShows c ON c.canonical_id = i.canonical_id
+        WHERE s.title IS NOT NULL
+        ORDER BY s.show_id
+    ''').fetchall()
+
+    groups: Dict[Any, Dict[str, Any]] = {}
+    title_groups: Dict[str, Any] = {} # title -> key of the group it belongs to
+    order: Dict[Any, int] = {}
+    # Mapped shows first, so an unmapped spelling can join its canonical show.
+    for position, (platform, platform_show_id, title, show_id, canonical_id, feed_id, link_method, match_ratio) in sorted(
+            enumerate(rows), key=lambda row: row[1][4] is None):
+        if canonical_id is not None:
+            key = ("canonical", canonical_id)
+            title_groups.setdefault(title, key)
+        else:
+            key = title_groups.setdefault(title, ("title", title))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "title": title, "titles": [], "platforms": [], "itunes_id": None,
+                "chart_shows": [], "canonical_id": canonical_id, "feed_id": feed_id,
+                "link_method": link_method, "match_ratio": match_ratio,
+            }
+            order[key] = position
+        elif position < order[key]:
+            group["title"] = title
+            order[key] = position
+        if canonical_id is not None and link_method in DIRECT_LINK_METHODS and group["link_method"] not in DIRECT_LINK_METHODS:
+            group["link_method"], group["match_ratio"] = link_method, match_ratio
+        if title not in group["titles"]:
+            group["titles"].append(title)
+        if platform not in group["platforms"]:
+            group["platforms"].append(platform)
+        if platform == "Apple" and platform_show_id and not group["itunes_id"]:
+            group["itunes_id"] = platform_show_id
+        group["chart_shows"].append((platform, platform_show_id, title, show_id))
+
+    return [groups[key] for key in sorted(groups, key=order.get)]
+
+CANONICAL_UPSERT_SQL = '''
+    INSERT INTO CanonicalShows (feed_id, podcast_guid, title, updated_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(feed_id) DO UPDATE SET
+        podcast_guid = excluded.podcast_guid,
+        title = excluded.title,
+        updated_at = excluded.updated_at
+'''
+
+# linked_at and the link's origin only move when an id is (re)linked to a different show.
+IDENTITY_UPSERT_SQL = '''
+    INSERT INTO ShowIdentities (id_type, external_id, canonical_id, linked_at, link_method, match_ratio)
+    SELECT ?, ?, canonical_id, ?, ?, ? FROM CanonicalShows WHERE feed_id = ?
+    ON CONFLICT(id_type, external_id) DO UPDATE SET
+        canonical_id = excluded.canonical_id,
+        linked_at = excluded.linked_at,
+        link_method = excluded.link_method,
+        match_ratio = excluded.match_ratio
+    WHERE canonical_id IS NOT excluded.canonical_id
+'''
+
+def queue_identity_links(
+    writer,
+    item: Dict[str, Any],
+    feed_id: int,
+    podcast_guid: Optional[str],
+    title: Optional[str],
+    link_method: Optional[str],
+    match_ratio: Optional[float],
+):
+    """
+    Queues the canonical show for an enriched feed and links the ids known for
+    it: always the feed id and GUID, and, if the resolution is trusted (see
+    is_trusted_link), the platform id of each chart listing in the item.
+
+    Args:
+        writer: The enrichment BatchWriter (anything with add/add_many).
+        item: The enrichment item, as built by load_enrichment_items.
+        feed_id: The PodcastIndex feed the item resolved to.
+        podcast_guid: The feed's podcast GUID, if it has one.
+        title: The feed's own title.
+        link_method, match_ratio: How the item was resolved (the resolution's
+            endpoint and title match ratio), recorded on each platform link.
+    """
+    now = int(time.time())
+    writer.add(CANONICAL_UPSERT_SQL, (feed_id, podcast_guid, title, now))
+    identities = {(FEED_ID_TYPE, str(feed_id)): (FEED_LINK_METHOD, 1.0)}
+    if podcast_guid:
+        identities.setdefault((GUID_ID_TYPE, podcast_guid), (FEED_LINK_METHOD, 1.0))
+    if is_trusted_link(link_method, match_ratio):
+        for platform, platform_show_id, _, _ in item.get("chart_shows", ()):
+            if platform_show_id:
+                identities.setdefault((platform_id_type(platform), str(platform_show_id)), (link_method, match_ratio))
+    writer.add_many(IDENTITY_UPSERT_SQL, [
+        (id_type, external_id, now, method, ratio, feed_id)
+        for (id_type, external_id), (method, ratio) in identities.items()
+    ])
@@ -0,0 +1,125 @@
+import abc
+import difflib
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+# --- Configuration ---
+MATCH_THRESHOLD = 0.4 # Minimum difflib ratio for a search result to count as a match
+# The indel ratio is never below difflib's, so it needs a higher cut-off. At
+# 0.45 it accepts fewer unrelated titles than difflib does at 0.4 (see
+# benchmarks/bench_title_matcher.py).
+INDEL_MATCH_THRESHOLD = 0.45
+DEFAULT_MATCHER = os.environ.get("TITLE_MATCHER", "difflib")
+
+class TitleMatcher(abc.ABC):
+    """
+    Scores chart titles against search-result titles on a 0..1 scale.
+
+    Subclasses implement `ratio()` over normalized strings; `best_match()` normalizes
+    the query once and scores every candidate against it.
+    """
+
+    name = "base"
+    default_threshold = MATCH_THRESHOLD
+
+    def __init__(self, threshold: Optional[float] = None):
+        self.threshold = self.default_threshold if threshold is None else threshold
+
+    def normalize(self, title: str) -> str:
+        """Normalizes a title before scoring (case-insensitive, like the original search code)."""
+        return title.lower()
+
+    @abc.abstractmethod
+    def ratio(self, a: str, b: str) -> float:
+        """Similarity of two already-normalized titles, 1.0 meaning identical."""
+
+    def best_match(self, query: str, candidates: Iterable[str]) -> Tuple[Optional[int], float]:
+        """
+        Finds the highest-scoring candidate title for a query.
+
+        Args:
+            query: The chart title being resolved.
+            candidates: Candidate titles; empty or missing titles are skipped.
+
+        Returns:
+            (index of the best candidate or None, its ratio). Ties keep the earliest
+            candidate. The caller compares the ratio to `threshold`.
+        """
+        query = self.normalize(query)
+        best_index, best_ratio = None, 0
+        for index, candidate in enumerate(candidates):
+            if not candidate:
+                continue
+            ratio = self.ratio(query, self.normalize(candidate))
+            if ratio > best_ratio:
+                best_index, best_ratio = index, ratio
+        return best_index, best_ratio
+
+    def is_match(self, ratio: float) -> bool:
+        return ratio >= self.threshold
+
+class DifflibMatcher(TitleMatcher):
+    """The original scorer: difflib.SequenceMatcher ratio (pure Python, roughly quadratic)."""
+
+    name = "difflib"
+
+    def ratio(self, a: str, b: str) -> float:
+        return difflib.SequenceMatcher(None, a, b).ratio()
+
+class IndelMatcher(TitleMatcher):
+    """
+    Normalized indel similarity, 2 * LCS(a, b) / (len(a) + len(b)).
+
+    This is the same 0..1 scale as SequenceMatcher.ratio(), which counts matching
+    characters of a greedy block alignment instead of the longest common
+    subsequence and so is never higher. Because indel scores run higher, the
+    matcher uses its own threshold (INDEL_MATCH_THRESHOLD). The LCS length is computed with the
+    bit-parallel algorithm of Allison-Dix/Hyyro: one big-int update per character
+    of the candidate, with the query's character masks built once per query.
+    """
+
+    name = "indel"
+    default_threshold = INDEL_MATCH_THRESHOLD
+
+    def _masks(self, a: str) -> Dict[str, int]:
+        masks: Dict[str, int] = {}
+        for i, ch in enumerate(a):
+            masks[ch] = masks.get(ch, 0) | (1 << i)
+        return masks
+
+    def _lcs_length(self, a: str, masks: Dict[str, int], b: str) -> int:
+        full = (1 << len(a)) - 1
+        v = full
+        for ch in b:
+            u = v & masks.get(ch, 0)
+            v = ((v + u) | (v - u)) & full
+        return len(a) - v.bit_count()
+
+    def ratio(self, a: str, b: str) -> float:
+        total = len(a) + len(b)
+        if not total:
+            return 1.0
+        return 2.0 * self._lcs_length(a, self._masks(a), b) / total
+
+    def best_match(self, query: str, candidates: Iterable[str]) -> Tuple[Optional[int], float]:
+        query = self.normalize(query)
+        masks = self._masks(query)
+        best_index, best_ratio = None, 0
+        for index, candidate in enumerate(candidates):
+            if not candidate:
+                continue
+            candidate = self.normalize(candidate)
+            total = len(query) + len(candidate)
+            ratio = 2.0 * self._lcs_length(query, masks, candidate) / total if total else 1.0
+            if ratio > best_ratio:
+                best_index, best_ratio = index, ratio
+        return best_index, best_ratio
+
+MATCHERS = {matcher.name: matcher for matcher in (DifflibMatcher, IndelMatcher)}
+
+def get_matcher(name: str = DEFAULT_MATCHER, threshold: Optional[float] = None) -> TitleMatcher:
+    """Returns a matcher by name ('difflib' or 'indel'), at its own default threshold unless one is given."""
+    try:
+        return MATCHERS[name](threshold)
+    except KeyError:
+        raise ValueError(f"Unknown title matcher '{name}', expected one of {sorted(MATCHERS)}") from None
@@ -2,137 +2,214 @@ import os
 import sqlite3
 import requests
 import time
-import hashlib
-import difflib
 import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from podcast_client import PodcastIndexClient, TokenBucket, get_response_cache, http_get, request_deadline
+from replay_transport import REPLAY_ARCHIVE_PATH, get_replay_adapter
+from schema import ensure_schema
+from show_identity import IDENTITY_LINK_MIN_RATIO, load_enrichment_items, prune_identity_links, queue_identity_links
+from title_matcher import get_matcher
 
 # Podcast Index API credentials and base URL.
 API_KEY = os.environ.get("PODCASTINDEX_API_KEY")
 API_SECRET = os.environ.get("PODCASTINDEX_API_SECRET")
 
-# Added check
-if not API_KEY or not API_SECRET:
-    print("Error: Podcast Index API keys not found in environment variables.")
-    exit(1) # Exit if keys are missing
-BASE_URL = "https://api.podcastindex.org/api/1.0/"
-
-# --- Helper Functions ---
-
-def get_headers():
-    """Generates the required authentication headers for the API."""
-    auth_date = str(int(time.time()))
-    auth_string = API_KEY + API_SECRET + auth_date
-    authorization = hashlib.sha1(auth_string.encode("utf-8")).hexdigest()
-    headers = {
-        "User-Agent": "PodcastDashboard/1.2 (Python Script)", # Updated version
-        "X-Auth-Key": API_KEY,
-        "X-Auth-Date": auth_date,
-        "Authorization": authorization,
-    }
-    return headers
-
-# --- Search Functions (Unchanged) ---
+# Replayed runs never send credentials anywhere. Missing keys are reported when
+# an update runs (see api_keys_missing), not at import time.
+if REPLAY_ARCHIVE_PATH:
+    API_KEY, API_SECRET = API_KEY or "replay", API_SECRET or "replay"
+BASE_URL = os.environ.get("PODCASTINDEX_BASE_URL", "https://api.podcastindex.org/api/1.0/")
+
+# iTunes Lookup API: accepts a comma-separated list of ids and returns each
+# show's feedUrl, so a whole Apple chart resolves in a couple of calls.
+ITUNES_LOOKUP_URL = os.environ.get("ITUNES_LOOKUP_URL", "https://itunes.apple.com/lookup")
+ITUNES_LOOKUP_BATCH_SIZE = 100
+
+DATABASE_NAME = "podcasts.db"
+
+# Enrichment engine. "async" runs the per-title chain for many titles at once;
+# "serial" is the original one-title-at-a-time loop, kept as a fallback.
+ENRICH_MODES = ("async", "serial")
+ENRICH_MODE = os.environ.get("ENRICH_MODE", "async")
+ENRICH_CONCURRENCY = int(os.environ.get("ENRICH_CONCURRENCY", "8"))
+
+# Podcasts refresh. "incremental" keeps existing rows and only re-fetches titles
+# whose row is older than the TTL; "full" re-fetches every title (rows are still
+# upserted, never dropped).
+REFRESH_MODES = ("incremental", "full")
+REFRESH_MODE = os.environ.get("PODCASTS_REFRESH_MODE", "incremental")
+REFRESH_TTL_HOURS = float(os.environ.get("PODCASTS_REFRESH_TTL_HOURS", "168"))
+
+# Shared pacing for every PodcastIndex request (replaces the fixed sleeps).
+PODCASTINDEX_RPS = float(os.environ.get("PODCASTINDEX_RPS", "4"))
+PODCASTINDEX_BURST = int(os.environ.get("PODCASTINDEX_BURST", "8"))
+
+# Upper bound on the wall time spent on one title's whole request chain,
+# including retries and rate-limit waits.
+TITLE_DEADLINE_SECONDS = float(os.environ.get("TITLE_DEADLINE_SECONDS", "90"))
+
+# Negative cache for titles with no good search match: the n-th consecutive
+# failure waits FAILED_RETRY_BASE_HOURS * 2**(n-1) (capped) before the next try.
+# FORCE_RETRY_FAILED=1 retries every failed title regardless of its schedule.
+FAILED_RETRY_BASE_HOURS = float(os.environ.get("FAILED_RETRY_BASE_HOURS", "24"))
+FAILED_RETRY_MAX_HOURS = float(os.environ.get("FAILED_RETRY_MAX_HOURS", str(24 * 60)))
+FORCE_RETRY_FAILED = os.environ.get("FORCE_RETRY_FAILED", "") == "1"
+
+# Enrichment results are buffered and written in one transaction per batch.
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "50")) # Titles per batch
+WRITE_FLUSH_SECONDS = float(os.environ.get("WRITE_FLUSH_SECONDS", "30"))
+
+# Checkpointing: every title's outcome is recorded against the current run in the
+# same transaction as its data. A run that dies before finishing is resumed by
+# the next one (if it started within RESUME_MAX_AGE_HOURS), which skips the
+# titles that run already finished.
+RESUME_RUNS = os.environ.get("ENRICH_RESUME", "1") != "0"
+RESUME_MAX_AGE_HOURS = float(os.environ.get("ENRICH_RESUME_MAX_AGE_HOURS", "24"))
+ENRICH_STAGE = "enrich"
+
+# --- API Client ---
+
+# One pooled keep-alive client (shared with the chart scrapers' session) and one
+# rate limiter for every PodcastIndex request.
+rate_limiter = TokenBucket(PODCASTINDEX_RPS, PODCASTINDEX_BURST)
+client = PodcastIndexClient(API_KEY, API_SECRET, base_url=BASE_URL, rate_limiter=rate_limiter)
+
+# Scores search results against chart titles (TITLE_MATCHER=difflib|indel).
+title_matcher = get_matcher()
+
+def api_keys_missing():
+    """True if the PodcastIndex API keys are not configured."""
+    return not API_KEY or not API_SECRET
+
+def podcastindex_get(endpoint, params):
+    """GETs a PodcastIndex endpoint through the shared client and rate limiter."""
+    return client.get(endpoint, params)
+
+# --- Search Functions ---
 
 def search_byterm(query):
-    """Search using 'search/byterm' (max 10 results) and pick best match by fuzzy ratio."""
+    """Search using 'search/byterm' (max 10 results) and pick best match by fuzzy ratio.
+       Returns (best_match, best_ratio); best_match is None if nothing reached the threshold,
+       and best_ratio is None if the search itself failed."""
     endpoint = "search/byterm"
-    url = BASE_URL + endpoint
     params = {"q": query, "max": 10}
-    headers = get_headers()
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = podcastindex_get(endpoint, params)
         print(f"[byterm] Raw response for '{query}': {response.text[:200]}...")
         response.raise_for_status()
         data = response.json()
         results = data.get("feeds") or data.get("results", [])
         if results:
-            best_match = None
-            best_ratio = 0
-            for res in results:
-                candidate_title = res.get("title_original", "") or res.get("title", "")
-                if not candidate_title: continue
-                ratio = difflib.SequenceMatcher(None, query.lower(), candidate_title.lower()).ratio()
-                if ratio > best_ratio:
-                    best_ratio = ratio
-                    best_match = res
+            best_index, best_ratio = title_matcher.best_match(
+                query, (res.get("title_original", "") or res.get("title", "") for res in results))
+            best_match = results[best_index] if best_index is not None else None
             print(f"[byterm] Best ratio for '{query}': {best_ratio:.2f} (Match: '{best_match.get('title') if best_match else 'None'}')")
-            if best_match and best_ratio >= 0.4:
-                return best_match
+            if best_match and title_matcher.is_match(best_ratio):
+                return best_match, best_ratio
             else:
                 print(f"[byterm] No good match found for '{query}' (Best ratio: {best_ratio:.2f})")
+                return None, best_ratio
         else:
             print(f"[byterm] No results found for '{query}' in response.")
+            return None, 0
     except requests.exceptions.RequestException as e:
         print(f"[byterm] Request Exception for '{query}': {e}")
     except json.JSONDecodeError as e:
         print(f"[byterm] JSON Decode Error for '{query}': {e} - Response was: {response.text[:200]}...")
     except Exception as e:
         print(f"[byterm] General Exception for '{query}': {e}")
-    return None
+    return None, None
 
 def search_bytitle(query):
-    """Search using 'search/bytitle' (max 10 results) and pick best match by fuzzy ratio."""
+    """Search using 'search/bytitle' (max 10 results) and pick best match by fuzzy ratio.
+       Returns (best_match, best_ratio); best_match is None if nothing reached the threshold,
+       and best_ratio is None if the search itself failed."""
     endpoint = "search/bytitle"
-    url = BASE_URL + endpoint
     params = {"q": query, "max": 10} # Corrected parameter is 'q'
-    headers = get_headers()
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = podcastindex_get(endpoint, params)
         print(f"[bytitle] Raw response for '{query}': {response.text[:200]}...")
         response.raise_for_status()
         data = response.json()
         feeds = data.get("feeds", [])
         if feeds:
-            best_match = None
-            best_ratio = 0
-            for feed in feeds:
-                candidate_title = feed.get("title", "")
-                if not candidate_title: continue
-                ratio = difflib.SequenceMatcher(None, query.lower(), candidate_title.lower()).ratio()
-                if ratio > best_ratio:
-                    best_ratio = ratio
-                    best_match = feed
+            best_index, best_ratio = title_matcher.best_match(query, (feed.get("title", "") for feed in feeds))
+            best_match = feeds[best_index] if best_index is not None else None
             print(f"[bytitle] Best ratio for '{query}': {best_ratio:.2f} (Match: '{best_match.get('title') if best_match else 'None'}')")
-            if best_match and best_ratio >= 0.4:
-                return best_match
+            if best_match and title_matcher.is_match(best_ratio):
+                return best_match, best_ratio
             else:
                 print(f"[bytitle] No good match found for '{query}' (Best ratio: {best_ratio:.2f})")
+                return None, best_ratio
         else:
             print(f"[bytitle] No results found for '{query}' in response.")
+            return None, 0
     except requests.exceptions.RequestException as e:
         print(f"[bytitle] Request Exception for '{query}': {e}")
     except json.JSONDecodeError as e:
         print(f"[bytitle] JSON Decode Error for '{query}': {e} - Response was: {response.text[:200]}...")
     except Exception as e:
         print(f"[bytitle] General Exception for '{query}': {e}")
-    return None
+    return None, None
 
 def search_podcast_combined(query):
-    """Try searching using byterm first; if that fails or match is poor, fall back to bytitle."""
+    """Try searching using byterm first; if that fails or match is poor, fall back to bytitle.
+       Returns (candidate, match_ratio, matched_endpoint). Without a candidate, match_ratio is
+       the best ratio seen if both searches completed (a genuine miss) or None if either errored."""
     print(f"\n--- Searching combined for: '{query}' ---")
-    result = search_byterm(query)
+    endpoint = "search/byterm"
+    result, ratio = search_byterm(query)
     if not result:
         print(f"-> Falling back to search/bytitle for: '{query}'")
-        result = search_bytitle(query)
+        endpoint = "search/bytitle"
+        byterm_ratio = ratio
+        result, ratio = search_bytitle(query)
+        if not result and ratio is not None:
+            ratio = None if byterm_ratio is None else max(ratio, byterm_ratio)
 
     if result:
         print(f"--> Combined search found candidate: ID {result.get('id')}, Title: {result.get('title')}")
-        return result
+        return result, ratio, endpoint
     else:
         print(f"--> Combined search FAILED for: '{query}'")
-        return None
+        return None, ratio, None
+
+# --- Batch iTunes Resolver ---
+
+def lookup_itunes_feed_urls(itunes_ids, batch_size=ITUNES_LOOKUP_BATCH_SIZE):
+    """Resolves Apple podcast ids to feed URLs with batched iTunes Lookup calls.
+       Returns {itunes_id (str): feed_url}; ids without a feedUrl are left out."""
+    unique_ids = list(dict.fromkeys(str(i) for i in itunes_ids if i))
+    feed_urls = {}
+    for start in range(0, len(unique_ids), batch_size):
+        batch = unique_ids[start:start + batch_size]
+        params = {"id": ",".join(batch), "entity": "podcast"}
+        print(f"[itunes/lookup] Looking up {len(batch)} iTunes IDs ({start + 1}-{start + len(batch)} of {len(unique_ids)})")
+        try:
+            response = http_get(ITUNES_LOOKUP_URL, params=params, timeout=10, endpoint="lookup")
+            response.raise_for_status()
+            for result in response.json().get("results", []):
+                result_id = result.get("collectionId") or result.get("trackId")
+                if result_id and result.get("feedUrl"):
+                    feed_urls[str(result_id)] = result["feedUrl"]
+        except requests.exceptions.RequestException as e:
+            print(f"[itunes/lookup] Request Exception for batch starting at {start}: {e}")
+        except json.JSONDecodeError as e:
+            print(f"[itunes/lookup] JSON Decode Error for batch starting at {start}: {e}")
+    print(f"[itunes/lookup] Resolved feed URLs for {len(feed_urls)}/{len(unique_ids)} iTunes IDs")
+    return feed_urls
 
 # --- Detail Fetching Functions ---
 
 def get_full_podcast_details_by_feed_id(feed_id):
     """Retrieve full podcast details using 'podcasts/byfeedid'."""
     endpoint = "podcasts/byfeedid"
-    url = BASE_URL + endpoint
-    params = {"id": feed_id, "pretty": 1}
-    headers = get_headers()
+    params = {"id": feed_id}
     print(f"--- Fetching details by Feed ID: {feed_id} ---")
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = podcastindex_get(endpoint, params)
         print(f"[byfeedid] Raw response for ID {feed_id}: {response.text[:200]}...")
         response.raise_for_status()
         data = response.json()
@@ -155,12 +232,10 @@ def get_full_podcast_details_by_feed_id(feed_id):
 def get_full_podcast_details_by_feed_url(feed_url):
     """Retrieve full podcast details using 'podcasts/byfeedurl'."""
     endpoint = "podcasts/byfeedurl"
-    url = BASE_URL + endpoint
-    params = {"url": feed_url, "pretty": 1}
-    headers = get_headers()
+    params = {"url": feed_url}
     print(f"--- Fetching details by Feed URL: {feed_url[:50]}... ---")
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = podcastindex_get(endpoint, params)
         print(f"[byfeedurl] Raw response for URL {feed_url[:50]}...: {response.text[:200]}...")
         response.raise_for_status()
         data = response.json()
@@ -180,6 +255,32 @@ def get_full_podcast_details_by_feed_url(feed_url):
         print(f"[byfeedurl] General Exception for URL {feed_url[:50]}...: {e}")
     return None
 
+def get_full_podcast_details_by_itunes_id(itunes_id):
+    """Retrieve full podcast details using 'podcasts/byitunesid' (Apple's numeric podcast id)."""
+    endpoint = "podcasts/byitunesid"
+    params = {"id": itunes_id}
+    print(f"--- Fetching details by iTunes ID: {itunes_id} ---")
+    try:
+        response = podcastindex_get(endpoint, params)
+        print(f"[byitunesid] Raw response for iTunes ID {itunes_id}: {response.text[:200]}...")
+        response.raise_for_status()
+        data = response.json()
+        if data.get("feed"):
+            print(f"[byitunesid] Successfully fetched details for iTunes ID: {itunes_id}")
+            return data["feed"]
+        else:
+            print(f"[byitunesid] Response OK, but no 'feed' data found for iTunes ID: {itunes_id}. Response: {data}")
+            return None
+    except requests.exceptions.HTTPError as e:
+        print(f"[byitunesid] HTTP Error {e.response.status_code} for iTunes ID {itunes_id}: {e.response.text[:200]}...")
+    except requests.exceptions.RequestException as e:
+        print(f"[byitunesid] Request Exception for iTunes ID {itunes_id}: {e}")
+    except json.JSONDecodeError as e:
+        print(f"[byitunesid] JSON Decode Error for iTunes ID {itunes_id}: {e} - Response was: {response.text[:200]}...")
+    except Exception as e:
+        print(f"[byitunesid] General Exception for iTunes ID {itunes_id}: {e}")
+    return None
+
 # *** RENAMED function and MODIFIED return value ***
 def get_latest_episode_info(feed_id):
     """
@@ -188,9 +289,7 @@ def get_latest_episode_info(feed_id):
     Returns (None, None) if calculation fails or no episodes found.
     """
     endpoint = "episodes/byfeedid"
-    url = BASE_URL + endpoint
-    params = {"id": feed_id, "max": 10, "pretty": 1} # Request only the 10 most recent
-    headers = get_headers()
+    params = {"id": feed_id, "max": 10} # Request only the 10 most recent
 
     print(f"--- Fetching latest episode info for Feed ID: {feed_id} ---")
 
@@ -198,7 +297,7 @@ def get_latest_episode_info(feed_id):
     average_duration = None
 
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = podcastindex_get(endpoint, params)
         print(f"[episodes/latest] Raw response for {feed_id}: {response.text[:150]}...")
         response.raise_for_status()
         data = response.json()
@@ -243,155 +342,525 @@ def get_latest_episode_info(feed_id):
     return None, None
 
 
+# --- Database Schema ---
+
+def load_resolution_failures(conn):
+    """Returns {chart_title: (failure_count, next_retry_at)} for every known failure."""
+    rows = conn.execute("SELECT chart_title, failure_count, next_retry_at FROM ResolutionFailures")
+    return {title: (count, next_retry_at) for title, count, next_retry_at in rows}
+
+def next_retry_delay(failure_count):
+    """Seconds to wait before retrying a title after its `failure_count`-th failed resolution."""
+    delay_hours = FAILED_RETRY_BASE_HOURS * (2 ** (failure_count - 1))
+    return int(min(delay_hours, FAILED_RETRY_MAX_HOURS) * 3600)
+
+def load_title_resolutions(conn):
+    """Returns {chart_title: (feed_id, match_ratio, matched_endpoint)}, newest resolution winning."""
+    rows = conn.execute('''
+        SELECT s.title, r.feed_id, r.match_ratio, r.matched_endpoint
+        FROM TitleResolutions r JOIN ChartShows s ON s.show_id = r.show_id
+        WHERE s.title IS NOT NULL
+        ORDER BY r.resolved_at
+    ''')
+    return {title: (feed_id, ratio, endpoint) for title, feed_id, ratio, endpoint in rows}
+
+def get_fresh_titles(conn, ttl_hours):
+    """Returns chart titles whose Podcasts row was refreshed within the TTL.
+       Rows written before refreshed_at existed fall back to the feed's last_update_time."""
+    cutoff = int(time.time() - ttl_hours * 3600)
+    rows = conn.execute('''
+        SELECT s.title FROM TitleResolutions r
+        JOIN ChartShows s ON s.show_id = r.show_id
+        JOIN Podcasts p ON p.podcast_id = r.feed_id
+        WHERE s.title IS NOT NULL AND COALESCE(p.refreshed_at, p.last_update_time, 0) >= ?
+        UNION
+        SELECT chart_title FROM Podcasts
+        WHERE chart_title IS NOT NULL
+          AND COALESCE(refreshed_at, last_update_time, 0) >= ?
+    ''', (cutoff, cutoff))
+    return {row[0] for row in rows}
+
+def start_or_resume_run(conn, mode, refresh_mode, total_titles, resume=RESUME_RUNS, max_age_hours=RESUME_MAX_AGE_HOURS):
+    """Returns (run_id, finished_titles) for this run.
+
+       With `resume`, the newest run still marked 'running' that started within
+       `max_age_hours` is picked up again, and finished_titles holds the titles it
+       already completed (status 'done' or 'unresolved'). Otherwise a new run is
+       started and finished_titles is empty."""
+    now = int(time.time())
+    if resume:
+        row = conn.execute('''
+            SELECT run_id, started_at FROM EnrichmentRuns
+            WHERE status = 'running' AND started_at >= ?
+            ORDER BY started_at DESC, run_id DESC LIMIT 1
+        ''', (now - int(max_age_hours * 3600),)).fetchone()
+        if row:
+            run_id, started_at = row
+            finished = {title for (title,) in conn.execute('''
+                SELECT chart_title FROM EnrichmentProgress
+                WHERE run_id = ? AND stage = ? AND status IN ('done', 'unresolved')
+            ''', (run_id, ENRICH_STAGE))}
+            print(f"Resuming interrupted run {run_id} (started {(now - started_at) / 60:.0f} min ago): {len(finished)} titles already finished.")
+            return run_id, finished
+    with conn:
+        # Older unfinished runs are superseded by this one.
+        conn.execute("UPDATE EnrichmentRuns SET status = 'abandoned' WHERE status = 'running'")
+        cursor = conn.execute(
+            "INSERT INTO EnrichmentRuns (started_at, status, mode, refresh_mode, total_titles) VALUES (?, 'running', ?, ?, ?)",
+            (now, mode, refresh_mode, total_titles),
+        )
+    print(f"Started enrichment run {cursor.lastrowid}.")
+    return cursor.lastrowid, set()
+
+def finish_run(conn, run_id):
+    """Marks a run completed so the next run starts fresh."""
+    with conn:
+        conn.execute(
+            "UPDATE EnrichmentRuns SET status = 'completed', finished_at = ? WHERE run_id = ?",
+            (int(time.time()), run_id),
+        )
+
+# --- Batched Writes ---
+
+class BatchWriter:
+    """
+    Buffers enrichment writes and flushes them with executemany in one transaction.
+
+    A flush happens once `batch_size` titles are queued or `flush_interval` seconds
+    have passed since the last one, so a crash loses at most one batch. Statements
+    are grouped by SQL text; each statement's rows keep their queue order. The
+    enrichment statements touch different tables (or different keys), so grouping
+    does not change the result.
+    """
+
+    def __init__(self, conn, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_SECONDS):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._pending_items = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, sql, params):
+        self._pending.setdefault(sql, []).append(params)
+
+    def add_many(self, sql, seq_of_params):
+        self._pending.setdefault(sql, []).extend(seq_of_params)
+
+    def item_done(self):
+        """Marks one title's writes as queued and flushes if the batch is due."""
+        self._pending_items += 1
+        if (self._pending_items >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Writes everything queued in a single transaction.
+
+        A failed batch is rolled back and the error re-raised, so the run is not
+        marked completed: its titles have no checkpoint rows and the next run
+        resumes them."""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            self._pending_items = 0
+            return
+        pending, items = self._pending, self._pending_items
+        self._pending, self._pending_items = {}, 0
+        rows = sum(len(params) for params in pending.values())
+        try:
+            with self.conn: # BEGIN ... COMMIT, or ROLLBACK on error
+                for sql, params in pending.items():
+                    self.conn.executemany(sql, params)
+            print(f"### SUCCESS: Flushed batch of {items} titles ({rows} rows) to DB ###")
+        except sqlite3.Error as e:
+            print(f"!!! DATABASE ERROR flushing batch of {items} titles ({rows} rows): {e} !!!")
+            raise
+
+# --- Per-Title Enrichment ---
+
+def fetch_podcast_record(item, cached_resolution=None):
+    """Runs the search -> details -> episodes chain for one chart title, with every
+       request in the chain bounded by TITLE_DEADLINE_SECONDS.
+       See _fetch_podcast_record for the resolution order and return value."""
+    with request_deadline(TITLE_DEADLINE_SECONDS):
+        return _fetch_podcast_record(item, cached_resolution)
+
+def _fetch_podcast_record(item, cached_resolution=None):
+    """Runs the search -> details -> episodes chain for one chart title.
+
+    Shows already in the identity map are fetched by their known feed id.
+    Apple titles are resolved directly: by the feed URL the batch iTunes lookup
+    found for them (podcasts/byfeedurl), else by id via podcasts/byitunesid.
+    Otherwise, with a cached_resolution (feed_id, match_ratio, matched_endpoint)
+    the search calls are skipped and details are fetched for the known feed.
+    Fuzzy search is only the last resort.
+    Returns (record, resolution): record is a tuple of Podcasts column values ready
+    for insert and resolution a (feed_id, match_ratio, matched_endpoint) tuple.
+    If both searches completed without a good match, returns
+    (None, (None, best_ratio, None)) so the miss can be negative-cached; any other
+    failure returns (None, None).
+    """
+    title = item["title"]
+    itunes_id = item.get("itunes_id")
+    candidate = {}
+    full_details = None
+    resolution = None
+
+    # 1. Resolve: the identity map first, then Apple's id, then a previous
+    #    resolution, otherwise search
+    if item.get("feed_id"):
+        full_details = get_full_podcast_details_by_feed_id(item["feed_id"])
+        if full_details:
+            # Keep how the show was first linked, so the resolution stays prunable.
+            resolution = (full_details.get("id"), item.get("match_ratio"), item.get("link_method"))
+        else:
+            print(f"-> Known Feed ID {item['feed_id']} failed for '{title}', falling back")
+
+    if not full_details and item.get("feed_url"):
+        full_details = get_full_podcast_details_by_feed_url(item["feed_url"])
+        if full_details:
+            resolution = (full_details.get("id"), 1.0, "podcasts/byfeedurl")
+        else:
+            print(f"-> iTunes feed URL lookup failed for '{title}', falling back")
+
+    if not full_details and itunes_id:
+        full_details = get_full_podcast_details_by_itunes_id(itunes_id)
+        if full_details:
+            resolution = (full_details.get("id"), 1.0, "podcasts/byitunesid")
+        else:
+            print(f"-> iTunes ID {itunes_id} lookup failed for '{title}', falling back")
+
+    if not full_details and cached_resolution:
+        cached_feed_id = cached_resolution[0]
+        print(f"--- Resolution cache hit for '{title}': Feed ID {cached_feed_id} ---")
+        full_details = get_full_podcast_details_by_feed_id(cached_feed_id)
+        if full_details:
+            resolution = cached_resolution
+        else:
+            print(f"-> Cached Feed ID {cached_feed_id} failed for '{title}', searching again")
+
+    if not full_details:
+        candidate, match_ratio, matched_endpoint = search_podcast_combined(title)
+        if not candidate:
+            print(f"SKIPPING: No candidate found for '{title}' via search.")
+            if match_ratio is not None:
+                return None, (None, match_ratio, None)
+            return None, None
+
+        # 2. Get Full Details (by Feed ID or URL)
+        candidate_feed_id = candidate.get("id")
+        if candidate_feed_id:
+            full_details = get_full_podcast_details_by_feed_id(candidate_feed_id)
+        else:
+             print(f"WARNING: Candidate for '{title}' found, but missing 'id'. Candidate data: {candidate}")
+
+        if not full_details:
+            feed_url_from_candidate = candidate.get("url") or candidate.get("originalUrl")
+            if feed_url_from_candidate:
+                print(f"-> Feed ID fetch failed or missing, falling back to Feed URL for '{title}'")
+                full_details = get_full_podcast_details_by_feed_url(feed_url_from_candidate)
+            else:
+                print(f"WARNING: Cannot fall back to feed URL for '{title}', URL missing in candidate: {candidate}")
+
+        if not full_details:
+            print(f"--- FAILED: Could not retrieve full details for '{title}' (Candidate ID: {candidate_feed_id}) ---")
+            return None, None
+        resolution = (full_details.get("id"), match_ratio, matched_endpoint)
+
+    # 3. Process Details and Get Latest Episode Info
+    feed_id = full_details.get("id")
+    podcast_title = full_details.get("title")
+    description = full_details.get("description")
+    feed_url = full_details.get("url")
+    original_url = full_details.get("originalUrl")
+    image_url = full_details.get("image") or full_details.get("artwork")
+    episode_count = full_details.get("episodeCount")
+    last_update_time = full_details.get("lastUpdateTime")
+    categories_dict = full_details.get("categories")
+    podcast_guid = full_details.get("podcastGuid")
+
+    if not feed_id:
+        print(f"!!! SKIPPING DB INSERT: 'id' field missing in full_details for '{title}'. Details: {full_details} !!!")
+        return None, None
+
+    # Get latest episode info (duration and title)
+    avg_dur_10, latest_title = get_latest_episode_info(feed_id)
+
+    # Fallbacks for URLs
+    if not feed_url: feed_url = candidate.get("url")
+    if not original_url: original_url = candidate.get("originalUrl")
+
+    # Categories to JSON
+    categories_json = None
+    if categories_dict and isinstance(categories_dict, dict):
+         try:
+             categories_json = json.dumps(categories_dict)
+         except TypeError:
+             print(f"Warning: Could not serialize categories for feed ID {feed_id}: {categories_dict}")
+             categories_json = "{}"
+    elif isinstance(categories_dict, str):
+         categories_json = categories_dict
+
+    print(f"+++ Prepared record for Feed ID: {feed_id}, Title: '{podcast_title}', Episodes: {episode_count}, AvgDur10: {avg_dur_10}, LatestEp: '{latest_title}' +++")
+
+    record = (
+        feed_id,
+        podcast_title,
+        description,
+        feed_url,
+        image_url,
+        episode_count,
+        avg_dur_10,
+        latest_title,
+        last_update_time,
+        categories_json,
+        podcast_guid,
+        original_url
+    )
+    return record, resolution
+
+PODCAST_UPSERT_SQL = '''
+    INSERT INTO Podcasts
+    (podcast_id, title, description, feed_url, image_url, episode_count, avg_duration_last_10, latest_episode_title, last_update_time, categories, podcast_guid, original_url, chart_title, refreshed_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(podcast_id) DO UPDATE SET
+        title = excluded.title,
+        description = excluded.description,
+        feed_url = excluded.feed_url,
+        image_url = excluded.image_url,
+        episode_count = excluded.episode_count,
+        avg_duration_last_10 = excluded.avg_duration_last_10,
+        latest_episode_title = excluded.latest_episode_title,
+        last_update_time = excluded.last_update_time,
+        categories = excluded.categories,
+        podcast_guid = excluded.podcast_guid,
+        original_url = excluded.original_url,
+        chart_title = excluded.chart_title,
+        refreshed_at = excluded.refreshed_at
+'''
+
+# resolved_at only moves when the resolution itself changes.
+RESOLUTION_UPSERT_SQL = '''
+    INSERT INTO TitleResolutions (show_id, feed_id, match_ratio, matched_endpoint, resolved_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(show_id) DO UPDATE SET
+        feed_id = excluded.feed_id,
+        match_ratio = excluded.match_ratio,
+        matched_endpoint = excluded.matched_endpoint,
+        resolved_at = excluded.resolved_at
+    WHERE feed_id IS NOT excluded.feed_id OR matched_endpoint IS NOT excluded.matched_endpoint
+'''
+
+FAILURE_CLEAR_SQL = "DELETE FROM ResolutionFailures WHERE chart_title = ?"
+
+PROGRESS_UPSERT_SQL = '''
+    INSERT INTO EnrichmentProgress (run_id, chart_title, stage, status, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(run_id, chart_title, stage) DO UPDATE SET
+        status = excluded.status,
+        updated_at = excluded.updated_at
+'''
+
+FAILURE_UPSERT_SQL = '''
+    INSERT INTO ResolutionFailures (chart_title, failure_count, best_ratio, first_failed_at, last_failed_at, next_retry_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(chart_title) DO UPDATE SET
+        failure_count = excluded.failure_count,
+        best_ratio = excluded.best_ratio,
+        last_failed_at = excluded.last_failed_at,
+        next_retry_at = excluded.next_retry_at
+'''
+
+def save_podcast_record(writer, item, record, resolution):
+    """Queues the upsert of one enriched record (as returned by fetch_podcast_record) into
+       Podcasts, stamped with the chart title it came from and the refresh time, plus the
+       resolution of every chart listing (ChartShows row) in the item and its identity links
+       (platform ids only for a direct or high-confidence resolution)."""
+    title = item["title"]
+    now = int(time.time())
+    writer.add(PODCAST_UPSERT_SQL, record + (title, now))
+    show_ids = dict.fromkeys(show_id for _, _, _, show_id in item["chart_shows"])
+    writer.add_many(RESOLUTION_UPSERT_SQL, [(show_id,) + tuple(resolution) + (now,) for show_id in show_ids])
+    writer.add_many(FAILURE_CLEAR_SQL, [(chart_title,) for chart_title in item["titles"]])
+    queue_identity_links(writer, item, record[0], record[10], record[1], resolution[2], resolution[1])
+    print(f"### Queued DB update for Feed ID: {record[0]} ('{title}') ###")
+
+def save_resolution_failure(writer, item, resolution, failures):
+    """Queues a title that searched without a good match and schedules its next retry."""
+    title = item["title"]
+    best_ratio = resolution[1]
+    failure_count = failures.get(title, (0, 0))[0] + 1
+    now = int(time.time())
+    next_retry_at = now + next_retry_delay(failure_count)
+    writer.add(FAILURE_UPSERT_SQL, (title, failure_count, best_ratio, now, now, next_retry_at))
+    print(f"--- Negative-cached '{title}' (failure #{failure_count}, best ratio {best_ratio:.2f}); next retry in {(next_retry_at - now) / 3600:g}h ---")
+
+def save_enrichment_result(writer, item, record, resolution, failures, run_id=None):
+    """Queues whatever fetch_podcast_record produced for one title, plus its checkpoint
+       row for `run_id` (committed in the same transaction); flushes when a batch is due."""
+    if record:
+        save_podcast_record(writer, item, record, resolution)
+        status = "done"
+    elif resolution:
+        save_resolution_failure(writer, item, resolution, failures)
+        status = "unresolved"
+    else:
+        status = "error"
+    if run_id is not None:
+        writer.add(PROGRESS_UPSERT_SQL, (run_id, item["title"], ENRICH_STAGE, status, int(time.time())))
+    writer.item_done()
+
+# --- Enrichment Engines ---
+
+def enrich_titles_serial(writer, items, resolutions, failures, run_id=None):
+    """Original one-title-at-a-time loop, kept as a fallback mode."""
+    for processed_count, item in enumerate(items, start=1):
+        title = item["title"]
+        print(f"\n======= Processing {processed_count}/{len(items)}: '{title}' =======")
+        record, resolution = fetch_podcast_record(item, resolutions.get(title))
+        save_enrichment_result(writer, item, record, resolution, failures, run_id)
+
+async def enrich_titles_async(writer, items, resolutions, failures, concurrency=ENRICH_CONCURRENCY, run_id=None):
+    """Runs the per-title chain for up to `concurrency` titles at once.
+
+    The blocking request helpers run on a dedicated thread pool. Records are
+    written in the same order as `items`, on this thread, so the resulting
+    table matches what the serial loop would have produced.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="enrich")
+
+    async def enrich_one(index, item):
+        title = item["title"]
+        async with semaphore:
+            print(f"\n======= Processing {index}/{len(items)}: '{title}' =======")
+            try:
+                return await loop.run_in_executor(executor, fetch_podcast_record, item, resolutions.get(title))
+            except Exception as e:
+                print(f"!!! Unexpected error while enriching '{title}': {e} !!!")
+                return None, None
+
+    tasks = [asyncio.create_task(enrich_one(i, item)) for i, item in enumerate(items, start=1)]
+    try:
+        for item, task in zip(items, tasks):
+            record, resolution = await task
+            save_enrichment_result(writer, item, record, resolution, failures, run_id)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Drop queued titles, then wait for the in-flight ones (each bounded by
+        # TITLE_DEADLINE_SECONDS), so no worker is still calling the API or
+        # writing the cache and archive once the caller closes up.
+        executor.shutdown(wait=True, cancel_futures=True)
+
 # --- Main Database Update Function ---
 
-def update_all_podcast_details():
+def update_all_podcast_details(mode=ENRICH_MODE, concurrency=ENRICH_CONCURRENCY,
+                               refresh_mode=REFRESH_MODE, ttl_hours=REFRESH_TTL_HOURS,
+                               retry_failed=FORCE_RETRY_FAILED, resume=RESUME_RUNS,
+                               conn=None, db_path=DATABASE_NAME):
     """Fetches podcast titles, searches for them, gets full details
-       (including avg duration & title of last episode), and updates the DB."""
-    conn = None
+       (including avg duration & title of last episode), and updates the DB.
+
+       mode is "async" (many titles at once, bounded by `concurrency`) or
+       "serial" (the original one-by-one loop). refresh_mode "incremental"
+       skips titles refreshed within `ttl_hours`; "full" re-fetches them all.
+       Titles that previously failed to resolve are skipped until their retry is
+       due, unless retry_failed is set. With `resume`, an interrupted run is
+       continued and the titles it already finished are skipped.
+
+       Pass `conn` to reuse an open connection (it is left open); otherwise
+       `db_path` is opened and closed here. Database errors (including a failed
+       batch write) are re-raised after the connection is cleaned up."""
+    if mode not in ENRICH_MODES:
+        raise ValueError(f"Unknown enrichment mode '{mode}', expected one of {ENRICH_MODES}")
+    if refresh_mode not in REFRESH_MODES:
+        raise ValueError(f"Unknown refresh mode '{refresh_mode}', expected one of {REFRESH_MODES}")
+
+    if api_keys_missing():
+        print("Error: Podcast Index API keys not found in environment variables.")
+        return
+
+    own_conn = conn is None
     try:
-        conn = sqlite3.connect('podcasts.db')
-        cursor = conn.cursor()
-
-        # Drop and recreate the Podcasts table with the new columns.
-        cursor.execute("DROP TABLE IF EXISTS Podcasts")
-        # *** ADDED latest_episode_title column ***
-        cursor.execute('''
-            CREATE TABLE Podcasts (
-                podcast_id INTEGER PRIMARY KEY,
-                title TEXT,
-                description TEXT,
-                feed_url TEXT,
-                image_url TEXT,
-                episode_count INTEGER,
-                avg_duration_last_10 INTEGER,
-                latest_episode_title TEXT, -- Added column for latest episode title
-                last_update_time INTEGER,
-                categories TEXT,
-                podcast_guid TEXT,
-                original_url TEXT
-            )
-        ''')
-        conn.commit()
-
-        # Get distinct podcast titles from Top100Lists.
+        if own_conn:
+            conn = sqlite3.connect(db_path)
+
+        # Existing rows are kept; each enriched title is upserted. Tables, the
+        # ChartPodcasts view and indexes come from the versioned migrations.
+        ensure_schema(conn)
+
+        # One item per show: chart listings whose Apple/Spotify id is in the
+        # identity map are grouped by canonical show, the rest by title. Links
+        # from weak title matches are dropped first, so those shows resolve again.
         try:
-            cursor.execute("SELECT DISTINCT title FROM Top100Lists")
-            titles = [row[0] for row in cursor.fetchall()]
+            with conn:
+                pruned = prune_identity_links(conn)
+            if pruned:
+                print(f"Identity map: pruned {pruned} platform links below ratio {IDENTITY_LINK_MIN_RATIO:g} or of unknown origin.")
+            items = load_enrichment_items(conn)
         except sqlite3.OperationalError as e:
-            print(f"Error accessing Top100Lists table: {e}")
-            print("Please ensure the 'Top100Lists' table exists and has a 'title' column.")
+            print(f"Error accessing the chart tables: {e}")
+            print("Please ensure the chart scrapers have run against this database.")
             return
 
-        print(f"\nFound {len(titles)} unique podcast titles from Top100Lists.")
-        processed_count = 0
-
-        for title in titles:
-            processed_count += 1
-            print(f"\n======= Processing {processed_count}/{len(titles)}: '{title}' =======")
-
-            # 1. Search
-            candidate = search_podcast_combined(title)
-            if not candidate:
-                print(f"SKIPPING: No candidate found for '{title}' via search.")
-                time.sleep(1)
-                continue
-
-            # 2. Get Full Details (by Feed ID or URL)
-            candidate_feed_id = candidate.get("id")
-            full_details = None
-            if candidate_feed_id:
-                full_details = get_full_podcast_details_by_feed_id(candidate_feed_id)
-            else:
-                 print(f"WARNING: Candidate for '{title}' found, but missing 'id'. Candidate data: {candidate}")
-
-            if not full_details:
-                feed_url_from_candidate = candidate.get("url") or candidate.get("originalUrl")
-                if feed_url_from_candidate:
-                    print(f"-> Feed ID fetch failed or missing, falling back to Feed URL for '{title}'")
-                    full_details = get_full_podcast_details_by_feed_url(feed_url_from_candidate)
-                else:
-                    print(f"WARNING: Cannot fall back to feed URL for '{title}', URL missing in candidate: {candidate}")
-
-            # 3. Process Details and Get Latest Episode Info
-            if full_details:
-                feed_id = full_details.get("id")
-                podcast_title = full_details.get("title")
-                description = full_details.get("description")
-                feed_url = full_details.get("url")
-                original_url = full_details.get("originalUrl")
-                image_url = full_details.get("image") or full_details.get("artwork")
-                episode_count = full_details.get("episodeCount")
-                last_update_time = full_details.get("lastUpdateTime")
-                categories_dict = full_details.get("categories")
-                podcast_guid = full_details.get("podcastGuid")
-
-                # *** Get latest episode info (duration and title) ***
-                avg_dur_10 = None
-                latest_title = None
-                if feed_id:
-                    # Call the RENAMED function and unpack the results
-                    avg_dur_10, latest_title = get_latest_episode_info(feed_id)
-                    # time.sleep(0.2) # Optional small delay
-                else:
-                     print(f"WARNING: Cannot get latest episode info for '{title}', Feed ID missing in full_details.")
-
-                # Fallbacks for URLs
-                if not feed_url: feed_url = candidate.get("url")
-                if not original_url: original_url = candidate.get("originalUrl")
-
-                # Categories to JSON
-                categories_json = None
-                if categories_dict and isinstance(categories_dict, dict):
-                     try:
-                         categories_json = json.dumps(categories_dict)
-                     except TypeError:
-                         print(f"Warning: Could not serialize categories for feed ID {feed_id}: {categories_dict}")
-                         categories_json = "{}"
-                elif isinstance(categories_dict, str):
-                     categories_json = categories_dict
-
-                print(f"+++ Preparing DB insert for Feed ID: {feed_id}, Title: '{podcast_title}', Episodes: {episode_count}, AvgDur10: {avg_dur_10}, LatestEp: '{latest_title}' +++")
-
-                if feed_id:
-                    try:
-                        # *** Update INSERT statement with new column and value ***
-                        cursor.execute('''
-                            INSERT OR REPLACE INTO Podcasts
-                            (podcast_id, title, description, feed_url, image_url, episode_count, avg_duration_last_10, latest_episode_title, last_update_time, categories, podcast_guid, original_url)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            feed_id,
-                            podcast_title,
-                            description,
-                            feed_url,
-                            image_url,
-                            episode_count,
-                            avg_dur_10,
-                            latest_title, # Add the latest title here
-                            last_update_time,
-                            categories_json,
-                            podcast_guid,
-                            original_url
-                        ))
-                        conn.commit()
-                        print(f"### SUCCESS: Updated details in DB for Feed ID: {feed_id} ('{title}') ###")
-                    except sqlite3.Error as e:
-                        print(f"!!! DATABASE ERROR for Feed ID {feed_id} ('{title}'): {e} !!!")
-                        if conn: conn.rollback() # Check if conn exists before rollback
-                else:
-                    print(f"!!! SKIPPING DB INSERT: 'id' field missing in full_details for '{title}'. Details: {full_details} !!!")
-
+        known_feeds = sum(1 for item in items if item["feed_id"])
+        print(f"\nFound {len(items)} unique podcasts in the charts ({known_feeds} with a known feed, title search skipped).")
+        run_id, finished_titles = start_or_resume_run(conn, mode, refresh_mode, len(items), resume)
+        if finished_titles:
+            items = [item for item in items if item["title"] not in finished_titles]
+            print(f"Checkpoint: skipping {len(finished_titles)} titles already finished in run {run_id}.")
+        if refresh_mode == "incremental":
+            fresh_titles = get_fresh_titles(conn, ttl_hours)
+            items = [item for item in items if item["title"] not in fresh_titles]
+            print(f"Incremental refresh: {len(items)} titles stale or new (TTL {ttl_hours:g}h), {len(fresh_titles)} fresh titles kept.")
+        failures = load_resolution_failures(conn)
+        if retry_failed:
+            print(f"Negative cache: forcing a retry of {len(failures)} previously failed titles.")
+        else:
+            now = int(time.time())
+            not_due = {title for title, (_, next_retry_at) in failures.items() if next_retry_at > now}
+            items = [item for item in items if item["title"] not in not_due]
+            print(f"Negative cache: skipping {len(not_due)} unresolved titles not yet due for retry.")
+        resolutions = load_title_resolutions(conn)
+        cache_hits = sum(1 for item in items if item["title"] in resolutions)
+        print(f"Resolution cache: {cache_hits}/{len(items)} titles already resolved (search skipped).")
+
+        # Batch-resolve Apple ids to feed URLs before the per-title chain runs
+        # (shows with a known feed do not need one).
+        itunes_feed_urls = lookup_itunes_feed_urls(item["itunes_id"] for item in items if not item["feed_id"])
+        for item in items:
+            item["feed_url"] = itunes_feed_urls.get(str(item["itunes_id"])) if item["itunes_id"] else None
+        itunes_titles = sum(1 for item in items if item["itunes_id"])
+        print(f"Direct iTunes resolution available for {itunes_titles}/{len(items)} titles ({len(itunes_feed_urls)} with feed URLs).")
+        print(f"Enrichment mode: {mode} (concurrency: {concurrency if mode == 'async' else 1})")
+
+        writer = BatchWriter(conn)
+        try:
+            if mode == "async":
+                asyncio.run(enrich_titles_async(writer, items, resolutions, failures, concurrency, run_id))
             else:
-                print(f"--- FAILED: Could not retrieve full details for '{title}' (Candidate ID: {candidate_feed_id}) ---")
-
-            # Main delay between processing different podcast titles
-            time.sleep(1.5) # Keep the main delay
+                enrich_titles_serial(writer, items, resolutions, failures, run_id)
+            writer.flush()
+            finish_run(conn, run_id)
+            print(f"Enrichment run {run_id} completed.")
+        finally:
+            writer.flush()
+            cache = get_response_cache()
+            if cache:
+                print(f"HTTP cache: {cache.stats()}")
+            replay = get_replay_adapter()
+            if replay:
+                print(f"Replay: {replay.stats()}")
 
     except sqlite3.Error as e:
+        # Re-raised so callers (pipeline.py, the workflow) see the run failed
+        # and do not publish it; the run itself stays resumable.
         print(f"An error occurred with the database connection or operation: {e}")
+        raise
     finally:
-        if conn:
+        if own_conn and conn:
             conn.close()
             print("\n======= Database connection closed. =======")
 
@@ -401,4 +870,7 @@ def update_all_podcast_details():
 # --- Main Execution Block ---
 
 if __name__ == "__main__":
-    update_all_podcast_details()
\ No newline at end of file
+    if api_keys_missing():
+        print("Error: Podcast Index API keys not found in environment variables.")
+        exit(1) # Exit if keys are missing
+    update_all_podcast_details()